@@ -0,0 +1,71 @@
+"""
+Throughput benchmark and uniqueness stress test for the booking reference ID generator.
+
+Usage:
+    python benchmarks/reference_ids.py [--count 200000] [--workers 8] [--threads 4]
+
+The stress test runs one process per worker id (simulating orchestrator instances),
+each with several threads sharing a generator, and checks that no ID repeats and
+that IDs from a single generator are strictly increasing.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "booking-orchestrator"))
+sys.path.insert(0, os.path.join(ROOT, "services"))
+
+from app.reference_ids import ReferenceIdGenerator
+
+
+def benchmark(count):
+    gen = ReferenceIdGenerator(worker_id=1)
+    start = time.perf_counter()
+    for _ in range(count):
+        gen.next_id()
+    elapsed = time.perf_counter() - start
+    print(f"Single thread: {count} ids in {elapsed:.3f}s ({count / elapsed:,.0f} ids/s)")
+    print(f"Sample: {gen.next_id()}")
+
+
+def generate_for_worker(args):
+    worker_id, count, threads = args
+    gen = ReferenceIdGenerator(worker_id=worker_id)
+    per_thread = count // threads
+
+    def run(_):
+        ids = [gen.next_id() for _ in range(per_thread)]
+        # Per-thread calls are ordered, so IDs must be strictly increasing
+        assert all(a < b for a, b in zip(ids, ids[1:])), "IDs not time-ordered"
+        return ids
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return [i for ids in pool.map(run, range(threads)) for i in ids]
+
+
+def stress(count, workers, threads):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(generate_for_worker, [(w, count, threads) for w in range(workers)]))
+    elapsed = time.perf_counter() - start
+
+    all_ids = [i for ids in results for i in ids]
+    unique = len(set(all_ids))
+    print(f"Stress: {workers} workers x {threads} threads, {len(all_ids)} ids in {elapsed:.3f}s")
+    print(f"Duplicates: {len(all_ids) - unique}")
+    if unique != len(all_ids):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200000, help="ids per worker")
+    parser.add_argument("--workers", type=int, default=8, help="simulated orchestrator instances")
+    parser.add_argument("--threads", type=int, default=4, help="threads per instance")
+    args = parser.parse_args()
+
+    benchmark(args.count)
+    stress(args.count, args.workers, args.threads)
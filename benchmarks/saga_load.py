@@ -0,0 +1,137 @@
+"""
+End-to-end load test of the booking saga against run_local.py.
+
+Submits bookings at a fixed rate from many simulated clients, polls each one until
+it reaches a terminal state and reports saga throughput and completion latency
+percentiles. Combine with fault injection to see the saga under broker-like
+conditions:
+
+    python run_local.py --faults benchmarks/broker_faults.json
+    python benchmarks/saga_load.py --rate 20 --duration 30
+
+Usage:
+    python benchmarks/saga_load.py [--url http://localhost:8080] [--rate 20] [--duration 30]
+                                   [--timeout 60] [--clients 1000]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+
+TERMINAL_STATES = {"booking.completed", "booking.failed", "booking.quota.released"}
+FAILED_STATES = {"booking.validation.failed", "booking.pricing.failed", "booking.quota.failed"}
+SERVICE_PORTS = {"api-gateway": 8080, "validation-service": 8081, "pricing-service": 8082,
+                 "quota-manager": 8083, "booking-orchestrator": 8084}
+
+
+def random_booking():
+    gender = random.choice(["male", "female"])
+    services = [1, 4, 5, 8] + ([2, 3] if gender == "female" else [6, 7])
+    return {
+        "user_name": f"Load Test {random.randint(1, 10**6)}",
+        "user_gender": gender,
+        "user_dob": f"{random.randint(1950, 2005)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+        "service_ids": random.sample(services, random.randint(1, 3))
+    }
+
+
+async def run_booking(client, args, results):
+    try:
+        await poll_booking(client, args, results)
+    except Exception as e:
+        # An overloaded gateway is a result too, not a reason to abort the run
+        results["outcomes"][f"error {type(e).__name__}"] += 1
+
+
+async def poll_booking(client, args, results):
+    # Distinct client addresses so the gateway's per-client rate limit does not apply
+    n = random.randrange(args.clients)
+    headers = {"X-Forwarded-For": f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"}
+    start = time.perf_counter()
+    resp = await client.post(f"{args.url}/api/v1/bookings", json=random_booking(), headers=headers)
+    if resp.status_code != 200:
+        results["outcomes"][f"http {resp.status_code}"] += 1
+        return
+    transaction_id = resp.json()["transaction_id"]
+
+    last_seq, etag, state = 0, None, None
+    deadline = start + args.timeout
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(args.poll_interval)
+        poll_headers = {"If-None-Match": etag} if etag else {}
+        resp = await client.get(f"{args.url}/api/v1/bookings/{transaction_id}/status",
+                                params={"since": last_seq}, headers=poll_headers)
+        if resp.status_code == 304:
+            continue
+        status = resp.json()
+        etag = resp.headers.get("etag")
+        last_seq = status.get("last_seq", last_seq)
+        state = status.get("current_state")
+        if state in TERMINAL_STATES or state in FAILED_STATES:
+            results["latencies"].append(time.perf_counter() - start)
+            results["outcomes"][state] += 1
+            return
+    results["outcomes"][f"timeout ({state})"] += 1
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def injected_faults(client):
+    faults = {}
+    for name, port in SERVICE_PORTS.items():
+        try:
+            resp = await client.get(f"http://127.0.0.1:{port}/delivery")
+            stats = resp.json()
+            faults[name] = (stats.get("injected_faults"), stats.get("dead_letters"))
+        except Exception:
+            pass
+    return faults
+
+
+async def main(args):
+    import httpx
+
+    results = {"latencies": [], "outcomes": Counter()}
+    limits = httpx.Limits(max_connections=500, max_keepalive_connections=100)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        tasks = []
+        start = time.perf_counter()
+        total = int(args.rate * args.duration)
+        for i in range(total):
+            # Open-loop arrivals at a fixed rate, independent of response times
+            await asyncio.sleep(max(0.0, start + i / args.rate - time.perf_counter()))
+            tasks.append(asyncio.create_task(run_booking(client, args, results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        faults = await injected_faults(client)
+
+    latencies = results["latencies"]
+    print(f"Submitted {total} bookings at {args.rate}/s, finished in {elapsed:.1f}s")
+    print(f"Saga throughput: {len(latencies) / elapsed:.1f} terminal/s")
+    if latencies:
+        print("Completion latency ms: "
+              f"mean {statistics.mean(latencies) * 1000:.0f}  p50 {percentile(latencies, 0.5) * 1000:.0f}  "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f}  p99 {percentile(latencies, 0.99) * 1000:.0f}  "
+              f"max {max(latencies) * 1000:.0f}")
+    print("Outcomes:")
+    for outcome, count in results["outcomes"].most_common():
+        print(f"  {outcome:<32}{count:>8}")
+    print("Injected faults / dead letters per service:")
+    for name, (injected, dead_letters) in faults.items():
+        print(f"  {name:<22}{injected}  dead letters: {dead_letters}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--rate", type=float, default=20, help="bookings per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of arrivals")
+    parser.add_argument("--timeout", type=float, default=60, help="per-booking deadline in seconds")
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--clients", type=int, default=1000, help="simulated client addresses")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+"""
+Cold start benchmark for the five services.
+
+For each service it measures, over several fresh processes:
+  - import time of app.main
+  - time-to-first-request: from spawning uvicorn until GET /health answers
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--project-id local-project] [--importtime]
+
+--project-id other than local-project exercises the production code paths
+(Pub/Sub warmup starts in the background and must not delay the first request).
+--importtime prints the slowest modules imported by each service (python -X importtime).
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ["api-gateway", "validation-service", "pricing-service", "quota-manager", "booking-orchestrator"]
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def service_env(project_id):
+    env = os.environ.copy()
+    env["PROJECT_ID"] = project_id
+    env["TOPIC_ID"] = "booking-events"
+    env["PYTHONPATH"] = os.path.join(ROOT, "services")
+    env.pop("SHARD_SELF", None)
+    return env
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_time(cwd, env):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_request_time(cwd, env, timeout=60):
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except Exception:
+                time.sleep(0.01)
+        raise RuntimeError("service did not answer /health in time")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def slowest_imports(cwd, env, top=10):
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self_us |  cumulative_us | module"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def interpreter_time():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--project-id", default="local-project")
+    parser.add_argument("--importtime", action="store_true")
+    args = parser.parse_args()
+
+    env = service_env(args.project_id)
+    baseline = statistics.median(interpreter_time() for _ in range(args.runs))
+    print(f"Interpreter start (python -c pass): {baseline * 1000:.0f} ms")
+    print(f"{'service':<22}{'import ms':>12}{'first request ms':>20}")
+
+    for name in SERVICES:
+        cwd = os.path.join(ROOT, "services", name)
+        imports = [import_time(cwd, env) for _ in range(args.runs)]
+        firsts = [first_request_time(cwd, env) for _ in range(args.runs)]
+        print(f"{name:<22}{statistics.median(imports) * 1000:>12.0f}{statistics.median(firsts) * 1000:>20.0f}")
+
+        if args.importtime:
+            for cumulative_us, module in slowest_imports(cwd, env):
+                print(f"    {cumulative_us / 1000:>8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
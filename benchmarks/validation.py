@@ -0,0 +1,96 @@
+"""
+Per-booking cost of validation-service's ValidationEngine against the previous
+implementation (catalog dict and a ServiceObj per service rebuilt for every
+booking, gender checked in a Python loop).
+
+Usage:
+    python benchmarks/validation.py [--count 200000] [--invalid 0.2]
+
+Bookings are generated up front with a share of invalid ones (wrong gender, unknown
+or duplicate ids) and both implementations validate the same list.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "services", "validation-service"))
+sys.path.insert(0, os.path.join(ROOT, "services"))
+
+from app.validation_engine import ValidationEngine, SERVICES
+
+
+async def legacy_get_services_by_ids(service_ids):
+    all_services = {s['id']: dict(s) for s in SERVICES}
+
+    class ServiceObj:
+        def __init__(self, d):
+            self.__dict__ = d
+    return [ServiceObj(all_services[sid]) for sid in service_ids if sid in all_services]
+
+
+async def legacy_validate(data):
+    errors = []
+    if not data.get('user_name'):
+        errors.append("Name required")
+    if data.get('user_gender') not in ['male', 'female']:
+        errors.append("Invalid gender")
+    services = await legacy_get_services_by_ids(data['service_ids'])
+    user_gender = data['user_gender']
+    for svc in services:
+        if svc.gender not in [user_gender, 'both']:
+            errors.append(f"Service '{svc.name}' not available for {user_gender}")
+    return errors
+
+
+def make_bookings(count, invalid_share):
+    ids = [s['id'] for s in SERVICES]
+    bookings = []
+    for _ in range(count):
+        gender = random.choice(["male", "female"])
+        allowed = [s['id'] for s in SERVICES if s['gender'] in (gender, 'both')]
+        service_ids = random.sample(allowed, random.randint(1, 4))
+        if random.random() < invalid_share:
+            service_ids.append(random.choice([random.choice(ids), 99, service_ids[0]]))
+        bookings.append({"user_name": "Bench", "user_gender": gender, "user_dob": "1990-01-01",
+                         "service_ids": service_ids})
+    return bookings
+
+
+async def run_legacy(bookings):
+    return [await legacy_validate(b) for b in bookings]
+
+
+def report(name, elapsed, count, invalid):
+    print(f"{name:<10}{elapsed * 1e9 / count:>10.0f} ns/booking{count / elapsed:>14,.0f} bookings/s"
+          f"{invalid:>10} invalid")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--invalid", type=float, default=0.2, help="share of invalid bookings")
+    args = parser.parse_args()
+
+    random.seed(1)
+    bookings = make_bookings(args.count, args.invalid)
+
+    start = time.perf_counter()
+    legacy = asyncio.run(run_legacy(bookings))
+    report("legacy", time.perf_counter() - start, args.count, sum(1 for e in legacy if e))
+
+    engine = ValidationEngine()
+    start = time.perf_counter()
+    compiled = [engine.validate(b) for b in bookings]
+    report("compiled", time.perf_counter() - start, args.count, sum(1 for e in compiled if e))
+
+    # The engine also catches unknown and duplicate ids, which the old code let through
+    missed = sum(1 for old, new in zip(legacy, compiled) if new and not old)
+    print(f"Invalid bookings the previous implementation accepted: {missed}")
+
+
+if __name__ == "__main__":
+    main()
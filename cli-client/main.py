@@ -1,6 +1,12 @@
+import argparse
 import asyncio
+import csv
 import os
+import re
 import sys
+import time
+import uuid
+from collections import Counter
 from rich.console import Console
 from rich.live import Live
 from rich.panel import Panel
@@ -11,36 +17,59 @@ console = Console()
 
 API_URL = os.getenv("API_URL", "http://localhost:8080/api/v1")
 
-async def get_services():
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(f"{API_URL}/services")
-            resp.raise_for_status()
-            return resp.json()["services"]
-        except Exception as e:
-            console.print(f"[bold red]Error fetching services: {e}[/bold red]")
-            return []
-
-async def create_booking(data):
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.post(f"{API_URL}/bookings", json=data)
-            resp.raise_for_status()
-            return resp.json()["transaction_id"]
-        except Exception as e:
-            console.print(f"[bold red]Error creating booking: {e}[/bold red]")
-            sys.exit(1)
-
-async def get_status(transaction_id):
-    async with httpx.AsyncClient() as client:
+async def get_services(client):
+    try:
+        resp = await client.get(f"{API_URL}/services")
+        resp.raise_for_status()
+        return resp.json()["services"]
+    except Exception as e:
+        console.print(f"[bold red]Error fetching services: {e}[/bold red]")
+        return []
+
+async def submit_booking(client, data, key=None, attempts=3):
+    """
+    POST a booking and return its transaction_id. Transport errors, 429 and 5xx are
+    retried with the same Idempotency-Key, so a booking that went through despite a
+    timeout is not made twice.
+    """
+    headers = {"Idempotency-Key": key or str(uuid.uuid4())}
+    for attempt in range(attempts):
+        last = attempt + 1 == attempts
         try:
-            resp = await client.get(f"{API_URL}/bookings/{transaction_id}/status")
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            return {"current_state": "unknown", "events": [], "error": str(e)}
+            resp = await client.post(f"{API_URL}/bookings", json=data, headers=headers)
+        except httpx.TransportError:
+            if last:
+                raise
+            await asyncio.sleep(2 ** attempt)
+            continue
+        if (resp.status_code == 429 or resp.status_code >= 500) and not last:
+            await asyncio.sleep(float(resp.headers.get("retry-after", 2 ** attempt)))
+            continue
+        resp.raise_for_status()
+        return resp.json()["transaction_id"]
 
-async def get_booking(transaction_id):
+async def create_booking(client, data):
+    try:
+        return await submit_booking(client, data)
+    except Exception as e:
+        console.print(f"[bold red]Error creating booking: {e}[/bold red]")
+        sys.exit(1)
+
+async def get_status(client, transaction_id, since=0, etag=None):
+    """Returns the status, or None when unchanged since the response that carried `etag`."""
+    headers = {"If-None-Match": etag} if etag else {}
+    try:
+        resp = await client.get(f"{API_URL}/bookings/{transaction_id}/status", params={"since": since}, headers=headers)
+        if resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        status = resp.json()
+        status["etag"] = resp.headers.get("etag")
+        return status
+    except Exception as e:
+        return {"current_state": "unknown", "events": [], "last_seq": since, "error": str(e)}
+
+async def get_booking(client, transaction_id):
     # In a real app this might be a separate endpoint or part of status
     # For now utilizing status endpoint data or assuming an endpoint exists if confirmed
     # Since spec didn't strictly define GET /bookings/{id}, we might need to rely on status.
@@ -48,9 +77,14 @@ async def get_booking(transaction_id):
     # I will assume `get_status` returns enough info or I'll just use status for now.
     # Actually, let's mock the "booking details" fetch by reusing status info or assume
     # there is an endpoint. The API Gateway I wrote only has `get_status`, so I will just return status data.
-    return await get_status(transaction_id)
+    return await get_status(client, transaction_id)
 
 
+TERMINAL_STATES = {
+    'booking.completed', 'booking.quota.released', 'booking.failed',
+    'booking.validation.failed', 'booking.pricing.failed', 'booking.quota.failed'
+}
+
 # Event Mapping
 EVENT_MAP = {
     "booking.initiated": ("BOOKING_REQUESTED", "Request received", "cyan"),
@@ -91,12 +125,11 @@ def create_panel(events):
         info = desc
         # Special handling for pricing to show base price and then discount as separate row
         if etype == "booking.priced":
-            data = event.get('data', {}).get('data', {})
-            price = data.get('base_price')
-            final_price = data.get('final_price')
-            eligible = data.get('discount_eligible')
-            pct = data.get('discount_percentage')
-            reason = data.get('discount_reason') or desc
+            price = event.get('base_price')
+            final_price = event.get('final_price')
+            eligible = event.get('discount_eligible')
+            pct = event.get('discount_percentage')
+            reason = event.get('discount_reason') or desc
             
             # Row for base price
             table.add_row(ts, f"[{color}]{display_name}[/{color}]", f"Base price: ₹{price}")
@@ -108,8 +141,7 @@ def create_panel(events):
 
         if etype == "booking.completed":
              # Extract ref and show it
-             data = event.get('data', {})
-             ref = data.get('reference_id')
+             ref = event.get('reference_id')
              if ref:
                  info = f"Reference ID: {ref}"
         
@@ -129,6 +161,11 @@ def create_panel(events):
 from datetime import datetime
 
 async def main():
+    # One pooled client for the whole session
+    async with httpx.AsyncClient() as client:
+        await interactive(client)
+
+async def interactive(client):
     console.print("[bold green]Medical Clinic Booking System[/bold green]")
     
     # Get user input
@@ -138,7 +175,7 @@ async def main():
     
     # Show services
     with console.status("Fetching services..."):
-        services = await get_services()
+        services = await get_services(client)
     
     if not services:
         return
@@ -158,7 +195,7 @@ async def main():
     
     # Create booking
     with console.status("Initiating booking..."):
-        transaction_id = await create_booking({
+        transaction_id = await create_booking(client, {
             "user_name": name,
             "user_gender": gender,
             "user_dob": dob,
@@ -168,35 +205,41 @@ async def main():
     console.print(f"Booking initiated. ID: [bold]{transaction_id}[/bold]")
     
     # Monitor with real-time updates
-    await monitor_booking(transaction_id)
+    await monitor_booking(client, transaction_id)
 
-async def monitor_booking(transaction_id):
+async def monitor_booking(client, transaction_id):
+    # Only fetch events newer than the last seen seq and accumulate locally
+    events = []
+    last_seq = 0
+    etag = None
+    current_state = None
     with Live(console=console, refresh_per_second=4) as live:
         while True:
-            status = await get_status(transaction_id)
-            live.update(create_panel(status['events']))
+            status = await get_status(client, transaction_id, last_seq, etag)
+            if status is not None:
+                events.extend(status.get('events', []))
+                last_seq = status.get('last_seq', last_seq)
+                etag = status.get('etag')
+                current_state = status.get('current_state')
+                live.update(create_panel(events))
             
-            current_state = status.get('current_state')
-            if current_state in ['booking.completed', 'booking.quota.released', 'booking.failed']:
+            if current_state in TERMINAL_STATES:
                 break
             
             await asyncio.sleep(0.5)
     
-    status = await get_status(transaction_id)
+    status = await get_status(client, transaction_id, last_seq)
+    events.extend(status.get('events', []))
     # Show final result logic
     if status.get('current_state') == 'booking.completed':
-        events = status.get('events', [])
         ref_id = "UNKNOWN"
         final_price = "UNKNOWN"
         for e in events:
             if e.get('event_type') == 'booking.completed':
-                event_payload = e.get('data', {})
-                ref_id = event_payload.get('reference_id')
+                ref_id = e.get('reference_id')
             
             if e.get('event_type') == 'booking.priced':
-                event_payload = e.get('data', {})
-                inner_data = event_payload.get('data', {})
-                final_price = inner_data.get('final_price')
+                final_price = e.get('final_price')
                 
         console.print("\n[bold green]Booking Successful ✅[/bold green]")
         console.print(f"Reference ID: {ref_id}")
@@ -204,9 +247,166 @@ async def monitor_booking(transaction_id):
             console.print(f"Final Amount: ₹{final_price}")
     else:
         last_error = "Unknown error"
-        if status.get('events'):
-            last_error = status['events'][-1].get('error', 'Failure')
+        if events:
+            last_error = events[-1].get('error', 'Failure')
         console.print(f"\n[bold red]✗ Failed: {last_error}[/bold red]")
 
+RESULT_FIELDS = ["line", "user_name", "transaction_id", "status", "reference_id", "final_price", "error"]
+
+def parse_row(row):
+    """CSV row (user_name, user_gender, user_dob, service_ids like "1;4") -> booking request."""
+    service_ids = [int(x) for x in re.split(r"[;| ]+", (row.get("service_ids") or "").strip()) if x]
+    return {
+        "user_name": (row.get("user_name") or "").strip(),
+        "user_gender": (row.get("user_gender") or "").strip().lower(),
+        "user_dob": (row.get("user_dob") or "").strip(),
+        "service_ids": service_ids
+    }
+
+def outcome(events, state):
+    """Result columns from the events of a finished saga."""
+    result = {"status": "completed" if state == "booking.completed" else "failed"}
+    for e in events:
+        if e.get("event_type") == "booking.completed":
+            result["reference_id"] = e.get("reference_id")
+        elif e.get("event_type") == "booking.priced":
+            result["final_price"] = e.get("final_price")
+        if e.get("errors"):
+            result["error"] = "; ".join(e["errors"]) if isinstance(e["errors"], list) else str(e["errors"])
+        elif e.get("error") or e.get("reason"):
+            result["error"] = e.get("error") or e.get("reason")
+    if result["status"] == "failed" and not result.get("error"):
+        result["error"] = state
+    return result
+
+class BulkImport:
+    """
+    Streams bookings from a CSV, submits them with at most `concurrency` sagas in
+    flight over one pooled client and follows each until it finishes. Results are
+    appended to the output CSV as sagas finish (the `line` column maps back to the
+    input). Idempotency keys are derived from the file name and row, so re-running
+    an interrupted import does not book rows twice.
+    """
+
+    def __init__(self, path, out, concurrency=10, timeout=120.0, poll_interval=1.0):
+        self.path = path
+        self.out = out
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.active = {}     # line -> row result, while in flight
+        self.recent = []     # last finished row results
+        self.counts = Counter()
+        self.started = time.monotonic()
+
+    def idempotency_key(self, line, row):
+        raw = ",".join(f"{k}={row.get(k)}" for k in sorted(row))
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{os.path.basename(self.path)}:{line}:{raw}"))
+
+    async def follow(self, client, result):
+        """Poll a submitted booking until it reaches a terminal state (or times out)."""
+        events, last_seq, etag, state = [], 0, None, None
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            status = await get_status(client, result["transaction_id"], last_seq, etag)
+            if status is None:
+                continue
+            events.extend(status.get("events", []))
+            last_seq, etag = status.get("last_seq", last_seq), status.get("etag")
+            state = status.get("current_state")
+            result["state"] = EVENT_MAP.get(state, (state,))[0]
+            if state in TERMINAL_STATES:
+                result.update(outcome(events, state))
+                return
+        result.update(status="timeout", error=f"no terminal state after {self.timeout:.0f}s (last: {state})")
+
+    async def worker(self, client, queue, writer, out_file):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line, row = item
+            result = {"line": line, "user_name": row.get("user_name", ""), "state": "SUBMITTING"}
+            self.active[line] = result
+            try:
+                data = parse_row(row)
+                # Repeated 429s are expected while the gateway rate-limits this client
+                result["transaction_id"] = await submit_booking(
+                    client, data, key=self.idempotency_key(line, row), attempts=8
+                )
+                await self.follow(client, result)
+            except Exception as e:
+                result.update(status="error", error=str(e) or type(e).__name__)
+
+            del self.active[line]
+            self.counts[result["status"]] += 1
+            self.recent = (self.recent + [result])[-10:]
+            writer.writerow({k: result.get(k, "") for k in RESULT_FIELDS})
+            out_file.flush()
+
+    def render(self):
+        done = sum(self.counts.values())
+        elapsed = time.monotonic() - self.started
+        title = (f"{done} done ({self.counts['completed']} completed, {self.counts['failed']} failed, "
+                 f"{self.counts['error'] + self.counts['timeout']} errors), {len(self.active)} in flight, "
+                 f"{done / elapsed if elapsed else 0:.1f}/s")
+        table = Table(title=title, expand=True)
+        table.add_column("Line", justify="right", style="cyan")
+        table.add_column("Name")
+        table.add_column("Transaction", style="dim", no_wrap=True)
+        table.add_column("State", style="magenta")
+        table.add_column("Result")
+        for result in list(self.active.values())[:20] + self.recent[::-1]:
+            if result.get("status") == "completed":
+                info = f"[green]{result.get('reference_id')}[/green]"
+            elif result.get("status"):
+                info = f"[red]{result.get('error')}[/red]"
+            else:
+                info = ""
+            table.add_row(str(result["line"]), result["user_name"], (result.get("transaction_id") or "")[:8],
+                          result.get("state", ""), info)
+        return Panel(table, title=f"Importing {self.path}", border_style="blue")
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        queue = asyncio.Queue(maxsize=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            with open(self.out, "w", newline="") as out_file, Live(self.render(), console=console, refresh_per_second=4) as live:
+                writer = csv.DictWriter(out_file, RESULT_FIELDS)
+                writer.writeheader()
+                workers = [asyncio.create_task(self.worker(client, queue, writer, out_file)) for _ in range(self.concurrency)]
+
+                async def refresh():
+                    while True:
+                        live.update(self.render())
+                        await asyncio.sleep(0.25)
+                refresher = asyncio.create_task(refresh())
+
+                # Rows are read as workers free up, so large files are never loaded whole
+                with open(self.path, newline="") as csv_file:
+                    for line, row in enumerate(csv.DictReader(csv_file), start=2):
+                        await queue.put((line, row))
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+                refresher.cancel()
+                live.update(self.render())
+
+        console.print(f"Results written to [bold]{self.out}[/bold]")
+        return self.counts
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Medical Clinic Booking System client")
+    parser.add_argument("--import", dest="import_csv", metavar="CSV",
+                        help="book every row of CSV (user_name,user_gender,user_dob,service_ids)")
+    parser.add_argument("--out", help="results CSV (default: <CSV>.results.csv)")
+    parser.add_argument("--concurrency", type=int, default=10, help="bookings in flight at once")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for each booking")
+    args = parser.parse_args()
+
+    if args.import_csv:
+        out = args.out or os.path.splitext(args.import_csv)[0] + ".results.csv"
+        counts = asyncio.run(BulkImport(args.import_csv, out, args.concurrency, args.timeout).run())
+        sys.exit(0 if counts["completed"] == sum(counts.values()) else 1)
     asyncio.run(main())
@@ -1,37 +1,103 @@
 -- ACQUIRE QUOTA (with locking to prevent races)
+-- Days are provisioned ahead by provision_quota_days, so the hot path is a single
+-- conditional increment that locks the row; p_max only applies to a day that was
+-- not provisioned (created on the fly as before).
+-- With p_hold_seconds the allocation is a hold: it counts against the day like any
+-- other, but is reclaimed by reap_quota_holds unless confirm_quota_hold is called
+-- before it expires. Without it the allocation is permanent.
+DROP FUNCTION IF EXISTS acquire_quota(DATE, INTEGER, UUID);
 CREATE OR REPLACE FUNCTION acquire_quota(
     p_date DATE,
     p_max INTEGER,
-    p_transaction_id UUID
+    p_transaction_id UUID,
+    p_hold_seconds INTEGER DEFAULT NULL
 ) RETURNS BOOLEAN AS $$
 DECLARE
-    v_used INTEGER;
+    v_released BOOLEAN;
 BEGIN
-    -- Insert if not exists
-    INSERT INTO daily_quota (quota_date, max_discounts)
-    VALUES (p_date, p_max)
-    ON CONFLICT (quota_date) DO NOTHING;
-    
-    -- Lock row and check
-    SELECT discounts_used INTO v_used
-    FROM daily_quota
+    -- Idempotent per transaction: a redelivered booking.priced gets the first outcome
+    SELECT released INTO v_released FROM quota_allocations WHERE transaction_id = p_transaction_id;
+    IF FOUND THEN
+        RETURN NOT v_released;
+    END IF;
+
+    -- Lock row, check and increment in one statement
+    UPDATE daily_quota
+    SET discounts_used = discounts_used + 1
     WHERE quota_date = p_date
-    FOR UPDATE;  -- Critical: prevents race conditions
-    
-    IF v_used < p_max THEN
-        -- Increment
-        UPDATE daily_quota 
+      AND discounts_used < max_discounts;
+
+    IF NOT FOUND THEN
+        -- Either full or not provisioned yet. Retry the increment whether or not this
+        -- INSERT created the day: a concurrent acquire may have created it meanwhile.
+        INSERT INTO daily_quota (quota_date, max_discounts)
+        VALUES (p_date, p_max)
+        ON CONFLICT (quota_date) DO NOTHING;
+        UPDATE daily_quota
         SET discounts_used = discounts_used + 1
-        WHERE quota_date = p_date;
-        
-        -- Record allocation
-        INSERT INTO quota_allocations (transaction_id, quota_date)
-        VALUES (p_transaction_id, p_date);
-        
-        RETURN TRUE;
+        WHERE quota_date = p_date
+          AND discounts_used < max_discounts;
+        IF NOT FOUND THEN
+            -- Full, possibly with the slot a concurrent duplicate of this transaction took
+            SELECT released INTO v_released FROM quota_allocations WHERE transaction_id = p_transaction_id;
+            RETURN FOUND AND NOT v_released;
+        END IF;
     END IF;
-    
-    RETURN FALSE;
+
+    -- Record allocation
+    INSERT INTO quota_allocations (transaction_id, quota_date, expires_at)
+    VALUES (p_transaction_id, p_date, NOW() + make_interval(secs => p_hold_seconds))
+    ON CONFLICT (transaction_id) DO NOTHING;
+
+    IF NOT FOUND THEN
+        -- A concurrent duplicate allocated first: give our slot back (the day is still locked)
+        UPDATE daily_quota SET discounts_used = discounts_used - 1 WHERE quota_date = p_date;
+        SELECT released INTO v_released FROM quota_allocations WHERE transaction_id = p_transaction_id;
+        RETURN NOT v_released;
+    END IF;
+
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- PROVISION QUOTA DAYS (quota calendar)
+-- Creates daily_quota rows for p_days days from p_start, with the cap from
+-- quota_calendar when the day has an override and p_default_max otherwise.
+-- Existing rows are left alone. Returns the number of days created.
+CREATE OR REPLACE FUNCTION provision_quota_days(
+    p_start DATE,
+    p_days INTEGER,
+    p_default_max INTEGER
+) RETURNS INTEGER AS $$
+DECLARE
+    v_created INTEGER;
+BEGIN
+    INSERT INTO daily_quota (quota_date, max_discounts)
+    SELECT d::date, COALESCE(c.max_discounts, p_default_max)
+    FROM generate_series(p_start, p_start + (p_days - 1), INTERVAL '1 day') AS d
+    LEFT JOIN quota_calendar c ON c.quota_date = d::date
+    ON CONFLICT (quota_date) DO NOTHING;
+
+    GET DIAGNOSTICS v_created = ROW_COUNT;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- SET QUOTA CAP (holidays, campaigns)
+-- Records the override and applies it to the day if it is already provisioned.
+CREATE OR REPLACE FUNCTION set_quota_cap(
+    p_date DATE,
+    p_max INTEGER,
+    p_note TEXT
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO quota_calendar (quota_date, max_discounts, note)
+    VALUES (p_date, p_max, p_note)
+    ON CONFLICT (quota_date) DO UPDATE SET max_discounts = p_max, note = p_note;
+
+    INSERT INTO daily_quota (quota_date, max_discounts)
+    VALUES (p_date, p_max)
+    ON CONFLICT (quota_date) DO UPDATE SET max_discounts = p_max, updated_at = NOW();
 END;
 $$ LANGUAGE plpgsql;
 
@@ -65,3 +131,140 @@ BEGIN
     RETURN TRUE;
 END;
 $$ LANGUAGE plpgsql;
+
+-- RELEASE QUOTA BATCH (mass compensation)
+-- Releases the unreleased allocations of many transactions in one transaction, with
+-- one decrement per quota day. Rows are locked allocations first, then days, each in
+-- a fixed order, like release_quota, so concurrent batches cannot deadlock.
+-- Returns the ids that were actually released (unknown or already released ids are not).
+CREATE OR REPLACE FUNCTION release_quota_batch(
+    p_transaction_ids UUID[]
+) RETURNS SETOF UUID AS $$
+BEGIN
+    PERFORM 1 FROM quota_allocations
+    WHERE transaction_id = ANY(p_transaction_ids) AND NOT released
+    ORDER BY id
+    FOR UPDATE;
+
+    PERFORM 1 FROM daily_quota
+    WHERE quota_date IN (
+        SELECT quota_date FROM quota_allocations
+        WHERE transaction_id = ANY(p_transaction_ids) AND NOT released
+    )
+    ORDER BY quota_date
+    FOR UPDATE;
+
+    RETURN QUERY
+    WITH freed AS (
+        UPDATE quota_allocations
+        SET released = TRUE, released_at = NOW()
+        WHERE transaction_id = ANY(p_transaction_ids) AND NOT released
+        RETURNING transaction_id, quota_date
+    ), per_day AS (
+        UPDATE daily_quota q
+        SET discounts_used = q.discounts_used - f.freed, updated_at = NOW()
+        FROM (SELECT quota_date, COUNT(*) AS freed FROM freed GROUP BY quota_date) f
+        WHERE q.quota_date = f.quota_date
+    )
+    SELECT freed.transaction_id FROM freed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- CONFIRM QUOTA HOLD (booking created)
+-- Makes a hold permanent; called in the transaction that inserts the booking.
+-- Returns FALSE if the transaction holds no quota any more (the hold expired,
+-- whether or not the reaper has got to it yet, or was released), so the booking
+-- must not get the discount.
+CREATE OR REPLACE FUNCTION confirm_quota_hold(
+    p_transaction_id UUID
+) RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE quota_allocations
+    SET confirmed_at = COALESCE(confirmed_at, NOW()), expires_at = NULL
+    WHERE transaction_id = p_transaction_id AND NOT released
+      AND (expires_at IS NULL OR expires_at > NOW());
+
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+-- REAP QUOTA HOLDS (expired, unconfirmed allocations)
+-- Releases up to p_limit expired holds in one transaction, with one decrement per
+-- quota day. Holds locked by a concurrent confirm or reaper are skipped (picked up
+-- next round); days are then locked in date order as in release_quota_batch.
+-- Returns the transaction ids whose quota was reclaimed.
+CREATE OR REPLACE FUNCTION reap_quota_holds(
+    p_limit INTEGER
+) RETURNS SETOF UUID AS $$
+DECLARE
+    v_ids INTEGER[];
+BEGIN
+    SELECT array_agg(id) INTO v_ids FROM (
+        SELECT id FROM quota_allocations
+        WHERE NOT released AND confirmed_at IS NULL AND expires_at < NOW()
+        ORDER BY id
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ) expired;
+
+    IF v_ids IS NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM 1 FROM daily_quota
+    WHERE quota_date IN (SELECT quota_date FROM quota_allocations WHERE id = ANY(v_ids))
+    ORDER BY quota_date
+    FOR UPDATE;
+
+    RETURN QUERY
+    WITH freed AS (
+        UPDATE quota_allocations
+        SET released = TRUE, released_at = NOW()
+        WHERE id = ANY(v_ids)
+        RETURNING transaction_id, quota_date
+    ), per_day AS (
+        UPDATE daily_quota q
+        SET discounts_used = q.discounts_used - f.freed, updated_at = NOW()
+        FROM (SELECT quota_date, COUNT(*) AS freed FROM freed GROUP BY quota_date) f
+        WHERE q.quota_date = f.quota_date
+    )
+    SELECT freed.transaction_id FROM freed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- RECORD TRANSACTION EVENT
+-- Appends an event to a transaction's stream and makes it the current state. Returns
+-- its seq, or NULL if the saga already recorded an event of this type (a redelivery).
+-- The per-transaction lock is held until the caller commits, so seq n+1 is only
+-- assigned once seq n is committed: a status poll paging with seq > since never
+-- skips an event that commits late, as it could with the global id serial.
+CREATE OR REPLACE FUNCTION record_transaction_event(
+    p_transaction_id UUID,
+    p_event_type VARCHAR,
+    p_event_data JSONB
+) RETURNS INTEGER AS $$
+DECLARE
+    v_seq INTEGER;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtextextended(p_transaction_id::text, 0));
+
+    PERFORM 1 FROM transaction_events
+    WHERE transaction_id = p_transaction_id AND event_type = p_event_type;
+    IF FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT COALESCE(MAX(seq), 0) + 1 INTO v_seq
+    FROM transaction_events WHERE transaction_id = p_transaction_id;
+
+    INSERT INTO transaction_events (transaction_id, seq, event_type, event_data)
+    VALUES (p_transaction_id, v_seq, p_event_type, p_event_data);
+
+    INSERT INTO transaction_state (transaction_id, current_state)
+    VALUES (p_transaction_id, p_event_type)
+    ON CONFLICT (transaction_id)
+    DO UPDATE SET current_state = EXCLUDED.current_state, created_at = NOW();
+
+    RETURN v_seq;
+END;
+$$ LANGUAGE plpgsql;
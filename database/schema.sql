@@ -30,12 +30,30 @@ CREATE TABLE bookings (
     base_price DECIMAL(10, 2),
     discount_applied BOOLEAN,
     discount_percentage DECIMAL(5, 2),
+    discount_reason VARCHAR(255),
     final_price DECIMAL(10, 2),
     booking_status VARCHAR(50),
     reference_id VARCHAR(50) UNIQUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- DAILY ROLLUPS (maintained by the orchestrator, rebuilt by backfill_rollups.py)
+-- service_id 0 aggregates all services of a booking; per-service rows get an even
+-- share of the booking's prices
+CREATE TABLE daily_rollups (
+    day DATE NOT NULL,
+    service_id INTEGER NOT NULL,
+    gender VARCHAR(10) NOT NULL,
+    discount_reason VARCHAR(255) NOT NULL DEFAULT '',
+    bookings INTEGER NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 4) NOT NULL DEFAULT 0,
+    base_revenue NUMERIC(14, 4) NOT NULL DEFAULT 0,
+    discounted_bookings INTEGER NOT NULL DEFAULT 0,
+    quota_released INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (day, service_id, gender, discount_reason)
+);
+
 -- QUOTA TABLE (critical for R2)
 CREATE TABLE daily_quota (
     id SERIAL PRIMARY KEY,
@@ -45,6 +63,13 @@ CREATE TABLE daily_quota (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- QUOTA CALENDAR (per-day cap overrides: holidays, campaigns)
+CREATE TABLE quota_calendar (
+    quota_date DATE PRIMARY KEY,
+    max_discounts INTEGER NOT NULL CHECK (max_discounts >= 0),
+    note VARCHAR(255)
+);
+
 -- QUOTA ALLOCATIONS (for tracking)
 CREATE TABLE quota_allocations (
     id SERIAL PRIMARY KEY,
@@ -52,18 +77,39 @@ CREATE TABLE quota_allocations (
     quota_date DATE NOT NULL,
     allocated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     released BOOLEAN DEFAULT FALSE,
-    released_at TIMESTAMP
+    released_at TIMESTAMP,
+    -- Holds: an allocation not confirmed by expires_at is reclaimed by reap_quota_holds
+    expires_at TIMESTAMP,
+    confirmed_at TIMESTAMP
 );
 
+-- One allocation per transaction (acquire_quota is idempotent); releases look them up by it
+CREATE UNIQUE INDEX idx_quota_allocations_transaction ON quota_allocations (transaction_id);
+-- Open holds by expiry, for the reaper
+CREATE INDEX idx_quota_allocations_holds ON quota_allocations (expires_at)
+    WHERE NOT released AND confirmed_at IS NULL;
+
 -- TRANSACTION EVENTS (audit log)
 CREATE TABLE transaction_events (
     id SERIAL PRIMARY KEY,
     transaction_id UUID,
+    -- Position in the transaction's own stream (1, 2, ...), assigned by
+    -- record_transaction_event; the status `since` cursor pages on it, not on id
+    seq INTEGER NOT NULL,
     event_type VARCHAR(100),
     event_data JSONB,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Per-transaction event streams in order (status reads, rebuild_state.py)
+CREATE INDEX idx_transaction_events_transaction ON transaction_events (transaction_id, created_at, id);
+
+-- Status reads page through a transaction's events by seq
+CREATE UNIQUE INDEX idx_transaction_events_seq ON transaction_events (transaction_id, seq);
+
+-- Each event type happens once per saga; redelivered events are not recorded twice
+CREATE UNIQUE INDEX idx_transaction_events_type ON transaction_events (transaction_id, event_type);
+
 -- TRANSACTION STATE (for orchestrator)
 CREATE TABLE transaction_state (
     transaction_id UUID PRIMARY KEY,
@@ -73,3 +119,51 @@ CREATE TABLE transaction_state (
     error_message TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- REFERENCE WORKER LEASES (worker ids of booking reference generators, one per instance)
+CREATE TABLE reference_worker_leases (
+    worker_id SMALLINT PRIMARY KEY,
+    holder VARCHAR(64) NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- OUTBOX (events committed with the state change, published by the relay)
+CREATE TABLE outbox (
+    id BIGSERIAL PRIMARY KEY,
+    transaction_id UUID,
+    event_type VARCHAR(100) NOT NULL,
+    payload JSONB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    published_at TIMESTAMP,
+    -- Failed publishes back off until next_attempt_at; too many attempts dead-letter the row
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    dead_lettered_at TIMESTAMP
+);
+
+CREATE INDEX idx_outbox_pending ON outbox (id) WHERE published_at IS NULL AND dead_lettered_at IS NULL;
+CREATE INDEX idx_outbox_dead_letters ON outbox (id) WHERE dead_lettered_at IS NOT NULL;
+
+-- DELIVERY DEAD LETTERS (events a service gave up delivering, replayed from its /dead-letters)
+CREATE TABLE delivery_dead_letters (
+    id BIGSERIAL PRIMARY KEY,
+    service VARCHAR(64) NOT NULL,
+    destination TEXT NOT NULL,
+    event JSONB NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL,
+    failed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_delivery_dead_letters_service ON delivery_dead_letters (service, id);
+
+-- IDEMPOTENCY KEYS (client retries of POST /api/v1/bookings get the original transaction)
+CREATE TABLE idempotency_keys (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    request_hash CHAR(64) NOT NULL,
+    transaction_id UUID NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_idempotency_keys_created ON idempotency_keys (created_at);
@@ -45,6 +45,17 @@ resource "google_pubsub_topic" "events" {
   name = "booking-events"
 }
 
+# Events that exhausted their delivery attempts; inspect and replay from the pull subscription
+resource "google_pubsub_topic" "dead_letter" {
+  name = "booking-events-dead-letter"
+}
+
+resource "google_pubsub_subscription" "dead_letter" {
+  name  = "booking-events-dead-letter-sub"
+  topic = google_pubsub_topic.dead_letter.name
+  message_retention_duration = "604800s"
+}
+
 # Subscriptions (Push to Cloud Run)
 # Note: In a real deployment, we need the Cloud Run URL to set up the push config.
 # Circular dependency issue: Cloud Run needs Pub/Sub topic env var, Pub/Sub needs Cloud Run URL.
@@ -68,6 +79,17 @@ resource "google_pubsub_subscription" "validation" {
     #   service_account_email = google_service_account.pubsub_invoker.email
     # }
   }
+
+  # Same delivery semantics as local mode: exponential backoff, then dead-letter
+  retry_policy {
+    minimum_backoff = "1s"
+    maximum_backoff = "60s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = 10
+  }
 }
 
 # Pricing Service Subscription
@@ -79,28 +101,143 @@ resource "google_pubsub_subscription" "pricing" {
   push_config {
     push_endpoint = google_cloud_run_service.pricing_service.status[0].url
   }
+
+  retry_policy {
+    minimum_backoff = "1s"
+    maximum_backoff = "60s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = 10
+  }
 }
 
-# Quota Manager Service Subscription
+# Quota Manager Service Subscriptions
+# Compensation and quota signals get their own subscription so a backlog of new
+# bookings never delays releasing quota (separate flow control and backlog metrics)
 resource "google_pubsub_subscription" "quota" {
   name  = "quota-sub"
   topic = google_pubsub_topic.events.name
-  filter = "attributes.event_type = \"booking.priced\" OR attributes.event_type = \"booking.compensate\""
+  filter = "attributes.event_type = \"booking.priced\""
+  
+  push_config {
+    push_endpoint = google_cloud_run_service.quota_manager.status[0].url
+  }
+
+  retry_policy {
+    minimum_backoff = "1s"
+    maximum_backoff = "60s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = 10
+  }
+}
+
+resource "google_pubsub_subscription" "quota_priority" {
+  name  = "quota-priority-sub"
+  topic = google_pubsub_topic.events.name
+  filter = "attributes.event_type = \"booking.compensate\" OR hasPrefix(attributes.event_type, \"quota.\")"
   
   push_config {
     push_endpoint = google_cloud_run_service.quota_manager.status[0].url
   }
+
+  retry_policy {
+    minimum_backoff = "1s"
+    maximum_backoff = "60s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = 10
+  }
 }
 
-# Orchestrator Subscription (Wildcard)
+# Orchestrator Subscriptions (Wildcard, split into lanes)
+# Orchestrator listens to every saga event to update state; failures and
+# compensation come in on the priority subscription
 resource "google_pubsub_subscription" "orchestrator" {
   name  = "orchestrator-sub"
   topic = google_pubsub_topic.events.name
-  # Orchestrator listens to everything to update state
+  filter = "hasPrefix(attributes.event_type, \"booking.\") AND NOT (attributes.event_type = \"booking.validation.failed\" OR attributes.event_type = \"booking.pricing.failed\" OR attributes.event_type = \"booking.quota.failed\" OR attributes.event_type = \"booking.compensate\" OR attributes.event_type = \"booking.quota.released\")"
+  
+  push_config {
+    push_endpoint = google_cloud_run_service.orchestrator.status[0].url
+  }
+
+  retry_policy {
+    minimum_backoff = "1s"
+    maximum_backoff = "60s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = 10
+  }
+}
+
+resource "google_pubsub_subscription" "orchestrator_priority" {
+  name  = "orchestrator-priority-sub"
+  topic = google_pubsub_topic.events.name
+  filter = "attributes.event_type = \"booking.validation.failed\" OR attributes.event_type = \"booking.pricing.failed\" OR attributes.event_type = \"booking.quota.failed\" OR attributes.event_type = \"booking.compensate\" OR attributes.event_type = \"booking.quota.released\""
   
   push_config {
     push_endpoint = google_cloud_run_service.orchestrator.status[0].url
   }
+
+  retry_policy {
+    minimum_backoff = "1s"
+    maximum_backoff = "60s"
+  }
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = 10
+  }
+}
+
+# Dead-lettering is done by the Pub/Sub service agent: it must be allowed to publish to
+# the dead-letter topic and to subscribe (ack the forwarded message) on each subscription
+# with a dead_letter_policy, otherwise messages are never forwarded
+data "google_project" "project" {}
+
+locals {
+  pubsub_service_agent = "serviceAccount:service-${data.google_project.project.number}@gcp-sa-pubsub.iam.gserviceaccount.com"
+  dead_lettered_subscriptions = {
+    validation            = google_pubsub_subscription.validation.name
+    pricing               = google_pubsub_subscription.pricing.name
+    quota                 = google_pubsub_subscription.quota.name
+    quota_priority        = google_pubsub_subscription.quota_priority.name
+    orchestrator          = google_pubsub_subscription.orchestrator.name
+    orchestrator_priority = google_pubsub_subscription.orchestrator_priority.name
+  }
+}
+
+resource "google_pubsub_topic_iam_member" "dead_letter_publisher" {
+  topic  = google_pubsub_topic.dead_letter.name
+  role   = "roles/pubsub.publisher"
+  member = local.pubsub_service_agent
+}
+
+resource "google_pubsub_subscription_iam_member" "dead_letter_subscriber" {
+  for_each     = local.dead_lettered_subscriptions
+  subscription = each.value
+  role         = "roles/pubsub.subscriber"
+  member       = local.pubsub_service_agent
+}
+
+# API Gateway Subscription (status cache invalidation)
+resource "google_pubsub_subscription" "api_gateway" {
+  name  = "api-gateway-sub"
+  topic = google_pubsub_topic.events.name
+  filter = "attributes.event_type = \"status.changed\""
+  
+  push_config {
+    push_endpoint = "${google_cloud_run_service.api_gateway.status[0].url}/events"
+  }
 }
 
 # Cloud Run Services
@@ -1,7 +1,14 @@
-import subprocess
+import argparse
+import importlib.util
 import os
+import shutil
+import signal
+import socket
+import subprocess
 import sys
+import tempfile
 import time
+import urllib.request
 
 # Configuration
 SERVICES = [
@@ -12,44 +19,250 @@ SERVICES = [
     ("services/booking-orchestrator", 8084),
 ]
 
-processes = []
+# Orchestrator shard i > 0 listens on SHARD_PORT_BASE + i (shard 0 keeps 8084)
+SHARD_PORT_BASE = 8090
+
+HEALTH_TIMEOUT = 30     # seconds to wait for a service to answer /health
+MAX_BACKOFF = 30        # seconds between restarts of a crash-looping worker
+STABLE_AFTER = 60       # a worker up this long resets its backoff
+
+# Services that need every event of a transaction in one process: KeyedExecutor
+# orders them per process, and a shared socket would spread them over workers. The
+# quota exhausted flag is also per process (only broadcast through Pub/Sub).
+# The orchestrator scales out by transaction_id with --orchestrator-shards instead.
+SINGLE_WORKER_SERVICES = {
+    "quota-manager": "acquire/compensation ordering and the quota exhausted flag are per process",
+    "booking-orchestrator": "saga events are ordered per process, use --orchestrator-shards to scale",
+}
+
+# Multiple workers share one pre-bound listening socket (pre-fork model),
+# which needs fd inheritance and is not available on Windows
+SHARED_SOCKETS = os.name != "nt"
+
+workers = []    # list of Worker
+sockets = []    # listening sockets owned by the supervisor
+
+
+class Worker:
+    def __init__(self, name, path, port, index, cmd, env, sock=None):
+        self.name = name
+        self.path = path
+        self.port = port
+        self.index = index
+        self.cmd = cmd
+        self.env = env
+        self.sock = sock
+        self.process = None
+        self.started_at = 0
+        self.backoff = 1
+        self.restart_at = None
+
+    def start(self):
+        pass_fds = (self.sock.fileno(),) if self.sock else ()
+        self.process = subprocess.Popen(
+            self.cmd, cwd=self.path, env=self.env, shell=False,
+            pass_fds=pass_fds,
+            # Own session so Ctrl+C reaches only the supervisor, which drains in order
+            start_new_session=SHARED_SOCKETS
+        )
+        self.started_at = time.monotonic()
+        self.restart_at = None
+
+
+def pick_implementation(requested, preferred, module):
+    if requested != "auto":
+        return requested
+    return preferred if importlib.util.find_spec(module) else None
+
+
+def parse_worker_counts(default, overrides):
+    counts = {os.path.basename(path): default for path, _ in SERVICES}
+    for item in overrides:
+        name, _, value = item.partition("=")
+        if name not in counts:
+            sys.exit(f"Unknown service '{name}'. Choose from: {', '.join(counts)}")
+        counts[name] = int(value)
+    for name, reason in SINGLE_WORKER_SERVICES.items():
+        if counts[name] > 1:
+            print(f"Starting 1 {name} worker instead of {counts[name]}: {reason}.")
+            counts[name] = 1
+    return counts
+
+
+def service_instances(path, port, args, counts):
+    """(port, worker count, extra env) for each independently addressable instance of a service."""
+    name = os.path.basename(path)
+    if name != "booking-orchestrator" or args.orchestrator_shards <= 1:
+        return [(port, counts[name], {})]
+
+    # Each shard must be the single writer of its transactions: one worker per shard
+    ports = [port] + [SHARD_PORT_BASE + i for i in range(1, args.orchestrator_shards)]
+    members = ",".join(f"http://127.0.0.1:{p}" for p in ports)
+    return [
+        (p, 1, {"SHARD_SELF": f"http://127.0.0.1:{p}", "SHARD_MEMBERS": members})
+        for p in ports
+    ]
+
+
+def bind_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    sockets.append(sock)
+    return sock
+
 
-def start_services():
+def wait_healthy(port, timeout=HEALTH_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                if resp.status == 200:
+                    return True
+        except Exception:
+            time.sleep(0.2)
+    return False
+
+
+def start_services(args):
     print("Starting services in LOCAL MODE (Access API at http://localhost:8080)...")
-    
+
     # Common Env Vars
     env = os.environ.copy()
     env["PROJECT_ID"] = "local-project"
     env["TOPIC_ID"] = "booking-events"
-    # No DB URL needed as we mocked it for local-project
-    
-    for path, port in SERVICES:
-        print(f"Starting {path} on port {port}...")
-        
-        # Command: uvicorn app.main:app --host 0.0.0.0 --port PORT
-        # We need to run this from the service directory or set pythonpath
-        # Easier to cwd into the directory
-        
-        cmd = [sys.executable, "-u", "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)]
-        
-        # Start process
-        p = subprocess.Popen(cmd, cwd=path, env=env, shell=False)
-        processes.append((path, p))
-        
+    # Modules shared by all services (services/common), copied into each image
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.abspath("services"), env.get("PYTHONPATH")]))
+    # No DB URL needed as we mocked it for local-project.
+    # Mock state (saga store, quota counters) lives in SQLite files here so workers share it.
+    env["LOCAL_STATE_DIR"] = args.state_dir
+    if args.faults:
+        # Broker simulation (latency, drops, duplicates, reordering) in the local transport
+        env["LOCAL_FAULTS"] = os.path.abspath(args.faults)
+        print(f"Injecting transport faults from {args.faults}")
+
+    loop = pick_implementation(args.loop, "uvloop", "uvloop")
+    http = pick_implementation(args.http, "httptools", "httptools")
+    counts = parse_worker_counts(args.workers, args.service_workers)
+
+    # Command: uvicorn app.main:app, either on a shared socket (--fd) or a plain port
+    base_cmd = [sys.executable, "-u", "-m", "uvicorn", "app.main:app"]
+    if loop:
+        base_cmd += ["--loop", loop]
+    if http:
+        base_cmd += ["--http", http]
+
+    ports = []
+    for path, service_port in SERVICES:
+        name = os.path.basename(path)
+        for port, count, extra_env in service_instances(path, service_port, args, counts):
+            if count > 1 and not SHARED_SOCKETS:
+                print(f"Multiple workers are not supported on this platform, starting 1 {name} worker.")
+                count = 1
+
+            print(f"Starting {path} on port {port} with {count} worker(s)...")
+            ports.append((name, port))
+
+            sock = bind_socket(port) if SHARED_SOCKETS else None
+            for index in range(count):
+                if sock:
+                    cmd = base_cmd + ["--fd", str(sock.fileno())]
+                else:
+                    cmd = base_cmd + ["--host", "127.0.0.1", "--port", str(port)]
+
+                worker_env = env.copy()
+                worker_env.update(extra_env)
+                worker_env["WORKER_INDEX"] = str(index)
+                # Unique per process across all services, used for reference id generation
+                worker_env["WORKER_ID"] = str(len(workers))
+                worker = Worker(name, path, port, index, cmd, worker_env, sock)
+                worker.start()
+                workers.append(worker)
+
+    # Health-checked startup
+    for name, port in ports:
+        if wait_healthy(port):
+            print(f"{name} healthy on port {port}")
+        else:
+            print(f"WARNING: {name} did not become healthy on port {port}")
+
     print("\nAll services started! Press Ctrl+C to stop.")
 
-def stop_services():
+def supervise():
+    """Restart crashed workers with exponential backoff."""
+    now = time.monotonic()
+    for worker in workers:
+        if worker.process.poll() is None:
+            if now - worker.started_at > STABLE_AFTER:
+                worker.backoff = 1
+            continue
+
+        if worker.restart_at is None:
+            print(f"{worker.name} worker {worker.index} on port {worker.port} exited with code {worker.process.returncode}, "
+                  f"restarting in {worker.backoff}s...")
+            worker.restart_at = now + worker.backoff
+            worker.backoff = min(worker.backoff * 2, MAX_BACKOFF)
+        elif now >= worker.restart_at:
+            worker.start()
+
+def stop_services(drain_timeout):
     print("\nStopping services...")
-    for name, p in processes:
-        print(f"Terminating {name}...")
-        p.terminate()
-        
+    # Gateway first so no new bookings come in, then downstream services drain in pipeline order
+    for path, _ in SERVICES:
+        name = os.path.basename(path)
+        group = [w for w in workers if w.name == name and w.process.poll() is None]
+        for w in group:
+            print(f"Terminating {name} worker {w.index} on port {w.port}...")
+            w.process.terminate()
+
+        deadline = time.monotonic() + drain_timeout
+        for w in group:
+            try:
+                w.process.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print(f"Killing {name} worker {w.index} (did not drain in {drain_timeout}s)")
+                w.process.kill()
+
+    for sock in sockets:
+        sock.close()
+
     print("Cleanup complete.")
 
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run all services locally")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes per service")
+    parser.add_argument("--service-workers", action="append", default=[], metavar="NAME=N",
+                        help="override worker count for one service, e.g. api-gateway=4")
+    parser.add_argument("--orchestrator-shards", type=int, default=1,
+                        help="partition the orchestrator by transaction_id across N instances")
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default="auto")
+    parser.add_argument("--drain-timeout", type=float, default=10, help="seconds to wait for graceful shutdown")
+    parser.add_argument("--state-dir", help="directory for shared local state (default: fresh temp dir)")
+    parser.add_argument("--faults", metavar="FILE",
+                        help="JSON config of latency/fault injection in the local event transport")
+    args = parser.parse_args()
+
+    cleanup_state = args.state_dir is None
+    if cleanup_state:
+        args.state_dir = tempfile.mkdtemp(prefix="clinic-local-")
+    os.makedirs(args.state_dir, exist_ok=True)
+
+    # SIGINT may be inherited as ignored (e.g. started in the background); Ctrl+C must drain
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, handle_sigterm)
     try:
-        start_services()
+        start_services(args)
         while True:
+            supervise()
             time.sleep(1)
     except KeyboardInterrupt:
-        stop_services()
+        stop_services(args.drain_timeout)
+    finally:
+        if cleanup_state:
+            shutil.rmtree(args.state_dir, ignore_errors=True)
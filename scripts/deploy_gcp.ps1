@@ -27,7 +27,7 @@ foreach ($svc in $Services) {
     Write-Host "Building $svc..." -ForegroundColor Cyan
     $ImageName = "gcr.io/$ProjectId/$svc`:latest"
     
-    docker build -t $ImageName ".\services\$svc"
+    docker build -t $ImageName -f ".\services\$svc\Dockerfile" ".\services"
     if ($LASTEXITCODE -ne 0) { Write-Error "Build failed for $svc"; exit 1 }
     
     Write-Host "Pushing $svc..." -ForegroundColor Cyan
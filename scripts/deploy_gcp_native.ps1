@@ -50,7 +50,7 @@ foreach ($svc in $Services) {
     
     # Build & Push
     $ImageName = "gcr.io/$ProjectId/$svc`:latest"
-    docker build -t $ImageName ".\services\$svc"
+    docker build -t $ImageName -f ".\services\$svc\Dockerfile" ".\services"
     docker push $ImageName
     
     # Deploy Cloud Run
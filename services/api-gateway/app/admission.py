@@ -0,0 +1,82 @@
+import math
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token. Returns 0 if allowed, otherwise seconds until a token is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Sheds load at the edge before it reaches the downstream services.
+
+    - Per-client token bucket (rate limit per IP); a rate <= 0 disables it
+    - Global in-flight cap covering publishes in progress and queued local deliveries.
+      The cap adapts to downstream health: halved on a failed delivery, grown by one
+      on each success (AIMD), bounded by [min_in_flight, max_in_flight].
+
+    State is per process, so every limit applies per uvicorn worker: an instance
+    running N workers admits up to N times the configured rate and in-flight cap.
+    """
+
+    def __init__(self, rate=5.0, burst=10, max_in_flight=200, min_in_flight=10, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.max_clients = max_clients
+
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self._buckets = OrderedDict()  # client -> TokenBucket (LRU bounded)
+
+    def _bucket(self, client: str):
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
+
+    def admit(self, client: str):
+        """Returns (admitted, retry_after_seconds)."""
+        if self.in_flight >= self.limit:
+            return (False, 1)
+
+        if self.rate <= 0:
+            return (True, 0)
+        wait = self._bucket(client).take()
+        if wait > 0:
+            return (False, max(1, math.ceil(wait)))
+        return (True, 0)
+
+    def start(self):
+        """A unit of downstream work (publish or queued delivery) started."""
+        self.in_flight += 1
+
+    def finish(self, success: bool = True):
+        """A unit of downstream work finished; adjusts the in-flight cap."""
+        self.in_flight = max(0, self.in_flight - 1)
+        if success:
+            self.limit = min(self.max_in_flight, self.limit + 1)
+        else:
+            self.limit = max(self.min_in_flight, self.limit // 2)
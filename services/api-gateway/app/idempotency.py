@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from common.database import get_db
+from app.local_store import LocalIdempotencyStore
+
+
+def request_hash(body: dict) -> str:
+    """Fingerprint of a request body, to reject a key reused for a different request."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Maps Idempotency-Key headers to the transaction_id of the booking they created.
+
+    A bounded LRU answers client retries hitting the same worker without a round trip;
+    the durable table (idempotency_keys, or SQLite in local mode) is the source of
+    truth across workers and instances. The first request claims the key with an
+    insert, so concurrent duplicates agree on one transaction_id. Keys expire after
+    `ttl` seconds.
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400.0, purge_interval=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._entries = OrderedDict()  # key -> (request_hash, transaction_id, stored_at)
+
+    @property
+    def local_store(self):
+        if not hasattr(self, '_local_store'):
+            self._local_store = LocalIdempotencyStore()
+        return self._local_store
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry + (time.monotonic(),)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def cached(self, key: str):
+        """(request_hash, transaction_id) from the LRU, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[:2]
+
+    async def claim(self, key: str, fingerprint: str, transaction_id: str):
+        """
+        Claim the key for a new transaction. Returns (request_hash, transaction_id) of
+        the owner: ours if the key was free, the original request's otherwise.
+        """
+        if os.getenv("PROJECT_ID") == "local-project":
+            owner = self.local_store.claim(key, fingerprint, transaction_id, self.ttl)
+        else:
+            owner = await self._claim_db(key, fingerprint, transaction_id)
+        self._remember(key, owner)
+        return owner
+
+    async def _claim_db(self, key, fingerprint, transaction_id):
+        from sqlalchemy import text
+        async with get_db() as db:
+            # An expired entry is taken over in the same statement
+            result = await db.execute(text("""
+                INSERT INTO idempotency_keys (idempotency_key, request_hash, transaction_id)
+                VALUES (:key, :hash, :tid)
+                ON CONFLICT (idempotency_key) DO UPDATE SET
+                    request_hash = EXCLUDED.request_hash,
+                    transaction_id = EXCLUDED.transaction_id,
+                    created_at = NOW()
+                WHERE idempotency_keys.created_at < NOW() - make_interval(secs => :ttl)
+                RETURNING request_hash, transaction_id
+            """), {"key": key, "hash": fingerprint, "tid": transaction_id, "ttl": self.ttl})
+            row = result.fetchone()
+            if row is None:
+                result = await db.execute(text(
+                    "SELECT request_hash, transaction_id FROM idempotency_keys WHERE idempotency_key = :key"
+                ), {"key": key})
+                row = result.fetchone()
+            await db.commit()
+        return (row[0], str(row[1]))
+
+    async def forget(self, key: str, transaction_id: str):
+        """Drop our claim when the booking could not be started, so a retry starts it."""
+        self._entries.pop(key, None)
+        if os.getenv("PROJECT_ID") == "local-project":
+            self.local_store.forget(key, transaction_id)
+            return
+
+        from sqlalchemy import text
+        async with get_db() as db:
+            await db.execute(text(
+                "DELETE FROM idempotency_keys WHERE idempotency_key = :key AND transaction_id = :tid"
+            ), {"key": key, "tid": transaction_id})
+            await db.commit()
+
+    async def purge(self):
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.local_store.purge(self.ttl)
+
+        from sqlalchemy import text
+        async with get_db() as db:
+            result = await db.execute(text(
+                "DELETE FROM idempotency_keys WHERE created_at < NOW() - make_interval(secs => :ttl)"
+            ), {"ttl": self.ttl})
+            await db.commit()
+            return result.rowcount
+
+    async def run(self):
+        """Delete expired keys every purge_interval seconds."""
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                purged = await self.purge()
+                if purged:
+                    print(f"Purged {purged} expired idempotency keys")
+            except Exception as e:
+                print(f"Idempotency key purge failed: {e}")
@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key TEXT PRIMARY KEY,
+    request_hash TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class LocalIdempotencyStore:
+    """
+    Idempotency keys for local mode (stands in for the idempotency_keys table).
+
+    Backed by SQLite so several gateway workers started by run_local.py share it:
+    set LOCAL_STATE_DIR and every worker opens the same file. Without it the store
+    lives in memory of the current process.
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            state_dir = os.getenv("LOCAL_STATE_DIR")
+            path = os.path.join(state_dir, "idempotency.db") if state_dir else ":memory:"
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def claim(self, key: str, request_hash: str, transaction_id: str, ttl: float):
+        """
+        Store the key unless a live entry exists. Returns (request_hash, transaction_id)
+        of the entry that owns the key, ours if the claim succeeded.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("""
+                INSERT INTO idempotency_keys (idempotency_key, request_hash, transaction_id, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (idempotency_key) DO UPDATE SET
+                    request_hash = excluded.request_hash,
+                    transaction_id = excluded.transaction_id,
+                    created_at = excluded.created_at
+                WHERE idempotency_keys.created_at < ?
+                RETURNING request_hash, transaction_id
+            """, (key, request_hash, transaction_id, now, now - ttl)).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT request_hash, transaction_id FROM idempotency_keys WHERE idempotency_key = ?", (key,)
+                ).fetchone()
+        return tuple(row)
+
+    def forget(self, key: str, transaction_id: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE idempotency_key = ? AND transaction_id = ?",
+                (key, transaction_id)
+            )
+
+    def purge(self, ttl: float):
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ?", (time.time() - ttl,)
+            ).rowcount
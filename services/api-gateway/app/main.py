@@ -1,29 +1,91 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from uuid import uuid4
 from datetime import datetime
+import math
 import os
+import threading
 import json
 import base64
-try:
-    from google.cloud import pubsub_v1
-except ImportError:
-    pubsub_v1 = None
 import asyncio
+from contextlib import asynccontextmanager
+from app.admission import AdmissionController
+from common.keyed_executor import KeyedExecutor
+from common.delivery import EventDelivery, DeliveryFailed, PUBSUB, delivery_routes
+from common.profiling import profiling_routes
+from app.status_cache import StatusCache
+from app.idempotency import IdempotencyStore, request_hash
+from common.database import get_db, note_write, router as db_router
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Outside local mode, build the Pub/Sub client in the background so neither
+    # startup nor the first request waits for it
+    if PROJECT_ID != "local-project":
+        asyncio.get_running_loop().run_in_executor(None, get_publisher)
+    # Expired idempotency keys are deleted in the background
+    purge_task = asyncio.create_task(idempotency.run())
+    yield
+    purge_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/db")
+async def db_metrics():
+    """Sessions, latency and replication lag per database, and how reads were routed."""
+    return db_router.stats()
 
 # Configuration
 PROJECT_ID = os.getenv("PROJECT_ID", "local-project")
 TOPIC_ID = os.getenv("TOPIC_ID", "booking-events")
 
-# Pub/Sub Publisher
-if pubsub_v1:
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-else:
-    publisher = None
-    topic_path = None
+# Pub/Sub Publisher, created on first use (or warmed up in the background at startup):
+# importing google.cloud.pubsub_v1 and building the client dominates cold start time
+publisher = None
+topic_path = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    global publisher, topic_path
+    with _publisher_lock:
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+            topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    return publisher, topic_path
+
+# Admission control (per-client rate limit + adaptive global in-flight cap)
+admission = AdmissionController(
+    rate=float(os.getenv("RATE_LIMIT_PER_SEC", "5")),
+    burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+    max_in_flight=int(os.getenv("MAX_IN_FLIGHT", "200")),
+    min_in_flight=int(os.getenv("MIN_IN_FLIGHT", "10"))
+)
+
+# Per-transaction ordered event delivery
+executor = KeyedExecutor(int(os.getenv("EVENT_CONCURRENCY", "100")))
+
+# Retrying event delivery with circuit breakers and a dead-letter store
+delivery = EventDelivery.from_env("api-gateway", get_publisher)
+app.include_router(delivery_routes(delivery))
+app.include_router(profiling_routes("api-gateway"))
+
+# Status snapshots, invalidated by status.changed notifications from the orchestrator
+status_cache = StatusCache(
+    max_entries=int(os.getenv("STATUS_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("STATUS_CACHE_TTL", "5"))
+)
+
+# Idempotency-Key -> transaction_id of the booking the key created
+idempotency = IdempotencyStore(
+    max_entries=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+)
 
 class BookingRequest(BaseModel):
     user_name: str
@@ -42,118 +104,311 @@ async def publish_event(event_data: dict):
             target_url = "http://127.0.0.1:8081/"
             # Also send to Orchestrator for tracking
             orchestrator_url = "http://127.0.0.1:8084/"
-            asyncio.create_task(send_local_event(orchestrator_url, event_data))
+            schedule_local_event(orchestrator_url, event_data)
             
         if target_url:
-            import httpx
             # Async fire and forget (simulating pub/sub async nature)
-            asyncio.create_task(send_local_event(target_url, event_data))
+            schedule_local_event(target_url, event_data)
         else:
             print(f"Warning: No local route for {event_type}", flush=True)
         return
         
-    data_str = json.dumps(event_data)
-    data_bytes = data_str.encode("utf-8")
-    
-    future = publisher.publish(
-        topic_path, 
-        data_bytes, 
-        event_type=event_data.get("event_type", "unknown"),
-        transaction_id=event_data.get("transaction_id", "")
-    )
-    future.result()
+    # Retried with backoff. Not dead-lettered: the client is told the booking did
+    # not start, so a later replay must not start it behind their back.
+    admission.start()
+    success = False
+    try:
+        success = await delivery.deliver(PUBSUB, event_data, dead_letter=False)
+    finally:
+        admission.finish(success)
+    if not success:
+        raise DeliveryFailed(f"{event_data.get('event_type')} was not published")
+
+def schedule_local_event(url, data):
+    # Queued deliveries count towards the in-flight cap until they complete.
+    # Deliveries for the same transaction go out in order, one at a time.
+    admission.start()
+    executor.submit(data.get("transaction_id"), lambda: send_local_event(url, data))
 
 async def send_local_event(url, data):
-    import httpx
+    # Retried with backoff, dead-lettered if the service stays unavailable
+    success = False
     try:
-        # Simulate Pub/Sub message format
-        payload = {
-            "message": {
-                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
-                "attributes": {
-                    "event_type": data.get("event_type")
-                }
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json=payload)
-    except Exception as e:
-        print(f"Failed to send local event to {url}: {e}")
+        success = await delivery.deliver(url, data)
+    finally:
+        admission.finish(success)
 
 
-async def get_transaction_state(transaction_id: str):
-    # In a real implementation this would query the DB
-    # For now returning mock
-    return type('obj', (object,), {'current_state': 'processing'})()
+# Fields of an event copied into status entries (same projection as the orchestrator)
+PROJECTED_FIELDS = ("reference_id", "error", "errors", "reason")
+PROJECTED_DATA_FIELDS = ("base_price", "final_price", "discount_eligible", "discount_percentage", "discount_reason")
 
-async def get_transaction_events(transaction_id: str):
-    # In a real implementation this would query the DB
-    return []
+def project_event(seq, event_type, created_at, event):
+    entry = {"seq": seq, "event_type": event_type, "timestamp": created_at.isoformat()}
+    for field in PROJECTED_FIELDS:
+        if field in event:
+            entry[field] = event[field]
+    data = event.get("data")
+    if isinstance(data, dict):
+        for field in PROJECTED_DATA_FIELDS:
+            if field in data:
+                entry[field] = data[field]
+    return entry
 
-async def get_services(gender: str = None):
-    # Mock services response as per DB values for now, essentially acting as a cache or direct DB query
-    # In full implementation, this connects to DB.
-    # We will use the hardcoded list for simplicity unless user wants full DB connectivity code here immediately.
-    # The spec has DB code in sections, but main.py provided in spec calls `get_services`.
-    # I will stick to the provided `main.py` skeleton but fill in the gaps to make it runnable.
-    all_services = [
-        {'id': 1, 'name': 'General Consultation', 'gender': 'both', 'base_price': 300.00},
-        {'id': 2, 'name': 'Gynecology', 'gender': 'female', 'base_price': 500.00},
-        {'id': 3, 'name': 'Ultrasound', 'gender': 'female', 'base_price': 800.00},
-        {'id': 4, 'name': 'Blood Test', 'gender': 'both', 'base_price': 450.00},
-        {'id': 5, 'name': 'Cardiology', 'gender': 'both', 'base_price': 600.00},
-        {'id': 6, 'name': 'Urology', 'gender': 'male', 'base_price': 550.00},
-        {'id': 7, 'name': 'Prostate Screening', 'gender': 'male', 'base_price': 700.00},
-        {'id': 8, 'name': 'Dermatology', 'gender': 'both', 'base_price': 400.00},
+async def read_status(transaction_id: str, since: int, primary: bool):
+    from sqlalchemy import text
+    # Status polls go to a replica unless this instance just initiated the transaction
+    async with get_db(readonly=True, key=transaction_id, primary=primary) as db:
+        state = (await db.execute(
+            text("SELECT current_state FROM transaction_state WHERE transaction_id = :tid"),
+            {"tid": transaction_id}
+        )).scalar()
+        rows = (await db.execute(text("""
+            SELECT seq, event_type, created_at, event_data FROM transaction_events
+            WHERE transaction_id = :tid AND seq > :since
+            ORDER BY seq
+        """), {"tid": transaction_id, "since": since})).fetchall()
+    events = [
+        project_event(r[0], r[1], r[2], r[3] if isinstance(r[3], dict) else json.loads(r[3]))
+        for r in rows
     ]
-    if gender:
-        return [s for s in all_services if s['gender'] in [gender, 'both']]
-    return all_services
+    return state, events
+
+async def get_transaction_state_and_events(transaction_id: str, since: int = 0):
+    if PROJECT_ID == "local-project":
+        # No database locally; the orchestrator is asked directly
+        return "unknown", []
+    state, events = await read_status(transaction_id, since, primary=False)
+    if state is None:
+        # Not replicated yet (freshly initiated elsewhere): ask the primary
+        state, events = await read_status(transaction_id, since, primary=True)
+    return state or "unknown", events
+
+async def get_transaction_event(transaction_id: str, seq: int):
+    if PROJECT_ID == "local-project":
+        return None
+    from sqlalchemy import text
+    for primary in (False, True):
+        async with get_db(readonly=True, key=transaction_id, primary=primary) as db:
+            payload = (await db.execute(
+                text("SELECT event_data FROM transaction_events WHERE transaction_id = :tid AND seq = :seq"),
+                {"tid": transaction_id, "seq": seq}
+            )).scalar()
+        if payload is not None:
+            return payload if isinstance(payload, dict) else json.loads(payload)
+    return None
+
+# Mock catalog for local mode (same rows as the services table)
+LOCAL_SERVICES = [
+    {'id': 1, 'name': 'General Consultation', 'gender': 'both', 'base_price': 300.00},
+    {'id': 2, 'name': 'Gynecology', 'gender': 'female', 'base_price': 500.00},
+    {'id': 3, 'name': 'Ultrasound', 'gender': 'female', 'base_price': 800.00},
+    {'id': 4, 'name': 'Blood Test', 'gender': 'both', 'base_price': 450.00},
+    {'id': 5, 'name': 'Cardiology', 'gender': 'both', 'base_price': 600.00},
+    {'id': 6, 'name': 'Urology', 'gender': 'male', 'base_price': 550.00},
+    {'id': 7, 'name': 'Prostate Screening', 'gender': 'male', 'base_price': 700.00},
+    {'id': 8, 'name': 'Dermatology', 'gender': 'both', 'base_price': 400.00},
+]
+
+async def get_services(gender: str = None):
+    if PROJECT_ID == "local-project":
+        if gender:
+            return [s for s in LOCAL_SERVICES if s['gender'] in [gender, 'both']]
+        return LOCAL_SERVICES
+
+    from sqlalchemy import text
+    # Catalog reads are served by replicas
+    async with get_db(readonly=True) as db:
+        result = await db.execute(text("""
+            SELECT id, name, gender, base_price FROM services
+            WHERE active AND (CAST(:gender AS VARCHAR) IS NULL OR gender IN (:gender, 'both'))
+            ORDER BY id
+        """), {"gender": gender})
+        return [
+            {'id': r[0], 'name': r[1], 'gender': r[2], 'base_price': float(r[3])}
+            for r in result.fetchall()
+        ]
+
+def client_id(http_request: Request):
+    # Cloud Run puts the original client first in X-Forwarded-For
+    forwarded = http_request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return http_request.client.host if http_request.client else "unknown"
+
+def replay_booking(owner, fingerprint):
+    """Response to a repeated Idempotency-Key: the original transaction, nothing published."""
+    owner_hash, transaction_id = owner
+    if owner_hash != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different booking request")
+    return JSONResponse(
+        content={"transaction_id": transaction_id, "status": "initiated"},
+        headers={"Idempotent-Replayed": "true"}
+    )
 
 @app.post("/api/v1/bookings")
-async def create_booking(request: BookingRequest):
-    transaction_id = uuid4()
+async def create_booking(request: BookingRequest, http_request: Request):
+    data = request.model_dump()
+    key = http_request.headers.get("idempotency-key")
+    if key is not None:
+        if not 0 < len(key) <= 255:
+            raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 characters")
+        fingerprint = request_hash(data)
+        # Retries this worker has already seen are answered before admission control
+        owner = idempotency.cached(key)
+        if owner is not None:
+            return replay_booking(owner, fingerprint)
+
+    admitted, retry_after = admission.admit(client_id(http_request))
+    if not admitted:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please retry later.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    transaction_id = str(uuid4())
+    if key is not None:
+        owner = await idempotency.claim(key, fingerprint, transaction_id)
+        if owner[1] != transaction_id:
+            return replay_booking(owner, fingerprint)
     
     event = {
         "event_type": "booking.initiated",
-        "transaction_id": str(transaction_id),
+        "transaction_id": transaction_id,
         "timestamp": datetime.utcnow().isoformat(),
-        "data": request.model_dump()
+        "data": data
     }
     
-    await publish_event(event)
+    # This instance reads the new transaction from the primary until replicas catch up
+    note_write(transaction_id)
+    try:
+        await publish_event(event)
+    except Exception as e:
+        # The saga never started: free the key so the client's retry starts it
+        if key is not None:
+            await idempotency.forget(key, transaction_id)
+        if isinstance(e, DeliveryFailed):
+            # Pub/Sub kept failing; its breaker lets a probe through after reset_timeout
+            raise HTTPException(
+                status_code=503,
+                detail="Booking could not be started. Please retry later.",
+                headers={"Retry-After": str(math.ceil(delivery.reset_timeout))}
+            )
+        raise
     
     return {
-        "transaction_id": str(transaction_id),
+        "transaction_id": transaction_id,
         "status": "initiated"
     }
 
-@app.get("/api/v1/bookings/{transaction_id}/status")
-async def get_status(transaction_id: str):
+async def load_status(transaction_id: str, since: int = 0):
+    """Current state plus the events after `since`, from the orchestrator (local) or the DB."""
     if PROJECT_ID == "local-project":
         import httpx
         try:
             async with httpx.AsyncClient() as client:
-                resp = await client.get(f"http://127.0.0.1:8084/bookings/{transaction_id}")
+                resp = await client.get(
+                    f"http://127.0.0.1:8084/bookings/{transaction_id}",
+                    params={"since": since}
+                )
                 if resp.status_code == 200:
                     data = resp.json()
                     return {
-                        "transaction_id": transaction_id,
                         "current_state": data.get("current_state"),
-                        "events": data.get("events", [])
+                        "events": data.get("events", []),
+                        "last_seq": data.get("last_seq", since)
                     }
         except Exception as e:
             print(f"Failed to fetch local status: {e}")
             
     # Query transaction_state and transaction_events
-    state = await get_transaction_state(transaction_id)
-    events = await get_transaction_events(transaction_id)
+    state, events = await get_transaction_state_and_events(transaction_id, since)
     
     return {
-        "transaction_id": transaction_id,
-        "current_state": state.current_state,
-        "events": events
+        "current_state": state,
+        "events": events,
+        "last_seq": events[-1]["seq"] if events else since
+    }
+
+async def get_status_snapshot(transaction_id: str):
+    snapshot = status_cache.fresh(transaction_id)
+    if snapshot is not None:
+        return snapshot
+
+    # Refresh incrementally on top of the stale snapshot, if any
+    stale = status_cache.peek(transaction_id)
+    base_seq = stale["last_seq"] if stale else 0
+    update = await load_status(transaction_id, base_seq)
+    snapshot = {
+        "current_state": update["current_state"],
+        "events": (stale["events"] if stale else []) + update["events"],
+        "last_seq": max(update["last_seq"], base_seq)
     }
+    if snapshot["current_state"] != "unknown":
+        status_cache.put(transaction_id, snapshot)
+    return snapshot
+
+@app.get("/api/v1/bookings/{transaction_id}/status")
+async def get_status(transaction_id: str, request: Request, since: int = 0):
+    """
+    Returns the current state and the events after the `since` cursor.
+    Clients poll with the `last_seq` of the previous response to only get new events,
+    and may send the ETag of the previous response for the same `since` in
+    If-None-Match to get a 304 when nothing changed.
+    """
+    snapshot = await get_status_snapshot(transaction_id)
+    # The body depends on the cursor too: the same snapshot read from another `since`
+    # holds other events, so it must not match the ETag of this one
+    etag = f'W/"{snapshot["last_seq"]}-{min(since, snapshot["last_seq"])}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return JSONResponse(
+        content={
+            "transaction_id": transaction_id,
+            "current_state": snapshot["current_state"],
+            "events": [e for e in snapshot["events"] if e["seq"] > since],
+            "last_seq": snapshot["last_seq"]
+        },
+        headers={"ETag": etag}
+    )
+
+@app.post("/events")
+async def receive_event(request: Request):
+    """
+    Receives status.changed notifications (Pub/Sub push format) from the orchestrator
+    to keep the status cache current.
+    """
+    body = await request.json()
+    if not body or "message" not in body:
+        return {"status": "ignored"}
+
+    b64_data = body["message"]["data"]
+    event = json.loads(base64.b64decode(b64_data).decode("utf-8"))
+    if event.get("event_type") == "status.changed":
+        status_cache.notify(event["transaction_id"], event["seq"])
+    return {"status": "processed"}
+
+@app.get("/api/v1/bookings/{transaction_id}/events/{seq}")
+async def get_event(transaction_id: str, seq: int):
+    """
+    Returns the full payload of a single event (status only carries projections).
+    """
+    if PROJECT_ID == "local-project":
+        import httpx
+        try:
+            async with httpx.AsyncClient() as client:
+                resp = await client.get(f"http://127.0.0.1:8084/bookings/{transaction_id}/events/{seq}")
+                if resp.status_code == 200:
+                    return resp.json()
+        except Exception as e:
+            print(f"Failed to fetch local event: {e}")
+
+    event = await get_transaction_event(transaction_id, seq)
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return event
 
 @app.get("/api/v1/services")
 async def list_services(gender: str = None):
@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+
+
+class StatusCache:
+    """
+    Bounded LRU/TTL cache of booking status snapshots, kept current by status.changed
+    notifications from the orchestrator.
+
+    Each entry tracks the snapshot (current_state, projected events, last_seq) and the
+    highest seq announced for the transaction. A snapshot is served only while it is
+    younger than `ttl` and not behind an announced seq; the TTL bounds staleness when
+    a notification is lost or lands on another gateway instance.
+    """
+
+    def __init__(self, max_entries=10000, ttl=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # transaction_id -> {"snapshot", "cached_at", "known_seq"}
+
+    def _entry(self, transaction_id: str):
+        entry = self._entries.get(transaction_id)
+        if entry is None:
+            entry = {"snapshot": None, "cached_at": 0.0, "known_seq": 0}
+            self._entries[transaction_id] = entry
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(transaction_id)
+        return entry
+
+    def fresh(self, transaction_id: str):
+        """Snapshot if it can be served without asking the backend, else None."""
+        entry = self._entries.get(transaction_id)
+        if entry is None or entry["snapshot"] is None:
+            return None
+        if time.monotonic() - entry["cached_at"] > self.ttl:
+            return None
+        if entry["snapshot"]["last_seq"] < entry["known_seq"]:
+            return None
+        self._entries.move_to_end(transaction_id)
+        return entry["snapshot"]
+
+    def peek(self, transaction_id: str):
+        """Snapshot even if stale (base for an incremental refresh), else None."""
+        entry = self._entries.get(transaction_id)
+        return entry["snapshot"] if entry else None
+
+    def put(self, transaction_id: str, snapshot: dict):
+        entry = self._entry(transaction_id)
+        entry["snapshot"] = snapshot
+        entry["cached_at"] = time.monotonic()
+
+    def notify(self, transaction_id: str, seq: int):
+        """Record that the transaction has advanced to `seq` (invalidates older snapshots)."""
+        entry = self._entry(transaction_id)
+        entry["known_seq"] = max(entry["known_seq"], seq)
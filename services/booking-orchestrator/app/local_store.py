@@ -0,0 +1,172 @@
+import json
+import os
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS saga_state (
+    transaction_id TEXT PRIMARY KEY,
+    current_state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS saga_events (
+    transaction_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event_type TEXT NOT NULL,
+    projection TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (transaction_id, seq)
+);
+CREATE TABLE IF NOT EXISTS daily_rollups (
+    day TEXT NOT NULL,
+    gender TEXT NOT NULL,
+    discount_reason TEXT NOT NULL,
+    service_id INTEGER NOT NULL,
+    bookings INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    base_revenue REAL NOT NULL DEFAULT 0,
+    discounted_bookings INTEGER NOT NULL DEFAULT 0,
+    quota_released INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, gender, discount_reason, service_id)
+);
+"""
+
+ROLLUP_COUNTERS = ("bookings", "revenue", "base_revenue", "discounted_bookings", "quota_released")
+
+
+class LocalSagaStore:
+    """
+    Saga state for local mode (stands in for transaction_state / transaction_events).
+
+    Backed by SQLite so several orchestrator workers started by run_local.py share it:
+    set LOCAL_STATE_DIR to a directory and every worker opens the same file.
+    Without it the store lives in memory of the current process.
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            state_dir = os.getenv("LOCAL_STATE_DIR")
+            path = os.path.join(state_dir, "orchestrator.db") if state_dir else ":memory:"
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def append_event(self, transaction_id: str, event_type: str, payload: dict, project):
+        """
+        Store an event and make it the current state. `project(seq)` builds the
+        compact status entry once the seq is known. Returns that entry, or None if
+        the saga already recorded an event of this type (a redelivery).
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            # IMMEDIATE takes the write lock up front so seq allocation is atomic across workers
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if cur.execute(
+                    "SELECT 1 FROM saga_events WHERE transaction_id = ? AND event_type = ? LIMIT 1",
+                    (transaction_id, event_type)
+                ).fetchone():
+                    cur.execute("ROLLBACK")
+                    return None
+                row = cur.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM saga_events WHERE transaction_id = ?",
+                    (transaction_id,)
+                ).fetchone()
+                seq = row[0] + 1
+                entry = project(seq)
+                cur.execute(
+                    "INSERT INTO saga_events (transaction_id, seq, event_type, projection, payload) VALUES (?, ?, ?, ?, ?)",
+                    (transaction_id, seq, event_type, json.dumps(entry), json.dumps(payload))
+                )
+                cur.execute(
+                    "INSERT INTO saga_state (transaction_id, current_state) VALUES (?, ?) "
+                    "ON CONFLICT (transaction_id) DO UPDATE SET current_state = excluded.current_state",
+                    (transaction_id, event_type)
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            return entry
+
+    def get_status(self, transaction_id: str, since: int = 0):
+        with self._lock:
+            state = self._conn.execute(
+                "SELECT current_state FROM saga_state WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone()
+            if state is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT seq, projection FROM saga_events WHERE transaction_id = ? AND seq > ? ORDER BY seq",
+                (transaction_id, since)
+            ).fetchall()
+            last_seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM saga_events WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone()[0]
+
+        return {
+            "current_state": state[0],
+            "events": [json.loads(projection) for _, projection in rows],
+            "last_seq": last_seq
+        }
+
+    def get_payload(self, transaction_id: str, seq: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM saga_events WHERE transaction_id = ? AND seq = ?", (transaction_id, seq)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_payload(self, transaction_id: str, event_type: str):
+        """Full payload of the first event of this type, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM saga_events WHERE transaction_id = ? AND event_type = ? ORDER BY seq LIMIT 1",
+                (transaction_id, event_type)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def apply_rollups(self, deltas: dict):
+        """Add {(day, gender, discount_reason, service_id): {counter: delta}} to daily_rollups."""
+        columns = ", ".join(ROLLUP_COUNTERS)
+        updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in ROLLUP_COUNTERS)
+        rows = [
+            key + tuple(float(counters.get(c, 0)) for c in ROLLUP_COUNTERS)
+            for key, counters in deltas.items()
+        ]
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.executemany(
+                    f"INSERT INTO daily_rollups (day, gender, discount_reason, service_id, {columns}) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    f"ON CONFLICT (day, gender, discount_reason, service_id) DO UPDATE SET {updates}",
+                    rows
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def get_rollups(self, day: str, service_id: int):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT gender, discount_reason, {', '.join(ROLLUP_COUNTERS)} FROM daily_rollups "
+                "WHERE day = ? AND service_id = ? ORDER BY gender, discount_reason",
+                (day, service_id)
+            ).fetchall()
+        return [
+            dict(zip(("gender", "discount_reason") + ROLLUP_COUNTERS, row))
+            for row in rows
+        ]
+
+    def has_event(self, transaction_id: str, event_type: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM saga_events WHERE transaction_id = ? AND event_type = ? LIMIT 1",
+                (transaction_id, event_type)
+            ).fetchone()
+        return row is not None
@@ -1,11 +1,94 @@
+import asyncio
 import base64
 import json
 import os
-from fastapi import FastAPI, Request
-from app.saga_coordinator import SagaCoordinator
+from contextlib import asynccontextmanager
+from datetime import date
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+from app.saga_coordinator import SagaCoordinator, executor, scheduler, lane_for, delivery, get_publisher, PROJECT_ID
+from common.delivery import delivery_routes
+from common.profiling import profiling_routes
+from common.database import router as db_router
+from app.sharding import ShardRouter, ShardUnavailable, FORWARDED_HEADER
+from app.outbox import OutboxRelay
+from app.reference_ids import WorkerIdLease
+from app.rollups import ALL_SERVICES, ist_day
 
-app = FastAPI()
-saga = SagaCoordinator()
+router = ShardRouter()
+saga = SagaCoordinator(router)
+relay = OutboxRelay(
+    get_publisher,
+    batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")),
+    poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10")),
+    retry_base=float(os.getenv("OUTBOX_RETRY_BASE", "1")),
+    retry_max=float(os.getenv("OUTBOX_RETRY_MAX", "300"))
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    relay_tasks = []
+    # Without a configured WORKER_ID, lease one; startup fails if none can be had
+    lease = lease_task = None
+    if saga.reference_ids.worker_id is None:
+        lease = WorkerIdLease(saga.reference_ids, ttl=float(os.getenv("REFERENCE_LEASE_TTL", "60")))
+        await lease.acquire()
+        lease_task = asyncio.create_task(lease.run())
+    # Outside local mode, build the Pub/Sub client in the background and start
+    # draining the outbox (safe to run several relays, rows are claimed with SKIP LOCKED)
+    if PROJECT_ID != "local-project":
+        asyncio.get_running_loop().run_in_executor(None, get_publisher)
+        relay_tasks = [asyncio.create_task(relay.run()) for _ in range(int(os.getenv("OUTBOX_RELAYS", "1")))]
+    # Batched rollup writes
+    rollup_task = asyncio.create_task(saga.rollups.run())
+    # Join the shard ring on startup and leave it on shutdown so keys rebalance
+    await router.announce("join")
+    probe_task = asyncio.create_task(router.run(float(os.getenv("SHARD_PROBE_INTERVAL", "5")))) if router.self_url else None
+    yield
+    if probe_task:
+        probe_task.cancel()
+    await router.announce("leave")
+    for task in relay_tasks:
+        task.cancel()
+    rollup_task.cancel()
+    await saga.rollups.flush()
+    if lease:
+        lease_task.cancel()
+        await lease.release()
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(delivery_routes(delivery))
+app.include_router(profiling_routes("booking-orchestrator"))
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/lanes")
+async def lane_metrics():
+    """Per-lane queue depth, throughput and wait times of event processing."""
+    return scheduler.stats()
+
+@app.get("/db")
+async def db_metrics():
+    """Sessions, latency and replication lag per database, and how reads were routed."""
+    return db_router.stats()
+
+async def route_to_owner(request: Request, transaction_id: str, method: str, path: str, **kwargs):
+    """Proxy to the owning shard; None means this instance handles the request."""
+    if request.headers.get(FORWARDED_HEADER):
+        # Already forwarded once: handle here even if rings disagree, to avoid loops
+        return None
+    try:
+        resp = await router.route(transaction_id, method, path, **kwargs)
+    except ShardUnavailable as e:
+        # Not handled here: the owner may still be processing it (retried by the sender)
+        raise HTTPException(status_code=503, detail=str(e))
+    if resp is None:
+        return None
+    # The owner's status and body as they are, whatever the content type
+    return Response(content=resp.content, status_code=resp.status_code, media_type=resp.headers.get("content-type"))
 
 @app.post("/")
 async def receive_event(request: Request):
@@ -15,16 +98,91 @@ async def receive_event(request: Request):
     body = await request.json()
     if not body or "message" not in body:
         return {"status": "ignored"}
-    
+
     # Decode message
     b64_data = body["message"]["data"]
     data_str = base64.b64decode(b64_data).decode("utf-8")
     event = json.loads(data_str)
-    
-    await saga.handle_event(event)
-        
+
+    # Service-level signals (e.g. quota.exhausted, status.changed) are not part of any saga
+    if "transaction_id" not in event or not event.get("event_type", "").startswith("booking."):
+        return {"status": "ignored"}
+
+    forwarded = await route_to_owner(request, event["transaction_id"], "POST", "/", json=body)
+    if forwarded is not None:
+        return forwarded
+
+    # Events of one transaction are handled strictly one after another
+    await executor.run(event["transaction_id"], lambda: saga.handle_event(event), lane_for(event["event_type"]))
+
     return {"status": "processed"}
 
 @app.get("/bookings/{transaction_id}")
-async def get_booking_status(transaction_id: str):
-    return saga.get_mock_status(transaction_id)
+async def get_booking_status(transaction_id: str, request: Request, since: int = 0):
+    """
+    Returns the current state and only the events after the `since` cursor.
+    """
+    forwarded = await route_to_owner(
+        request, transaction_id, "GET", f"/bookings/{transaction_id}", params={"since": since}
+    )
+    if forwarded is not None:
+        return forwarded
+    return saga.get_mock_status(transaction_id, since)
+
+@app.get("/bookings/{transaction_id}/events/{seq}")
+async def get_booking_event(transaction_id: str, seq: int, request: Request):
+    """
+    Returns the full original payload of a single event.
+    """
+    forwarded = await route_to_owner(request, transaction_id, "GET", f"/bookings/{transaction_id}/events/{seq}")
+    if forwarded is not None:
+        return forwarded
+
+    payload = saga.get_mock_event_payload(transaction_id, seq)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return payload
+
+@app.get("/outbox/dead-letters")
+async def list_outbox_dead_letters(limit: int = 100):
+    """Outbox rows that exhausted OUTBOX_MAX_ATTEMPTS, with their last error."""
+    if PROJECT_ID == "local-project":
+        raise HTTPException(status_code=404, detail="No outbox in local mode")
+    return await relay.dead_letters(limit)
+
+@app.post("/outbox/dead-letters/replay")
+async def replay_outbox_dead_letters(id: int = None):
+    if PROJECT_ID == "local-project":
+        raise HTTPException(status_code=404, detail="No outbox in local mode")
+    result = await relay.replay(id)
+    if id is not None and result["replayed"] == 0:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return result
+
+@app.get("/rollups/daily")
+async def get_daily_rollups(day: date = None, service_id: int = ALL_SERVICES):
+    """
+    Daily bookings, revenue, discounts and quota releases per gender and discount
+    reason for one IST day (default today) and service (default all services).
+    """
+    return {
+        "day": (day or ist_day()).isoformat(),
+        "service_id": service_id,
+        "rows": await saga.rollups.query(day or ist_day(), service_id)
+    }
+
+@app.get("/shards")
+async def list_shards():
+    return {"self": router.self_url, "members": sorted(router.ring.members)}
+
+@app.post("/shards/join")
+async def shard_join(request: Request):
+    body = await request.json()
+    router.add_member(body["url"])
+    return {"members": sorted(router.ring.members)}
+
+@app.post("/shards/leave")
+async def shard_leave(request: Request):
+    body = await request.json()
+    router.remove_member(body["url"])
+    return {"members": sorted(router.ring.members)}
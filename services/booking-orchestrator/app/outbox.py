@@ -0,0 +1,132 @@
+import asyncio
+import json
+from common.database import get_db
+
+
+async def add_to_outbox(db, event: dict):
+    """Queue an event in the caller's DB transaction; it is published after commit by the relay."""
+    from sqlalchemy import text
+    stmt = text("""
+        INSERT INTO outbox (transaction_id, event_type, payload)
+        VALUES (:tid, :etype, :payload)
+    """)
+    await db.execute(stmt, {
+        "tid": event.get("transaction_id"),
+        "etype": event["event_type"],
+        "payload": json.dumps(event)
+    })
+
+
+class OutboxRelay:
+    """
+    Drains the outbox table to Pub/Sub in batches.
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so any number of relays (tasks or
+    instances) can run in parallel without publishing the same row twice while it is
+    locked. Delivery is at-least-once: a crash after publishing but before commit
+    republishes the batch, which consumers already tolerate (Pub/Sub redelivers too).
+    A row that fails to publish is retried after an exponential backoff and, after
+    `max_attempts`, dead-lettered (kept with its last error, replayable) so a poison
+    row does not take a batch slot on every drain.
+    """
+
+    def __init__(self, get_publisher, batch_size=100, poll_interval=0.5,
+                 max_attempts=10, retry_base=1.0, retry_max=300.0):
+        self.get_publisher = get_publisher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+    async def publish_batch(self, events):
+        """Publish concurrently; returns one error per event (None when published)."""
+        client, path = self.get_publisher()
+        futures = [
+            client.publish(
+                path,
+                json.dumps(event).encode("utf-8"),
+                event_type=event.get("event_type", "unknown"),
+                transaction_id=event.get("transaction_id", "")
+            )
+            for event in events
+        ]
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures), return_exceptions=True)
+        return [repr(r) if isinstance(r, Exception) else None for r in results]
+
+    async def drain_once(self):
+        """Publish one batch. Returns the number of rows claimed."""
+        from sqlalchemy import text
+        async with get_db() as db:
+            result = await db.execute(text("""
+                SELECT id, payload FROM outbox
+                WHERE published_at IS NULL AND dead_lettered_at IS NULL AND next_attempt_at <= NOW()
+                ORDER BY id
+                LIMIT :limit
+                FOR UPDATE SKIP LOCKED
+            """), {"limit": self.batch_size})
+            rows = result.fetchall()
+            if not rows:
+                await db.commit()
+                return 0
+
+            ids = [row[0] for row in rows]
+            events = [row[1] if isinstance(row[1], dict) else json.loads(row[1]) for row in rows]
+            errors = await self.publish_batch(events)
+
+            published = [i for i, error in zip(ids, errors) if error is None]
+            failed = [{"id": i, "error": error} for i, error in zip(ids, errors) if error is not None]
+            if published:
+                await db.execute(
+                    text("UPDATE outbox SET published_at = NOW() WHERE id = ANY(:ids)"),
+                    {"ids": published}
+                )
+            if failed:
+                # Backoff doubles per attempt; the last attempt dead-letters the row
+                await db.execute(text("""
+                    UPDATE outbox SET
+                        attempts = attempts + 1,
+                        last_error = :error,
+                        next_attempt_at = NOW() + make_interval(secs => LEAST(:base * power(2, attempts), :max)),
+                        dead_lettered_at = CASE WHEN attempts + 1 >= :max_attempts THEN NOW() END
+                    WHERE id = :id
+                """), [dict(row, base=self.retry_base, max=self.retry_max, max_attempts=self.max_attempts)
+                        for row in failed])
+            await db.commit()
+            return len(rows)
+
+    async def dead_letters(self, limit=100):
+        from sqlalchemy import text
+        async with get_db() as db:
+            result = await db.execute(text("""
+                SELECT id, transaction_id, event_type, attempts, last_error, dead_lettered_at FROM outbox
+                WHERE dead_lettered_at IS NOT NULL
+                ORDER BY id LIMIT :limit
+            """), {"limit": limit})
+            return [
+                {"id": r[0], "transaction_id": str(r[1]), "event_type": r[2], "attempts": r[3],
+                 "last_error": r[4], "dead_lettered_at": r[5].isoformat()}
+                for r in result.fetchall()
+            ]
+
+    async def replay(self, id: int = None):
+        """Queue dead-lettered rows (one, or all) for publishing again with fresh attempts."""
+        from sqlalchemy import text
+        async with get_db() as db:
+            result = await db.execute(text("""
+                UPDATE outbox SET dead_lettered_at = NULL, attempts = 0, next_attempt_at = NOW()
+                WHERE dead_lettered_at IS NOT NULL AND (CAST(:id AS BIGINT) IS NULL OR id = :id)
+            """), {"id": id})
+            await db.commit()
+            return {"replayed": result.rowcount}
+
+    async def run(self):
+        while True:
+            try:
+                claimed = await self.drain_once()
+            except Exception as e:
+                print(f"Outbox relay error: {e}")
+                claimed = 0
+            # Keep draining while batches come back full, otherwise poll
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from common.database import get_db
+from app.rollups import IST
+
+# Crockford base32: no I, L, O, U so references are easy to read out over the phone
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MS_PER_DAY = 86_400_000
+# ms-of-day (27 bits, with headroom) + worker + sequence fits in 10 base32 chars (50 bits)
+SUFFIX_LENGTH = 10
+IST_OFFSET_MS = int(IST.utcoffset(None).total_seconds() * 1000)
+
+
+def default_worker_id():
+    """
+    WORKER_ID env var if set (must be unique per orchestrator process; run_local.py
+    numbers its workers), 0 for a lone local-mode process, otherwise None: the id
+    has to be leased with WorkerIdLease before references can be generated.
+    """
+    configured = os.getenv("WORKER_ID")
+    if configured is not None:
+        return int(configured)
+    if os.getenv("PROJECT_ID", "local-project") == "local-project":
+        return 0
+    return None
+
+
+def encode(value: int, length: int = SUFFIX_LENGTH):
+    chars = []
+    for _ in range(length):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+class ReferenceIdGenerator:
+    """
+    Snowflake-style booking references: BK{YYYYMMDD}-{ms of day | worker id | sequence},
+    with the IST date and ms since IST midnight (the day bookings are counted on).
+
+    IDs are unique as long as worker ids are unique, need no DB round trip and
+    sort by creation time (fixed width, so they index well as VARCHAR). Without a
+    configured worker id, next_id raises until a WorkerIdLease has assigned one, and
+    again if the lease runs out before it could be renewed.
+    If the clock goes backwards or a millisecond runs out of sequence numbers,
+    the generator keeps using (or moves past) the last millisecond instead of waiting.
+    """
+
+    def __init__(self, worker_id: int = None):
+        if worker_id is None:
+            worker_id = default_worker_id()
+        if worker_id is not None and not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+
+        self.worker_id = worker_id
+        # Monotonic deadline of a leased worker id (None: configured, never expires)
+        self.valid_until = None
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _next_slot(self):
+        now_ms = time.time_ns() // 1_000_000
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            elif self._sequence < MAX_SEQUENCE:
+                self._sequence += 1
+            else:
+                # Sequence exhausted for this millisecond: borrow the next one
+                self._last_ms += 1
+                self._sequence = 0
+            return self._last_ms, self._sequence
+
+    def next_id(self):
+        if self.worker_id is None or (self.valid_until is not None and time.monotonic() >= self.valid_until):
+            raise RuntimeError("No worker id lease, cannot generate booking references")
+        epoch_ms, sequence = self._next_slot()
+        ist_ms = epoch_ms + IST_OFFSET_MS
+        day = datetime.fromtimestamp(ist_ms // MS_PER_DAY * 86_400, tz=timezone.utc)
+        ms_of_day = ist_ms % MS_PER_DAY
+
+        value = (ms_of_day << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | sequence
+        return f"BK{day.strftime('%Y%m%d')}-{encode(value)}"
+
+
+class WorkerIdLease:
+    """
+    Leases a free worker id from reference_worker_leases for a ReferenceIdGenerator,
+    so autoscaled orchestrator instances never share one.
+
+    The lease lasts `ttl` seconds and is renewed every ttl / 3. The generator only
+    uses the id until the lease would have run out, counted from before the renewal
+    was sent, so once another instance may take the id over this one has stopped
+    generating with it. A lost lease is replaced by a new one on the next renewal.
+    """
+
+    def __init__(self, generator: ReferenceIdGenerator, ttl=60.0):
+        self.generator = generator
+        self.ttl = ttl
+        self.holder = str(uuid.uuid4())
+
+    async def acquire(self):
+        """Take a free (or expired) worker id. Raises RuntimeError if all are leased."""
+        from sqlalchemy import text
+        for _ in range(5):
+            started = time.monotonic()
+            async with get_db() as db:
+                # Two instances picking the same free id: the conflict leaves one without a row
+                result = await db.execute(text("""
+                    INSERT INTO reference_worker_leases (worker_id, holder, expires_at)
+                    SELECT id, :holder, NOW() + make_interval(secs => :ttl)
+                    FROM generate_series(0, :max_id) AS id
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM reference_worker_leases l
+                        WHERE l.worker_id = id AND l.expires_at > NOW()
+                    )
+                    ORDER BY random()
+                    LIMIT 1
+                    ON CONFLICT (worker_id) DO UPDATE SET
+                        holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+                    WHERE reference_worker_leases.expires_at <= NOW()
+                    RETURNING worker_id
+                """), {"holder": self.holder, "ttl": self.ttl, "max_id": MAX_WORKER_ID})
+                worker_id = result.scalar()
+                await db.commit()
+            if worker_id is not None:
+                self.generator.worker_id = worker_id
+                self.generator.valid_until = started + self.ttl
+                print(f"Leased reference worker id {worker_id}", flush=True)
+                return worker_id
+        raise RuntimeError("No free reference worker id (all leased)")
+
+    async def renew(self):
+        """Extend the lease. Returns False if it was lost (expired and taken over)."""
+        from sqlalchemy import text
+        started = time.monotonic()
+        async with get_db() as db:
+            result = await db.execute(text("""
+                UPDATE reference_worker_leases SET expires_at = NOW() + make_interval(secs => :ttl)
+                WHERE worker_id = :worker_id AND holder = :holder
+            """), {"ttl": self.ttl, "worker_id": self.generator.worker_id, "holder": self.holder})
+            await db.commit()
+        if result.rowcount == 0:
+            return False
+        self.generator.valid_until = started + self.ttl
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self.renew():
+                    print(f"Reference worker id {self.generator.worker_id} lease lost, leasing a new one", flush=True)
+                    await self.acquire()
+            except Exception as e:
+                print(f"Reference worker id lease renewal failed: {e}", flush=True)
+
+    async def release(self):
+        from sqlalchemy import text
+        self.generator.valid_until = time.monotonic()
+        async with get_db() as db:
+            await db.execute(text(
+                "DELETE FROM reference_worker_leases WHERE worker_id = :worker_id AND holder = :holder"
+            ), {"worker_id": self.generator.worker_id, "holder": self.holder})
+            await db.commit()
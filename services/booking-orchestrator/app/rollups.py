@@ -0,0 +1,148 @@
+import asyncio
+import os
+from datetime import datetime, date, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from common.database import get_db
+from app.local_store import ROLLUP_COUNTERS
+
+# IST is a fixed UTC+05:30 offset (no DST)
+IST = timezone(timedelta(hours=5, minutes=30), 'IST')
+
+# service_id of the row that aggregates all services of a booking
+ALL_SERVICES = 0
+
+
+def ist_day(timestamp: str = None) -> date:
+    """IST day of a naive UTC ISO timestamp (event "timestamp" fields), or of now."""
+    if timestamp is None:
+        moment = datetime.now(timezone.utc)
+    else:
+        moment = datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc)
+    return moment.astimezone(IST).date()
+
+
+def share(amount: Decimal, parts: int) -> Decimal:
+    """
+    Even per-service share of a booking amount, rounded like backfill_rollups.py
+    (Postgres ROUND on numeric rounds half away from zero; round() would round half-even).
+    """
+    return (amount / parts).quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+
+
+class DailyRollups:
+    """
+    Daily booking/discount rollups keyed by (IST day, gender, discount reason, service).
+
+    Completed bookings and quota releases are added to an in-memory buffer of deltas
+    and flushed in one batched upsert every `flush_interval` seconds (or as soon as
+    `max_pending` keys are buffered), so the hot path never touches the rollup table.
+    Each booking updates its ALL_SERVICES row and one row per service, with the
+    price split evenly between the booking's services. Deltas still buffered when a
+    process dies are lost; database/backfill_rollups.py rebuilds and cross-checks.
+    """
+
+    def __init__(self, local_store, flush_interval=5.0, max_pending=1000):
+        self.local_store = local_store
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._wakeup = None
+
+    def _add(self, key, **deltas):
+        counters = self._pending.setdefault(key, {})
+        for name, delta in deltas.items():
+            counters[name] = counters.get(name, 0) + delta
+        if len(self._pending) >= self.max_pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    def record_booking(self, data: dict, day: date = None):
+        day = (day or ist_day()).isoformat()
+        gender = data.get("user_gender") or ""
+        reason = data.get("discount_reason") or ""
+        final_price = Decimal(str(data.get("final_price") or 0))
+        base_price = Decimal(str(data.get("base_price") or 0))
+        discounted = 1 if data.get("discount_eligible") else 0
+
+        self._add((day, gender, reason, ALL_SERVICES), bookings=1, revenue=final_price,
+                  base_revenue=base_price, discounted_bookings=discounted)
+        services = data.get("service_ids") or []
+        for service_id in services:
+            self._add((day, gender, reason, service_id), bookings=1,
+                      revenue=share(final_price, len(services)),
+                      base_revenue=share(base_price, len(services)),
+                      discounted_bookings=discounted)
+
+    def record_release(self, acquired_event: dict):
+        """Count a quota release against the day and key of the acquisition it undoes."""
+        data = acquired_event.get("data") or {}
+        day = ist_day(acquired_event.get("timestamp")).isoformat()
+        key = (day, data.get("user_gender") or "", data.get("discount_reason") or "", ALL_SERVICES)
+        self._add(key, quota_released=1)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        deltas, self._pending = self._pending, {}
+        try:
+            await self._apply(deltas)
+        except Exception:
+            # Merge back so the deltas go out with the next flush
+            for key, counters in deltas.items():
+                self._add(key, **counters)
+            raise
+
+    async def _apply(self, deltas):
+        if os.getenv("PROJECT_ID") == "local-project":
+            self.local_store.apply_rollups(deltas)
+            return
+
+        from sqlalchemy import text
+        columns = ", ".join(ROLLUP_COUNTERS)
+        updates = ", ".join(f"{c} = daily_rollups.{c} + EXCLUDED.{c}" for c in ROLLUP_COUNTERS)
+        stmt = text(f"""
+            INSERT INTO daily_rollups (day, gender, discount_reason, service_id, {columns})
+            VALUES (:day, :gender, :reason, :service_id, {", ".join(":" + c for c in ROLLUP_COUNTERS)})
+            ON CONFLICT (day, service_id, gender, discount_reason)
+            DO UPDATE SET {updates}, updated_at = NOW()
+        """)
+        params = [
+            dict(zip(("day", "gender", "reason", "service_id"), (date.fromisoformat(key[0]),) + key[1:]),
+                 **{c: counters.get(c, 0) for c in ROLLUP_COUNTERS})
+            for key, counters in deltas.items()
+        ]
+        async with get_db() as db:
+            await db.execute(stmt, params)
+            await db.commit()
+
+    async def query(self, day: date, service_id: int = ALL_SERVICES):
+        """All (gender, discount reason) rows of one day and service: a primary key range read."""
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.local_store.get_rollups(day.isoformat(), service_id)
+
+        from sqlalchemy import text
+        # Dashboards tolerate the replica lag bound
+        async with get_db(readonly=True) as db:
+            result = await db.execute(text(f"""
+                SELECT gender, discount_reason, {", ".join(ROLLUP_COUNTERS)}
+                FROM daily_rollups
+                WHERE day = :day AND service_id = :service_id
+                ORDER BY gender, discount_reason
+            """), {"day": day, "service_id": service_id})
+            return [
+                {k: float(v) if isinstance(v, Decimal) else v
+                 for k, v in zip(("gender", "discount_reason") + ROLLUP_COUNTERS, row)}
+                for row in result.fetchall()
+            ]
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Rollup flush failed: {e}", flush=True)
@@ -1,51 +1,69 @@
 from datetime import datetime
-import random
 from uuid import UUID
-from sqlalchemy import text
-from app.database import get_db
+from common.database import get_db
+from app.reference_ids import ReferenceIdGenerator
+from app.local_store import LocalSagaStore
+from app.state_cache import StateCache
+from common.keyed_executor import KeyedExecutor
+from common.delivery import EventDelivery, PUBSUB
+from common.lanes import LaneScheduler, PRIORITY_LANE, DEFAULT_LANE
+from app.outbox import add_to_outbox
+from app.rollups import DailyRollups
 import json
 import os
+import threading
 import asyncio
-import base64
-try:
-    from google.cloud import pubsub_v1
-except ImportError:
-    pubsub_v1 = None
-
-# ... (omitted)
-
-    async def create_booking(self, transaction_id, data):
-        # Generate reference ID
-        ref_id = f"BK{datetime.now().strftime('%Y%m%d')}-{random.randint(100000,999999)}"
-        
-        # Create booking record
-        await self.create_booking_record(transaction_id, ref_id, data)
-        
-        event_data = {
-            "event_type": "booking.completed",
-            "transaction_id": transaction_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "reference_id": ref_id
-        }
-        
-        # Update local state so client sees it
-        if os.getenv("PROJECT_ID") == "local-project":
-            await self.update_state(transaction_id, "booking.completed", event_data)
-
-        # Publish success
-        await publish_event(event_data)
 
 # Configuration
 PROJECT_ID = os.getenv("PROJECT_ID", "local-project")
 TOPIC_ID = os.getenv("TOPIC_ID", "booking-events")
+# Opt-in, must match quota-manager: acquired quota is a hold the booking confirms,
+# and failed sagas leave it to expire instead of sending booking.compensate
+QUOTA_HOLDS = int(os.getenv("QUOTA_HOLD_SECONDS", "0")) > 0
+HOLD_EXPIRED_MESSAGE = "Discount quota hold expired before the booking was created. Please book again."
+
+# Outcomes of create_booking_record
+BOOKING_CREATED = "created"
+BOOKING_EXISTS = "exists"        # redelivered event, booking.completed already queued
+HOLD_EXPIRED = "hold_expired"
+
+# Pub/Sub Publisher, created on first use (or warmed up in the background at startup):
+# importing google.cloud.pubsub_v1 and building the client dominates cold start time
+publisher = None
+topic_path = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    global publisher, topic_path
+    with _publisher_lock:
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+            topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    return publisher, topic_path
 
-# Pub/Sub Publisher
-if pubsub_v1:
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-else:
-    publisher = None
-    topic_path = None
+# Per-transaction ordered event processing and delivery. Failures and compensation
+# lead to quota being released, so they run in the priority lane instead of
+# queueing behind new bookings.
+PRIORITY_EVENTS = {
+    "booking.validation.failed", "booking.pricing.failed", "booking.quota.failed",
+    "booking.compensate", "booking.quota.released"
+}
+
+def lane_for(event_type):
+    return PRIORITY_LANE if event_type in PRIORITY_EVENTS else DEFAULT_LANE
+
+scheduler = LaneScheduler(
+    capacity=int(os.getenv("EVENT_CONCURRENCY", "100")),
+    weights={
+        PRIORITY_LANE: int(os.getenv("PRIORITY_LANE_WEIGHT", "4")),
+        DEFAULT_LANE: int(os.getenv("DEFAULT_LANE_WEIGHT", "1"))
+    }
+)
+executor = KeyedExecutor(scheduler=scheduler)
+
+# Retrying event delivery with circuit breakers and a dead-letter store
+delivery = EventDelivery.from_env("booking-orchestrator", get_publisher)
 
 async def publish_event(event_data: dict):
     if PROJECT_ID == "local-project":
@@ -58,147 +76,296 @@ async def publish_event(event_data: dict):
              target_url = "http://127.0.0.1:8083/"
              
         if target_url:
-            import httpx
-            asyncio.create_task(send_local_event(target_url, event_data))
+            schedule_local_event(target_url, event_data)
         return
         
-    data_str = json.dumps(event_data)
-    data_bytes = data_str.encode("utf-8")
-    future = publisher.publish(
-        topic_path, 
-        data_bytes, 
-        event_type=event_data.get("event_type", "unknown"),
-        transaction_id=event_data.get("transaction_id", "")
-    )
-    future.result()
+    # Retried with backoff, dead-lettered if Pub/Sub stays unavailable
+    await delivery.deliver(PUBSUB, event_data)
 
-async def send_local_event(url, data):
-    import httpx
+# Best-effort status notifications in flight, referenced until done
+_notifications = set()
+
+async def send_status_changed(event):
     try:
-        # Simulate Pub/Sub message format
-        payload = {
-            "message": {
-                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
-                "attributes": {
-                    "event_type": data.get("event_type")
-                }
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json=payload)
+        # One attempt, no retries or dead letters
+        await delivery.send("http://127.0.0.1:8080/events", event)
     except Exception as e:
-        print(f"Failed to send local event to {url}: {e}")
+        print(f"status.changed for {event['transaction_id']} not delivered: {e!r}")
+
+def log_publish_failure(future):
+    if future.exception() is not None:
+        print(f"status.changed not published: {future.exception()!r}")
+
+async def notify_status_changed(transaction_id, seq, current_state):
+    """
+    Tell the api-gateway status cache that a transaction advanced. Fire and forget,
+    outside the transaction's executor key: a lost notification only delays the
+    cache until its TTL expires, and must not hold back the saga.
+    """
+    event = {
+        "event_type": "status.changed",
+        "transaction_id": str(transaction_id),
+        "seq": seq,
+        "current_state": current_state
+    }
+    if PROJECT_ID == "local-project":
+        task = asyncio.get_running_loop().create_task(send_status_changed(event))
+        _notifications.add(task)
+        task.add_done_callback(_notifications.discard)
+        return
+
+    client, path = get_publisher()
+    future = client.publish(
+        path,
+        json.dumps(event).encode("utf-8"),
+        event_type="status.changed",
+        transaction_id=str(transaction_id)
+    )
+    future.add_done_callback(log_publish_failure)
+
+def schedule_local_event(url, data):
+    # Deliveries for the same transaction go out in order, one at a time
+    executor.submit(data.get("transaction_id"), lambda: send_local_event(url, data), lane_for(data.get("event_type")))
+
+async def send_local_event(url, data):
+    # Retried with backoff, dead-lettered if the service stays unavailable
+    await delivery.deliver(url, data)
+
+
+# Top-level event fields kept in the compact status projection
+PROJECTED_FIELDS = ("reference_id", "error", "errors", "reason")
+# Fields lifted out of the nested `data` payload (pricing summary)
+PROJECTED_DATA_FIELDS = ("base_price", "final_price", "discount_eligible", "discount_percentage", "discount_reason")
+
+def project_event(seq, event_type, event):
+    """Build the compact status entry for an event instead of copying the whole payload."""
+    entry = {
+        "seq": seq,
+        "event_type": event_type,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    for field in PROJECTED_FIELDS:
+        if field in event:
+            entry[field] = event[field]
+
+    data = event.get("data")
+    if isinstance(data, dict):
+        for field in PROJECTED_DATA_FIELDS:
+            if field in data:
+                entry[field] = data[field]
+    return entry
 
 
 class SagaCoordinator:
     async def handle_event(self, event: dict):
         event_type = event['event_type']
         transaction_id = event['transaction_id']
-        
+
+        # quota-manager fast-rejects exhausted days from memory, so an instance that
+        # did not see the acquire can answer a redelivered booking.priced with a
+        # failure. The allocation is authoritative: drop such a stale failure.
+        if event_type == 'booking.quota.failed' and await self.check_quota_allocation(transaction_id):
+            print(f"Ignoring booking.quota.failed for {transaction_id}: quota already acquired")
+            return
+
         # Update state
         await self.update_state(transaction_id, event_type, event)
         
         # Handle completion
         if event_type in ['booking.quota.acquired', 'booking.quota.skipped']:
-            await self.create_booking(transaction_id, event['data'])
+            hold = QUOTA_HOLDS and event_type == 'booking.quota.acquired'
+            await self.create_booking(transaction_id, event['data'], hold)
         
         # Handle failures
         elif event_type in ['booking.validation.failed', 'booking.quota.failed', 'booking.pricing.failed']:
             await self.handle_failure(transaction_id, event)
 
-    def __init__(self):
-        self._mock_db = {}
+        elif event_type == 'booking.quota.released':
+            await self.record_release(transaction_id)
+
+    def __init__(self, router=None):
+        # Local mode saga state, shared between workers through LOCAL_STATE_DIR
+        self._mock_db = LocalSagaStore()
+        self.reference_ids = ReferenceIdGenerator()
+        self.rollups = DailyRollups(
+            self._mock_db,
+            flush_interval=float(os.getenv("ROLLUP_FLUSH_INTERVAL", "5")),
+            max_pending=int(os.getenv("ROLLUP_MAX_PENDING", "1000"))
+        )
+
+        # Per-shard cache, only used when this instance is the single writer of its
+        # transactions (sharding enabled); dropped for keys that move to another shard
+        self.router = router
+        self._cache = StateCache()
+        if router is not None:
+            router.on_rebalance = lambda: self._cache.evict(lambda tid: not router.owns(tid))
 
-    def get_mock_status(self, transaction_id):
-        return self._mock_db.get(str(transaction_id), {"current_state": "unknown", "events": []})
+    @property
+    def cache_enabled(self):
+        return self.router is not None and self.router.enabled
+
+    def _cached_record(self, tid):
+        if not self.cache_enabled:
+            return None
+        record = self._cache.get(tid)
+        if record is None:
+            status = self._mock_db.get_status(tid, 0)
+            if status is None:
+                return None
+            record = {"current_state": status["current_state"], "events": status["events"]}
+            self._cache.put(tid, record)
+        return record
+
+    def get_mock_status(self, transaction_id, since=0):
+        """Return state plus the projected events with seq > since (seq starts at 1)."""
+        tid = str(transaction_id)
+        since = max(since, 0)
+
+        record = self._cached_record(tid)
+        if record is not None:
+            events = record["events"]
+            return {
+                "current_state": record["current_state"],
+                "events": events[since:],
+                "last_seq": len(events)
+            }
+
+        status = self._mock_db.get_status(tid, since)
+        if status is None:
+            return {"current_state": "unknown", "events": [], "last_seq": 0}
+        return status
+
+    def get_mock_event_payload(self, transaction_id, seq):
+        """Full original event for a given seq, or None if unknown."""
+        return self._mock_db.get_payload(str(transaction_id), seq)
 
     async def update_state(self, transaction_id, event_type, event):
+        """
+        Record the event and make it the current state. Each event type happens once
+        per saga, so a redelivered event is not recorded again and cannot move the
+        state back (e.g. a late booking.quota.acquired after booking.completed).
+        """
         if os.getenv("PROJECT_ID") == "local-project":
             tid = str(transaction_id)
             print(f"[MOCK DB] Saga State Update: {tid} -> {event_type}")
-            if tid not in self._mock_db:
-                self._mock_db[tid] = {"current_state": "initiated", "events": []}
-            
-            self._mock_db[tid]["current_state"] = event_type
-            self._mock_db[tid]["events"].append({
-                "event_type": event_type,
-                "timestamp": datetime.utcnow().isoformat(),
-                "data": event
-            })
+            # Status polls only see the compact projection; the full payload is kept aside
+            entry = self._mock_db.append_event(
+                tid, event_type, event,
+                lambda seq: project_event(seq, event_type, event)
+            )
+            if entry is None:
+                return
+            if self.cache_enabled:
+                self._cache.append(tid, event_type, entry)
+            await notify_status_changed(tid, entry["seq"], event_type)
             return
 
+        from sqlalchemy import text
         async with get_db() as db:
-            # Upsert transaction state
-            # Simple assumption: we just log the event in transaction_events and update state
-            # For simplicity, just inserting event
-            stmt_event = text("""
-                INSERT INTO transaction_events (transaction_id, event_type, event_data)
-                VALUES (:tid, :etype, :edata)
-            """)
-            await db.execute(stmt_event, {
-                "tid": transaction_id,
-                "etype": event_type,
-                "edata": json.dumps(event)
-            })
-            
-            # Update current state
-            stmt_state = text("""
-                INSERT INTO transaction_state (transaction_id, current_state)
-                VALUES (:tid, :state)
-                ON CONFLICT (transaction_id) 
-                DO UPDATE SET current_state = :state, created_at = NOW()
-            """)
-            await db.execute(stmt_state, {
-                "tid": transaction_id,
-                "state": event_type
-            })
+            # Appends the event with the transaction's next seq and updates transaction_state
+            result = await db.execute(
+                text("SELECT record_transaction_event(:tid, :etype, CAST(:edata AS JSONB))"),
+                {"tid": transaction_id, "etype": event_type, "edata": json.dumps(event)}
+            )
+            seq = result.scalar()
+            if seq is None:
+                return
             await db.commit()
+        await notify_status_changed(transaction_id, seq, event_type)
+
+    def has_event(self, transaction_id, event_type):
+        """Local mode: whether the saga has recorded an event of this type."""
+        record = self._cached_record(str(transaction_id))
+        if record is not None:
+            return any(e["event_type"] == event_type for e in record["events"])
+        return self._mock_db.has_event(str(transaction_id), event_type)
 
     async def check_quota_allocation(self, transaction_id):
          if os.getenv("PROJECT_ID") == "local-project":
-            tid = str(transaction_id)
-            state = self._mock_db.get(tid)
-            if state:
-                for e in state["events"]:
-                    if e["event_type"] == "booking.quota.acquired":
-                        return True
-            return False
+            return self.has_event(transaction_id, "booking.quota.acquired")
 
+         from sqlalchemy import text
          async with get_db() as db:
             stmt = text("SELECT COUNT(*) FROM quota_allocations WHERE transaction_id = :tid AND released = FALSE")
             result = await db.execute(stmt, {"tid": transaction_id})
             count = result.scalar()
             return count > 0
 
+    async def record_release(self, transaction_id):
+        """Count released quota (compensated, or a hold that expired) in the daily rollups."""
+        if os.getenv("PROJECT_ID") == "local-project":
+            acquired = self._mock_db.find_payload(str(transaction_id), "booking.quota.acquired")
+        else:
+            from sqlalchemy import text
+            async with get_db() as db:
+                result = await db.execute(text("""
+                    SELECT event_data FROM transaction_events
+                    WHERE transaction_id = :tid AND event_type = 'booking.quota.acquired'
+                    ORDER BY id LIMIT 1
+                """), {"tid": transaction_id})
+                acquired = result.scalar()
+        if acquired:
+            self.rollups.record_release(acquired if isinstance(acquired, dict) else json.loads(acquired))
+
     async def handle_failure(self, transaction_id, event):
+        if QUOTA_HOLDS:
+            # An unconfirmed hold is reclaimed by quota-manager's reaper, no event needed
+            return
+
         # Check if quota was acquired
         quota_acquired = await self.check_quota_allocation(transaction_id)
         
         if quota_acquired:
             # Trigger compensation
-            await publish_event({
+            compensate_event = {
                 "event_type": "booking.compensate",
                 "transaction_id": transaction_id,
                 "timestamp": datetime.utcnow().isoformat(),
                 "reason": event.get('error')
-            })
+            }
+            if os.getenv("PROJECT_ID") == "local-project":
+                await publish_event(compensate_event)
+                return
+
+            # Durably queued; the outbox relay publishes it
+            async with get_db() as db:
+                await add_to_outbox(db, compensate_event)
+                await db.commit()
             
-    async def create_booking_record(self, transaction_id, ref_id, data):
+    async def confirm_hold_local(self, transaction_id):
+        import httpx
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.post(f"http://127.0.0.1:8083/quota/holds/{transaction_id}/confirm")
+            response.raise_for_status()
+            return response.json()["confirmed"]
+
+    async def create_booking_record(self, transaction_id, ref_id, data, completed_event, hold=False):
+         """
+         Idempotent per transaction. Returns BOOKING_CREATED, BOOKING_EXISTS (nothing
+         written again) or HOLD_EXPIRED (nothing written, the quota hold is gone).
+         """
          if os.getenv("PROJECT_ID") == "local-project":
+            if self.has_event(transaction_id, "booking.completed"):
+                return BOOKING_EXISTS
+            if hold and not await self.confirm_hold_local(transaction_id):
+                return HOLD_EXPIRED
             print(f"[MOCK DB] Booking Created! Ref: {ref_id}")
-            return
+            return BOOKING_CREATED
 
+         from sqlalchemy import text
          async with get_db() as db:
             stmt = text("""
                 INSERT INTO bookings (
                     transaction_id, user_name, user_gender, user_dob, 
                     service_ids, base_price, discount_applied, 
-                    discount_percentage, final_price, booking_status, reference_id
+                    discount_percentage, discount_reason, final_price, booking_status, reference_id
                 ) VALUES (
-                    :tid, :name, :gender, :dob, :sids, :bp, :da, :dp, :fp, :status, :ref
+                    :tid, :name, :gender, :dob, :sids, :bp, :da, :dp, :dr, :fp, :status, :ref
                 )
+                ON CONFLICT (transaction_id) DO NOTHING
+                RETURNING id
             """)
-            await db.execute(stmt, {
+            result = await db.execute(stmt, {
                 "tid": transaction_id,
                 "name": data.get('user_name'),
                 "gender": data.get('user_gender'),
@@ -208,18 +375,45 @@ class SagaCoordinator:
                 "bp": data.get('base_price'),
                 "da": data.get('discount_eligible', False),
                 "dp": data.get('discount_percentage', 0.0),
+                "dr": data.get('discount_reason'),
                 "fp": data.get('final_price'),
                 "status": "confirmed",
                 "ref": ref_id
             })
+            if result.scalar() is None:
+                await db.rollback()
+                return BOOKING_EXISTS
+
+            if hold:
+                # The hold becomes permanent only together with the booking
+                result = await db.execute(text("SELECT confirm_quota_hold(:tid)"), {"tid": transaction_id})
+                if not result.scalar():
+                    await db.rollback()
+                    return HOLD_EXPIRED
+
+            # booking.completed commits (or rolls back) together with the booking
+            await add_to_outbox(db, completed_event)
             await db.commit()
+         return BOOKING_CREATED
 
-    async def create_booking(self, transaction_id, data):
-        # Generate reference ID
-        ref_id = f"BK{datetime.now().strftime('%Y%m%d')}-{random.randint(100000,999999)}"
-        
-        # Create booking record
-        await self.create_booking_record(transaction_id, ref_id, data)
+    async def reject_expired_hold(self, transaction_id):
+        failed_event = {
+            "event_type": "booking.quota.failed",
+            "transaction_id": transaction_id,
+            "timestamp": datetime.utcnow().isoformat(),
+            "error": HOLD_EXPIRED_MESSAGE
+        }
+        if os.getenv("PROJECT_ID") == "local-project":
+            await self.update_state(transaction_id, "booking.quota.failed", failed_event)
+            return
+
+        async with get_db() as db:
+            await add_to_outbox(db, failed_event)
+            await db.commit()
+
+    async def create_booking(self, transaction_id, data, hold=False):
+        # Generate reference ID (unique per worker, no DB round trip)
+        ref_id = self.reference_ids.next_id()
         
         event_data = {
             "event_type": "booking.completed",
@@ -228,9 +422,18 @@ class SagaCoordinator:
             "reference_id": ref_id
         }
 
-        # Update local state so client sees it
+        # Create booking record (outside local mode, with booking.completed in the outbox)
+        outcome = await self.create_booking_record(transaction_id, ref_id, data, event_data, hold)
+        if outcome == BOOKING_EXISTS:
+            print(f"Booking for {transaction_id} already exists, ignoring duplicate")
+            return
+        if outcome == HOLD_EXPIRED:
+            # The discount was only priced in while the hold lasted
+            await self.reject_expired_hold(transaction_id)
+            return
+        self.rollups.record_booking(data)
+
+        # Local mode has no outbox: update state so client sees it and publish directly
         if os.getenv("PROJECT_ID") == "local-project":
             await self.update_state(transaction_id, "booking.completed", event_data)
-        
-        # Publish success
-        await publish_event(event_data)
+            await publish_event(event_data)
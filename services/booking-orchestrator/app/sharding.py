@@ -0,0 +1,189 @@
+import asyncio
+import bisect
+import hashlib
+import os
+
+VIRTUAL_NODES = 64
+FORWARDED_HEADER = "X-Shard-Forwarded"
+
+
+def _hash(key: str):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes, so a join/leave only moves ~1/N of the keys."""
+
+    def __init__(self, members=(), vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self.members = set()
+        self._points = []
+        self._owners = []
+        for member in members:
+            self.add(member)
+
+    def _rebuild(self):
+        points = sorted(
+            (_hash(f"{member}#{i}"), member)
+            for member in self.members
+            for i in range(self.vnodes)
+        )
+        self._points = [p for p, _ in points]
+        self._owners = [m for _, m in points]
+
+    def add(self, member: str):
+        if member in self.members:
+            return False
+        self.members.add(member)
+        self._rebuild()
+        return True
+
+    def remove(self, member: str):
+        if member not in self.members:
+            return False
+        self.members.discard(member)
+        self._rebuild()
+        return True
+
+    def owner(self, key: str):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class ShardUnavailable(Exception):
+    """The owning shard is a member but did not answer in time (busy, not gone)."""
+
+
+class ShardRouter:
+    """
+    Partitions sagas across orchestrator instances by transaction_id.
+
+    SHARD_SELF is this instance's base URL and SHARD_MEMBERS the comma-separated
+    base URLs of the initial members. Without SHARD_SELF sharding is disabled and
+    every transaction is handled locally.
+    Instances announce themselves on startup/shutdown (join/leave). A member is only
+    dropped from the ring without a leave when it refuses connections (its process is
+    gone, so it comes back with an empty cache); a slow or failing member keeps its
+    keys and the request fails instead, to be retried. probe() re-adds dropped
+    members once they answer /health again, so all rings converge on the live set.
+    """
+
+    def __init__(self, self_url: str = None, members: str = None):
+        self_url = self_url or os.getenv("SHARD_SELF")
+        members = members if members is not None else os.getenv("SHARD_MEMBERS", "")
+
+        self.self_url = self_url.rstrip("/") if self_url else None
+        self.ring = HashRing()
+        # Members that did not leave, probed to be re-added after they were unreachable
+        self.known = set()
+        # Called with no arguments after the ring changed
+        self.on_rebalance = None
+        if self.self_url:
+            self.ring.add(self.self_url)
+            for member in members.split(","):
+                if member.strip():
+                    self.add_member(member.strip())
+
+    @property
+    def enabled(self):
+        return self.self_url is not None and len(self.ring.members) > 1
+
+    def owner(self, transaction_id: str):
+        if not self.enabled:
+            return self.self_url
+        return self.ring.owner(str(transaction_id))
+
+    def owns(self, transaction_id: str):
+        return not self.enabled or self.owner(transaction_id) == self.self_url
+
+    def peers(self):
+        return sorted(m for m in self.ring.members if m != self.self_url)
+
+    def _changed(self):
+        if self.on_rebalance:
+            self.on_rebalance()
+
+    def add_member(self, url: str):
+        url = url.rstrip("/")
+        if not self.self_url or url == self.self_url:
+            return
+        self.known.add(url)
+        if self.ring.add(url):
+            print(f"[SHARD] Member joined: {url}")
+            self._changed()
+
+    def remove_member(self, url: str, left=True):
+        """Drop a member; one that left is also no longer probed until it joins again."""
+        url = url.rstrip("/")
+        if url == self.self_url:
+            return
+        if left:
+            self.known.discard(url)
+        if self.ring.remove(url):
+            print(f"[SHARD] Member {'left' if left else 'unreachable'}: {url}")
+            self._changed()
+
+    async def route(self, transaction_id: str, method: str, path: str, **kwargs):
+        """
+        Forward a request to the shard owning transaction_id.
+        Returns the owner's response, or None when this instance should handle it.
+        Raises ShardUnavailable when the owner is up but did not respond.
+        """
+        import httpx
+        while not self.owns(transaction_id):
+            owner = self.owner(transaction_id)
+            try:
+                async with httpx.AsyncClient() as client:
+                    return await client.request(
+                        method, f"{owner}{path}",
+                        headers={FORWARDED_HEADER: self.self_url}, **kwargs
+                    )
+            except httpx.ConnectError as e:
+                print(f"[SHARD] {owner} refused the connection: {e}")
+                self.remove_member(owner, left=False)
+            except httpx.HTTPError as e:
+                raise ShardUnavailable(f"Shard {owner} did not respond: {e!r}") from e
+        return None
+
+    async def probe(self):
+        """Re-add known members that answer /health, drop ring members that refuse connections."""
+        import httpx
+        async with httpx.AsyncClient(timeout=1.0) as client:
+            for member in sorted(self.known):
+                try:
+                    resp = await client.get(f"{member}/health")
+                except httpx.ConnectError:
+                    self.remove_member(member, left=False)
+                    continue
+                except httpx.HTTPError:
+                    # Slow is not gone: ring membership stays as it is
+                    continue
+                if resp.status_code == 200 and member in self.known:
+                    self.add_member(member)
+
+    async def run(self, interval=5.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.probe()
+            except Exception as e:
+                print(f"[SHARD] Probe failed: {e!r}")
+
+    async def announce(self, action: str):
+        """Tell the other members this instance joins or leaves ('join' / 'leave')."""
+        if not self.self_url:
+            return
+        import httpx
+        # Short timeout: peers may be shutting down at the same time
+        async with httpx.AsyncClient(timeout=1.0) as client:
+            for peer in self.peers():
+                try:
+                    resp = await client.post(f"{peer}/shards/{action}", json={"url": self.self_url})
+                    if action == "join" and resp.status_code == 200:
+                        for member in resp.json().get("members", []):
+                            self.add_member(member)
+                except Exception as e:
+                    # Peer may still be starting; the probe adds it once it is up
+                    print(f"[SHARD] Failed to announce {action} to {peer}: {e!r}")
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+
+
+class StateCache:
+    """
+    Bounded LRU of saga status (current state + projected events) per transaction.
+
+    Only safe when this instance is the single writer for the cached transactions,
+    i.e. for transactions owned by this shard. Entries must be evicted when
+    ownership moves to another shard.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, transaction_id: str):
+        record = self._entries.get(transaction_id)
+        if record is not None:
+            self._entries.move_to_end(transaction_id)
+        return record
+
+    def put(self, transaction_id: str, record: dict):
+        self._entries[transaction_id] = record
+        self._entries.move_to_end(transaction_id)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def append(self, transaction_id: str, event_type: str, entry: dict):
+        """Write-through for a new event; no-op if the transaction is not cached."""
+        record = self._entries.get(transaction_id)
+        if record is not None:
+            record["current_state"] = event_type
+            record["events"].append(entry)
+
+    def evict(self, predicate):
+        for transaction_id in [tid for tid in self._entries if predicate(tid)]:
+            del self._entries[transaction_id]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,394 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from fastapi import APIRouter, HTTPException
+from common.database import get_db
+from common.faults import FaultInjector
+from common.keyed_executor import slot_released
+
+# Destination of events published to the Pub/Sub topic (anything else is a local URL)
+PUBSUB = "pubsub"
+# Generous: a receiver may queue the event behind others of its transaction, and a
+# timed-out attempt is retried (consumers are idempotent, but duplicates cost work)
+LOCAL_DELIVERY_TIMEOUT = float(os.getenv("DELIVERY_TIMEOUT", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    destination TEXT NOT NULL,
+    event TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL,
+    failed_at TEXT NOT NULL
+);
+"""
+
+
+def load_event(value):
+    # JSONB comes back as a string from asyncpg unless a codec is registered
+    return value if isinstance(value, dict) else json.loads(value)
+
+
+class PermanentDeliveryError(Exception):
+    """The destination rejected the event (4xx); retrying would not help."""
+
+
+class DeliveryFailed(Exception):
+    """An event a client is waiting on was not delivered (and not dead-lettered)."""
+
+
+class CircuitBreaker:
+    """
+    Per-destination breaker. After `failure_threshold` consecutive failures it opens and
+    deliveries fail fast without touching the destination; after `reset_timeout` one
+    probe is let through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class LocalDeadLetterStore:
+    """
+    Dead letters for local mode (stands in for delivery_dead_letters).
+
+    SQLite like the other local stores: a file under LOCAL_STATE_DIR (shared by the
+    workers of one service), otherwise in memory of the current process.
+    """
+
+    def __init__(self, name: str, path: str = None):
+        if path is None:
+            state_dir = os.getenv("LOCAL_STATE_DIR")
+            path = os.path.join(state_dir, f"{name}-dead-letters.db") if state_dir else ":memory:"
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def add(self, destination: str, event: dict, error: str, attempts: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO dead_letters (destination, event, error, attempts, failed_at) VALUES (?, ?, ?, ?, ?)",
+                (destination, json.dumps(event), error, attempts, datetime.utcnow().isoformat())
+            )
+
+    def list(self, limit: int = 100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, destination, event, error, attempts, failed_at FROM dead_letters ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [
+            {"id": r[0], "destination": r[1], "event": json.loads(r[2]), "error": r[3], "attempts": r[4], "failed_at": r[5]}
+            for r in rows
+        ]
+
+    def take(self, entry_id: int = None):
+        """Remove and return one entry (or all entries when entry_id is None)."""
+        with self._lock:
+            if entry_id is None:
+                rows = self._conn.execute("SELECT id, destination, event FROM dead_letters ORDER BY id").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id, destination, event FROM dead_letters WHERE id = ?", (entry_id,)
+                ).fetchall()
+            self._conn.executemany("DELETE FROM dead_letters WHERE id = ?", [(r[0],) for r in rows])
+        return [(r[1], json.loads(r[2])) for r in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+
+class DeadLetterStore:
+    """
+    Events that could not be delivered, kept for inspection and replay: in the
+    delivery_dead_letters table, so they outlive the instance that failed to send
+    them, or in LocalDeadLetterStore in local mode. Rows are per service `name`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._local = None
+
+    @property
+    def local_store(self):
+        if self._local is None:
+            self._local = LocalDeadLetterStore(self.name)
+        return self._local
+
+    async def add(self, destination: str, event: dict, error: str, attempts: int):
+        if os.getenv("PROJECT_ID") == "local-project":
+            self.local_store.add(destination, event, error, attempts)
+            return
+
+        from sqlalchemy import text
+        async with get_db() as db:
+            await db.execute(text("""
+                INSERT INTO delivery_dead_letters (service, destination, event, error, attempts)
+                VALUES (:service, :destination, :event, :error, :attempts)
+            """), {"service": self.name, "destination": destination, "event": json.dumps(event),
+                   "error": error, "attempts": attempts})
+            await db.commit()
+
+    async def list(self, limit: int = 100):
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.local_store.list(limit)
+
+        from sqlalchemy import text
+        async with get_db(readonly=True) as db:
+            result = await db.execute(text("""
+                SELECT id, destination, event, error, attempts, failed_at FROM delivery_dead_letters
+                WHERE service = :service ORDER BY id LIMIT :limit
+            """), {"service": self.name, "limit": limit})
+            return [
+                {"id": r[0], "destination": r[1], "event": load_event(r[2]), "error": r[3],
+                 "attempts": r[4], "failed_at": r[5].isoformat()}
+                for r in result.fetchall()
+            ]
+
+    async def take(self, entry_id: int = None):
+        """Remove and return one entry (or all entries when entry_id is None)."""
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.local_store.take(entry_id)
+
+        from sqlalchemy import text
+        # Deleted and returned in one statement, so concurrent replays never share a row
+        async with get_db() as db:
+            result = await db.execute(text("""
+                DELETE FROM delivery_dead_letters
+                WHERE service = :service AND (CAST(:id AS BIGINT) IS NULL OR id = :id)
+                RETURNING destination, event
+            """), {"service": self.name, "id": entry_id})
+            rows = result.fetchall()
+            await db.commit()
+        return [(r[0], load_event(r[1])) for r in rows]
+
+    async def count(self):
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.local_store.count()
+
+        from sqlalchemy import text
+        async with get_db(readonly=True) as db:
+            result = await db.execute(
+                text("SELECT COUNT(*) FROM delivery_dead_letters WHERE service = :service"),
+                {"service": self.name}
+            )
+            return result.scalar()
+
+
+async def post_local_event(url, data):
+    """POST an event to a local service in Pub/Sub push format."""
+    import httpx
+    payload = {
+        "message": {
+            "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
+            "attributes": {
+                "event_type": data.get("event_type")
+            }
+        }
+    }
+    async with httpx.AsyncClient(timeout=LOCAL_DELIVERY_TIMEOUT) as client:
+        resp = await client.post(url, json=payload)
+    if 400 <= resp.status_code < 500:
+        raise PermanentDeliveryError(f"{resp.status_code} from {url}")
+    resp.raise_for_status()
+
+
+class EventDelivery:
+    """
+    Delivers events to a local service URL or to Pub/Sub (destination PUBSUB).
+
+    Failed attempts are retried with exponential backoff and full jitter (a random
+    delay up to base_delay * 2**attempt, capped at max_delay), so senders that failed
+    together do not all come back at the same moment. A per-destination circuit
+    breaker stops sending to a destination that keeps failing. At most `max_retrying`
+    deliveries wait for a retry at once; beyond that, and after `max_attempts`, the
+    event goes to the dead-letter store from where it can be replayed. Callers that
+    answer a client pass dead_letter=False and report the failure instead.
+
+    Callers run deliveries inside the per-transaction executor, so a retrying event
+    still holds back later events of the same transaction and order is kept; its
+    executor slot is lent to other transactions while it waits for the retry.
+    """
+
+    def __init__(self, dead_letters: DeadLetterStore, get_publisher=None, max_attempts=6,
+                 base_delay=0.5, max_delay=30.0, max_retrying=1000,
+                 failure_threshold=5, reset_timeout=10.0, faults: FaultInjector = None):
+        self.dead_letters = dead_letters
+        # Optional broker simulation for local capacity tests (LOCAL_FAULTS)
+        self.faults = faults
+        self.get_publisher = get_publisher
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retrying = max_retrying
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retrying = 0
+        self._breakers = {}
+
+    @classmethod
+    def from_env(cls, name: str, get_publisher=None):
+        return cls(
+            DeadLetterStore(name),
+            get_publisher,
+            max_attempts=int(os.getenv("DELIVERY_MAX_ATTEMPTS", "6")),
+            base_delay=float(os.getenv("DELIVERY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("DELIVERY_MAX_DELAY", "30")),
+            max_retrying=int(os.getenv("DELIVERY_MAX_RETRYING", "1000")),
+            failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", "10")),
+            faults=FaultInjector.from_env()
+        )
+
+    def breaker(self, destination):
+        breaker = self._breakers.get(destination)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self._breakers[destination] = breaker
+        return breaker
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def send(self, destination, event, on_late_failure=None):
+        """
+        One delivery attempt. `on_late_failure` takes over a delivery that the fault
+        injector held back and that failed after this returned.
+        """
+        if destination != PUBSUB:
+            if self.faults is not None:
+                await self.faults.send(destination, event, post_local_event, on_late_failure)
+            else:
+                await post_local_event(destination, event)
+            return
+        client, path = self.get_publisher()
+        future = client.publish(
+            path,
+            json.dumps(event).encode("utf-8"),
+            event_type=event.get("event_type", "unknown"),
+            transaction_id=event.get("transaction_id", "")
+        )
+        await asyncio.wrap_future(future)
+
+    async def deliver(self, destination, event, dead_letter=True):
+        """
+        Returns True once delivered, False if it was not: then the event has been
+        dead-lettered, or dropped with dead_letter=False. Raises if the dead letter
+        cannot be stored.
+        """
+        breaker = self.breaker(destination)
+        error = None
+        for attempt in range(self.max_attempts):
+            if breaker.allow():
+                try:
+                    await self.send(destination, event, on_late_failure=self.deliver)
+                    breaker.record_success()
+                    return True
+                except PermanentDeliveryError as e:
+                    error = str(e)
+                    break
+                except Exception as e:
+                    breaker.record_failure()
+                    error = f"{type(e).__name__}: {e}"
+            else:
+                error = error or "circuit open"
+
+            if attempt + 1 == self.max_attempts:
+                break
+            if self.retrying >= self.max_retrying:
+                error = f"retry queue full ({error})"
+                break
+            self.retrying += 1
+            try:
+                async with slot_released():
+                    await asyncio.sleep(self.backoff(attempt))
+            finally:
+                self.retrying -= 1
+
+        if not dead_letter:
+            print(f"Giving up on {event.get('event_type')} for {destination}: {error}", flush=True)
+            return False
+        print(f"Dead-lettering {event.get('event_type')} for {destination}: {error}", flush=True)
+        await self.dead_letters.add(destination, event, error, attempt + 1)
+        return False
+
+    async def replay(self, entry_id: int = None):
+        """Re-deliver dead letters; those failing again go back to the store."""
+        entries = await self.dead_letters.take(entry_id)
+        results = [await self.deliver(destination, event) for destination, event in entries]
+        return {"replayed": len(entries), "delivered": sum(results)}
+
+    async def stats(self):
+        return {
+            "retrying": self.retrying,
+            "injected_faults": self.faults.injected if self.faults is not None else None,
+            "dead_letters": await self.dead_letters.count(),
+            "breakers": {
+                destination: {"state": b.state, "failures": b.failures}
+                for destination, b in self._breakers.items()
+            }
+        }
+
+
+def delivery_routes(delivery: EventDelivery):
+    """Endpoints to inspect delivery health and replay dead letters."""
+    routes = APIRouter()
+
+    @routes.get("/delivery")
+    async def delivery_stats():
+        return await delivery.stats()
+
+    @routes.get("/dead-letters")
+    async def list_dead_letters(limit: int = 100):
+        return await delivery.dead_letters.list(limit)
+
+    @routes.post("/dead-letters/replay")
+    async def replay_dead_letters(id: int = None):
+        result = await delivery.replay(id)
+        if id is not None and result["replayed"] == 0:
+            raise HTTPException(status_code=404, detail="Dead letter not found")
+        return result
+
+    return routes
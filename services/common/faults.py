@@ -0,0 +1,171 @@
+import asyncio
+import json
+import math
+import os
+import random
+
+
+class InjectedFault(Exception):
+    """A delivery attempt lost on purpose; the retry path redelivers it like Pub/Sub would."""
+
+
+def latency_sampler(spec, rng):
+    """
+    Build a function returning a latency in seconds from a spec in milliseconds:
+      50                                           constant
+      {"dist": "uniform", "min": 50, "max": 200}
+      {"dist": "normal", "mean": 100, "stddev": 30}
+      {"dist": "lognormal", "median": 80, "p99": 400}   long tail
+    """
+    if spec is None:
+        return lambda: 0.0
+    if isinstance(spec, (int, float)):
+        return lambda: spec / 1000
+    dist = spec.get("dist", "constant")
+    if dist == "constant":
+        return lambda: spec["ms"] / 1000
+    if dist == "uniform":
+        return lambda: rng.uniform(spec["min"], spec["max"]) / 1000
+    if dist == "normal":
+        return lambda: max(0.0, rng.gauss(spec["mean"], spec["stddev"])) / 1000
+    if dist == "lognormal":
+        # p99 of a lognormal is median * exp(2.326 * sigma)
+        sigma = math.log(spec["p99"] / spec["median"]) / 2.326
+        return lambda: rng.lognormvariate(math.log(spec["median"]), sigma) / 1000
+    raise ValueError(f"unknown latency distribution {dist!r}")
+
+
+class Route:
+    def __init__(self, config, rng):
+        self.latency = latency_sampler(config.get("latency_ms"), rng)
+        self.drop_rate = config.get("drop_rate", 0.0)
+        self.duplicate_rate = config.get("duplicate_rate", 0.0)
+        self.reorder_window = config.get("reorder_window_ms", 0) / 1000
+        # Slow consumer: at most consumer_concurrency deliveries in flight, each
+        # taking consumer_delay_ms longer
+        self.consumer_delay = latency_sampler(config.get("consumer_delay_ms"), rng)
+        concurrency = config.get("consumer_concurrency")
+        self.consumer_slots = asyncio.Semaphore(concurrency) if concurrency else None
+
+
+class FaultInjector:
+    """
+    Makes the local event transport behave like a real broker, for capacity tests.
+
+    Driven by a JSON config file (LOCAL_FAULTS, see benchmarks/broker_faults.json).
+    Routes are matched by event type first, then by destination URL, then "default":
+
+      latency_ms           added before each delivery (see latency_sampler)
+      drop_rate            attempt fails and goes through retry/backoff (redelivery)
+      duplicate_rate       event is delivered a second time a little later
+      reorder_window_ms    delivery is detached from the per-transaction queue and
+                           delayed up to this window, so later events may overtake it;
+                           if it then fails, `on_failure` (the retry path) takes it over
+      consumer_delay_ms,   slow consumer: limited concurrency and extra time per delivery
+      consumer_concurrency
+
+    A "seed" makes the injected faults reproducible. "reordered" only counts held-back
+    events that a later event of the same transaction to the same destination overtook.
+    """
+
+    def __init__(self, config: dict):
+        self.rng = random.Random(config.get("seed"))
+        self.routes = {name: Route(route, self.rng) for name, route in config.get("routes", {}).items()}
+        if "default" in config:
+            self.routes["default"] = Route(config["default"], self.rng)
+        self.injected = {"dropped": 0, "duplicated": 0, "held_back": 0, "reordered": 0}
+        self._tasks = set()
+        # (destination, transaction_id) -> markers of its held-back deliveries in flight
+        self._held = {}
+
+    @classmethod
+    def from_env(cls):
+        path = os.getenv("LOCAL_FAULTS")
+        if not path:
+            return None
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def route_for(self, destination, event):
+        return (
+            self.routes.get(event.get("event_type"))
+            or self.routes.get(destination)
+            or self.routes.get("default")
+        )
+
+    def _detach(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, route, send, destination, event, overtakes=()):
+        await asyncio.sleep(route.latency())
+        if route.consumer_slots is None:
+            await send(destination, event)
+        else:
+            async with route.consumer_slots:
+                await asyncio.sleep(route.consumer_delay())
+                await send(destination, event)
+        self._overtook(overtakes)
+
+    @staticmethod
+    def _overtook(overtakes):
+        # Held-back events sent before the one just delivered are now out of order
+        for held in overtakes:
+            held["overtaken"] = True
+
+    async def _deliver_duplicate(self, route, send, destination, event):
+        await asyncio.sleep(route.latency())
+        try:
+            await self._deliver(route, send, destination, event)
+        except Exception as e:
+            # The original went through; losing the extra copy is harmless
+            print(f"Injected duplicate delivery to {destination} failed: {e}", flush=True)
+
+    async def _deliver_held(self, route, send, destination, event, key, held, overtakes, on_failure):
+        try:
+            await asyncio.sleep(self.rng.uniform(0, route.reorder_window))
+            await self._deliver(route, send, destination, event, overtakes)
+        except Exception as e:
+            if on_failure is None:
+                print(f"Injected late delivery to {destination} failed: {e}", flush=True)
+            else:
+                await on_failure(destination, event)
+        finally:
+            pending = self._held[key]
+            pending.remove(held)
+            if not pending:
+                del self._held[key]
+            if held["overtaken"]:
+                self.injected["reordered"] += 1
+
+    async def send(self, destination, event, send, on_failure=None):
+        """
+        Deliver `event` with the faults of its route. Errors of the delivery itself are
+        raised; a held-back delivery has already returned by the time it fails, so it
+        goes to the optional async `on_failure(destination, event)` instead.
+        """
+        route = self.route_for(destination, event)
+        key = (destination, event.get("transaction_id"))
+        overtakes = tuple(self._held.get(key, ()))
+        if route is None:
+            await send(destination, event)
+            self._overtook(overtakes)
+            return
+
+        if self.rng.random() < route.drop_rate:
+            self.injected["dropped"] += 1
+            await asyncio.sleep(route.latency())
+            raise InjectedFault(f"injected drop of {event.get('event_type')}")
+
+        if route.reorder_window:
+            self.injected["held_back"] += 1
+            held = {"overtaken": False}
+            self._held.setdefault(key, []).append(held)
+            self._detach(self._deliver_held(route, send, destination, event, key, held, overtakes, on_failure))
+        else:
+            await self._deliver(route, send, destination, event, overtakes)
+
+        if self.rng.random() < route.duplicate_rate:
+            self.injected["duplicated"] += 1
+            self._detach(self._deliver_duplicate(route, send, destination, event))
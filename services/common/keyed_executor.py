@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Slot of the KeyedExecutor job running in the current task, if any
+_current_slot = contextvars.ContextVar("keyed_executor_slot", default=None)
+
+
+class _Slot:
+    """The concurrency slot a job runs in; idle() lends it out while the job waits."""
+
+    def __init__(self, executor, lane):
+        self.executor = executor
+        self.lane = lane
+        self.task = asyncio.current_task()
+        self._held = None
+
+    async def __aenter__(self):
+        held = self.executor._slot(self.lane)
+        await held.__aenter__()
+        self._held = held
+        return self
+
+    async def __aexit__(self, *exc_info):
+        held, self._held = self._held, None
+        if held is not None:
+            await held.__aexit__(*exc_info)
+
+    @asynccontextmanager
+    async def idle(self):
+        await self.__aexit__(None, None, None)
+        try:
+            yield
+        finally:
+            await self.__aenter__()
+
+
+@asynccontextmanager
+async def slot_released():
+    """
+    Inside a KeyedExecutor job, give its concurrency slot to other keys while waiting
+    (e.g. a retry backoff). The job's own key stays blocked, so order is kept.
+    Anywhere else this does nothing.
+    """
+    slot = _current_slot.get()
+    if slot is None or slot.task is not asyncio.current_task():
+        yield
+        return
+    async with slot.idle():
+        yield
+
+
+class KeyedExecutor:
+    """
+    Runs async jobs strictly in submission order per key (transaction_id), while jobs
+    for different keys run concurrently, up to max_concurrency at a time.
+    A key's queue is dropped as soon as it runs empty, so idle keys cost nothing.
+
+    With a `scheduler` (see lanes.LaneScheduler) the concurrency slots are shared
+    between lanes by weight instead of first come, first served.
+    """
+
+    def __init__(self, max_concurrency=100, scheduler=None):
+        self.max_concurrency = max_concurrency
+        self.scheduler = scheduler
+        self._semaphore = None
+        self._queues = {}   # key -> deque of (job, future, lane)
+        self._tasks = set()  # keep drain tasks referenced until done
+
+    def submit(self, key, job, lane=None):
+        """
+        Queue `job` (a no-argument coroutine function) behind earlier jobs for `key`.
+        `lane` only matters with a scheduler: it decides which slot share the job waits for.
+        Returns a future with its result; callers may ignore it (fire and forget).
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None and self.scheduler is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        future = loop.create_future()
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append((job, future, lane))
+            return future
+
+        queue = deque([(job, future, lane)])
+        self._queues[key] = queue
+        task = loop.create_task(self._drain(key, queue))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def run(self, key, job, lane=None):
+        """Submit and wait for the result."""
+        return await self.submit(key, job, lane)
+
+    def _slot(self, lane):
+        if self.scheduler is not None:
+            return self.scheduler.slot(lane)
+        return self._semaphore
+
+    async def _drain(self, key, queue):
+        try:
+            while queue:
+                job, future, lane = queue.popleft()
+                if future.cancelled():
+                    continue
+                async with _Slot(self, lane) as slot:
+                    token = _current_slot.set(slot)
+                    try:
+                        result = await job()
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        _current_slot.reset(token)
+        finally:
+            # Idle queue: garbage-collect the key
+            if self._queues.get(key) is queue:
+                del self._queues[key]
+
+    @property
+    def active_keys(self):
+        return len(self._queues)
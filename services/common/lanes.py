@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+PRIORITY_LANE = "priority"
+DEFAULT_LANE = "default"
+
+
+class LaneScheduler:
+    """
+    Shares a fixed number of processing slots between lanes, e.g. "priority" for
+    compensation (frees quota) and "default" for new bookings (takes quota).
+
+    While slots are free every job starts immediately. Once they are all busy, each
+    freed slot is handed to a waiting job by smooth weighted round robin, so with
+    weights 4:1 a priority backlog gets four slots for every default one and is not
+    stuck behind thousands of queued acquisitions, while the default lane still
+    makes progress.
+    """
+
+    def __init__(self, capacity=100, weights=None):
+        self.capacity = capacity
+        self.weights = weights or {PRIORITY_LANE: 4, DEFAULT_LANE: 1}
+        self._in_use = 0
+        self._waiters = {lane: deque() for lane in self.weights}
+        self._current = {lane: 0 for lane in self.weights}
+        self._stats = {
+            lane: {"running": 0, "completed": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for lane in self.weights
+        }
+
+    @asynccontextmanager
+    async def slot(self, lane=None):
+        if lane not in self.weights:
+            lane = DEFAULT_LANE
+        queued_at = time.monotonic()
+
+        if self._in_use < self.capacity:
+            self._in_use += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[lane].append(future)
+            try:
+                # Resolved by _release, which hands its slot over as is
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()
+                elif future in self._waiters[lane]:
+                    self._waiters[lane].remove(future)
+                raise
+
+        stats = self._stats[lane]
+        wait = time.monotonic() - queued_at
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        stats["running"] += 1
+        try:
+            yield
+        finally:
+            stats["running"] -= 1
+            stats["completed"] += 1
+            self._release()
+
+    def _release(self):
+        lane = self._pick()
+        while lane is not None:
+            future = self._waiters[lane].popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+            lane = self._pick()
+        self._in_use -= 1
+
+    def _pick(self):
+        """Smooth weighted round robin over the lanes that have waiters."""
+        waiting = [lane for lane, queue in self._waiters.items() if queue]
+        if not waiting:
+            return None
+        total = sum(self.weights[lane] for lane in waiting)
+        for lane in waiting:
+            self._current[lane] += self.weights[lane]
+        best = max(waiting, key=lambda lane: self._current[lane])
+        self._current[best] -= total
+        return best
+
+    def stats(self):
+        lanes = {}
+        for lane, stats in self._stats.items():
+            started = stats["completed"] + stats["running"]
+            lanes[lane] = {
+                "weight": self.weights[lane],
+                "waiting": len(self._waiters[lane]),
+                "running": stats["running"],
+                "completed": stats["completed"],
+                "avg_wait_ms": round(stats["wait_total"] / started * 1000, 2) if started else 0.0,
+                "max_wait_ms": round(stats["wait_max"] * 1000, 2)
+            }
+        return {"capacity": self.capacity, "in_use": self._in_use, "lanes": lanes}
@@ -0,0 +1,202 @@
+import asyncio
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame):
+    """Stack of `frame` as 'outer;...;inner', the collapsed format flamegraph tools read."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads every `interval` seconds from a background thread.
+
+    Nothing is installed in the profiled threads (unlike cProfile), so the cost is one
+    sys._current_frames() call per interval and it is safe to run in production.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    self.stacks[f"{names.get(thread_id, thread_id)};{collapse(frame)}"] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task sleeping `interval` seconds."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lags = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    def report(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "mean_ms": round(statistics.mean(lags) * 1000, 2),
+            "p50_ms": round(lags[len(lags) // 2] * 1000, 2),
+            "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+            "max_ms": round(lags[-1] * 1000, 2),
+            "over_100ms": sum(1 for lag in lags if lag > 0.1)
+        }
+
+
+def awaiting(coro):
+    """Innermost coroutine a task is suspended in, with the line it waits on."""
+    while getattr(coro, "cr_await", None) is not None and hasattr(coro.cr_await, "cr_frame"):
+        coro = coro.cr_await
+    frame = getattr(coro, "cr_frame", None)
+    name = getattr(coro, "__qualname__", type(coro).__name__)
+    if frame is None:
+        return name
+    return f"{name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+def task_report():
+    """Pending asyncio tasks of this process grouped by coroutine and wait point."""
+    groups = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        groups[(getattr(coro, "__qualname__", repr(coro)), awaiting(coro))] += 1
+    return {
+        "total": sum(groups.values()),
+        "tasks": [
+            {"coroutine": coroutine, "awaiting": waiting, "count": count}
+            for (coroutine, waiting), count in groups.most_common()
+        ]
+    }
+
+
+def profiling_routes(name: str):
+    """
+    Admin endpoints to profile this worker on demand:
+
+      GET /debug/profile?seconds=10&mode=sample   collapsed stacks + event loop lag
+      GET /debug/profile?mode=cprofile             pstats of the event loop thread
+      GET /debug/tasks                             pending asyncio tasks
+
+    Disabled (404) unless PROFILING_TOKEN is set; requests must send it in
+    X-Profiling-Token. One profile runs at a time per worker and for at most
+    PROFILING_MAX_SECONDS. With several workers only the one receiving the request
+    is profiled (see "pid" in the response).
+    """
+    routes = APIRouter()
+    token = os.getenv("PROFILING_TOKEN")
+    max_seconds = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+    running = asyncio.Lock()
+
+    def authorize(request: Request):
+        if not token:
+            raise HTTPException(status_code=404, detail="Not Found")
+        # compare_digest raises TypeError on non-ASCII str; Starlette decodes headers as latin-1
+        supplied = request.headers.get("x-profiling-token", "").encode("latin-1")
+        if not hmac.compare_digest(supplied, token.encode()):
+            raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+    @routes.get("/debug/profile")
+    async def profile(request: Request, seconds: float = 10, mode: str = "sample",
+                      interval_ms: float = 10, format: str = "json"):
+        authorize(request)
+        if not 0 < seconds <= max_seconds:
+            raise HTTPException(status_code=400, detail=f"seconds must be in (0, {max_seconds:g}]")
+        if mode not in ("sample", "cprofile") or format not in ("json", "collapsed"):
+            raise HTTPException(status_code=400, detail="mode is sample|cprofile, format is json|collapsed")
+        if mode == "cprofile" and format == "collapsed":
+            raise HTTPException(status_code=400, detail="cprofile has no stacks, use mode=sample")
+        if running.locked():
+            raise HTTPException(status_code=409, detail="A profile is already running")
+
+        async with running:
+            monitor = LoopLagMonitor()
+            monitor_task = asyncio.create_task(monitor.run())
+            sampler = profiler = None
+            if mode == "sample":
+                sampler = StackSampler(max(interval_ms, 1) / 1000)
+                sampler.start()
+            else:
+                # Deterministic: every call on the event loop thread, at a noticeable cost
+                profiler = cProfile.Profile()
+                profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                if sampler is not None:
+                    sampler.stop()
+                if profiler is not None:
+                    profiler.disable()
+                monitor_task.cancel()
+            tasks = task_report()
+
+        if format == "collapsed":
+            return PlainTextResponse(
+                sampler.collapsed(),
+                headers={"Content-Disposition": f'attachment; filename="{name}-{os.getpid()}.collapsed"'}
+            )
+
+        result = {"service": name, "pid": os.getpid(), "mode": mode, "seconds": seconds}
+        if sampler is not None:
+            result["samples"] = sampler.samples
+            result["collapsed"] = sampler.collapsed()
+        else:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(50)
+            result["stats"] = out.getvalue()
+        result["loop_lag"] = monitor.report()
+        result["tasks"] = tasks
+        return result
+
+    @routes.get("/debug/tasks")
+    async def tasks(request: Request):
+        authorize(request)
+        return {"service": name, "pid": os.getpid(), "captured_at": time.time(), **task_report()}
+
+    return routes
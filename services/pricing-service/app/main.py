@@ -1,28 +1,56 @@
 import base64
 import json
 import os
+import threading
 import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-try:
-    from google.cloud import pubsub_v1
-except ImportError:
-    pubsub_v1 = None
 from datetime import datetime
 from app.pricing_engine import PricingEngine
+from common.keyed_executor import KeyedExecutor
+from common.delivery import EventDelivery, PUBSUB, delivery_routes
+from common.profiling import profiling_routes
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Outside local mode, build the Pub/Sub client in the background so neither
+    # startup nor the first request waits for it
+    if PROJECT_ID != "local-project":
+        asyncio.get_running_loop().run_in_executor(None, get_publisher)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
 
 # Configuration
 PROJECT_ID = os.getenv("PROJECT_ID", "local-project")
 TOPIC_ID = os.getenv("TOPIC_ID", "booking-events")
 
-# Pub/Sub Publisher
-if pubsub_v1:
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-else:
-    publisher = None
-    topic_path = None
+# Pub/Sub Publisher, created on first use (or warmed up in the background at startup):
+# importing google.cloud.pubsub_v1 and building the client dominates cold start time
+publisher = None
+topic_path = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    global publisher, topic_path
+    with _publisher_lock:
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+            topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    return publisher, topic_path
+
+# Per-transaction ordered event delivery
+executor = KeyedExecutor(int(os.getenv("EVENT_CONCURRENCY", "100")))
+
+# Retrying event delivery with circuit breakers and a dead-letter store
+delivery = EventDelivery.from_env("pricing-service", get_publisher)
+app.include_router(delivery_routes(delivery))
+app.include_router(profiling_routes("pricing-service"))
 
 pricing_engine = PricingEngine()
 
@@ -37,39 +65,22 @@ async def publish_event(event_data: dict):
         elif event_type == "booking.priced":
              target_url = "http://127.0.0.1:8083/"
              # Also send to Orchestrator for tracking
-             asyncio.create_task(send_local_event("http://127.0.0.1:8084/", event_data))
+             schedule_local_event("http://127.0.0.1:8084/", event_data)
              
         if target_url:
-            import httpx
-            asyncio.create_task(send_local_event(target_url, event_data))
+            schedule_local_event(target_url, event_data)
         return
         
-    data_str = json.dumps(event_data)
-    data_bytes = data_str.encode("utf-8")
-    future = publisher.publish(
-        topic_path, 
-        data_bytes, 
-        event_type=event_data.get("event_type", "unknown"),
-        transaction_id=event_data.get("transaction_id", "")
-    )
-    future.result()
+    # Retried with backoff, dead-lettered if Pub/Sub stays unavailable
+    await delivery.deliver(PUBSUB, event_data)
+
+def schedule_local_event(url, data):
+    # Deliveries for the same transaction go out in order, one at a time
+    executor.submit(data.get("transaction_id"), lambda: send_local_event(url, data))
 
 async def send_local_event(url, data):
-    import httpx
-    try:
-        # Simulate Pub/Sub message format
-        payload = {
-            "message": {
-                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
-                "attributes": {
-                    "event_type": data.get("event_type")
-                }
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json=payload)
-    except Exception as e:
-        print(f"Failed to send local event to {url}: {e}")
+    # Retried with backoff, dead-lettered if the service stays unavailable
+    await delivery.deliver(url, data)
 
 
 @app.post("/")
@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_quota (
+    quota_date TEXT PRIMARY KEY,
+    discounts_used INTEGER NOT NULL DEFAULT 0,
+    max_discounts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quota_calendar (
+    quota_date TEXT PRIMARY KEY,
+    max_discounts INTEGER NOT NULL,
+    note TEXT
+);
+CREATE TABLE IF NOT EXISTS quota_allocations (
+    transaction_id TEXT PRIMARY KEY,
+    quota_date TEXT NOT NULL,
+    released INTEGER NOT NULL DEFAULT 0,
+    expires_at REAL,
+    confirmed_at REAL
+);
+"""
+
+
+class LocalQuotaStore:
+    """
+    Quota counters for local mode, mirroring the quota functions in functions.sql.
+
+    Backed by SQLite so several quota-manager workers started by run_local.py share one
+    counter: set LOCAL_STATE_DIR and every worker opens the same file. Without it the
+    store lives in memory of the current process.
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            state_dir = os.getenv("LOCAL_STATE_DIR")
+            path = os.path.join(state_dir, "quota.db") if state_dir else ":memory:"
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self, fn):
+        with self._lock:
+            cur = self._conn.cursor()
+            # IMMEDIATE takes the write lock up front, like SELECT ... FOR UPDATE
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(cur)
+                cur.execute("COMMIT")
+                return result
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def acquire(self, quota_date: str, max_discounts: int, transaction_id: str, hold_seconds: float = None):
+        """
+        Returns (acquired, discounts_used). max_discounts only applies to a day that
+        was not provisioned; otherwise the day's own cap is used. With hold_seconds
+        the allocation is a hold that reap() reclaims unless confirmed in time.
+        """
+        expires_at = time.time() + hold_seconds if hold_seconds else None
+        increment = """
+            UPDATE daily_quota SET discounts_used = discounts_used + 1
+            WHERE quota_date = ? AND discounts_used < max_discounts
+            RETURNING discounts_used
+        """
+
+        def run(cur):
+            # Idempotent per transaction: a redelivered booking.priced gets the first outcome
+            existing = cur.execute(
+                "SELECT released, quota_date FROM quota_allocations WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone()
+            if existing is not None:
+                return (not existing[0], self._used(cur, existing[1]))
+
+            row = cur.execute(increment, (quota_date,)).fetchone()
+            if row is None:
+                # Either full or not provisioned yet; retry the increment either way
+                cur.execute(
+                    "INSERT OR IGNORE INTO daily_quota (quota_date, max_discounts) VALUES (?, ?)",
+                    (quota_date, max_discounts)
+                )
+                row = cur.execute(increment, (quota_date,)).fetchone()
+                if row is None:
+                    return (False, self._used(cur, quota_date))
+
+            cur.execute(
+                "INSERT INTO quota_allocations (transaction_id, quota_date, expires_at) VALUES (?, ?, ?)",
+                (transaction_id, quota_date, expires_at)
+            )
+            return (True, row[0])
+
+        return self._transaction(run)
+
+    def allocated(self, transaction_id: str):
+        """True if the transaction holds an unreleased allocation."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM quota_allocations WHERE transaction_id = ? AND released = 0", (transaction_id,)
+            ).fetchone() is not None
+
+    def _used(self, cur, quota_date: str):
+        return cur.execute("SELECT discounts_used FROM daily_quota WHERE quota_date = ?", (quota_date,)).fetchone()[0]
+
+    def provision(self, days: list, default_max: int):
+        """Create daily_quota rows for `days` (ISO dates) that do not exist yet. Returns how many."""
+        def run(cur):
+            created = 0
+            for day in days:
+                cur.execute("""
+                    INSERT OR IGNORE INTO daily_quota (quota_date, max_discounts)
+                    SELECT ?, COALESCE((SELECT max_discounts FROM quota_calendar WHERE quota_date = ?), ?)
+                """, (day, day, default_max))
+                created += cur.rowcount
+            return created
+
+        return self._transaction(run)
+
+    def set_cap(self, quota_date: str, max_discounts: int, note: str = None):
+        def run(cur):
+            cur.execute(
+                "INSERT OR REPLACE INTO quota_calendar (quota_date, max_discounts, note) VALUES (?, ?, ?)",
+                (quota_date, max_discounts, note)
+            )
+            cur.execute("""
+                INSERT INTO daily_quota (quota_date, max_discounts) VALUES (?, ?)
+                ON CONFLICT (quota_date) DO UPDATE SET max_discounts = excluded.max_discounts
+            """, (quota_date, max_discounts))
+
+        self._transaction(run)
+
+    def calendar(self, start: str, end: str):
+        """Provisioned days in [start, end] with their usage."""
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT q.quota_date, q.discounts_used, q.max_discounts, c.note
+                FROM daily_quota q LEFT JOIN quota_calendar c ON c.quota_date = q.quota_date
+                WHERE q.quota_date BETWEEN ? AND ?
+                ORDER BY q.quota_date
+            """, (start, end)).fetchall()
+        return [{"quota_date": r[0], "discounts_used": r[1], "max_discounts": r[2], "note": r[3]} for r in rows]
+
+    def release(self, transaction_id: str):
+        """Returns True if an unreleased allocation was released."""
+        def run(cur):
+            row = cur.execute(
+                "SELECT quota_date, released FROM quota_allocations WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone()
+            if row is None or row[1]:
+                return False
+
+            cur.execute(
+                "UPDATE daily_quota SET discounts_used = discounts_used - 1 WHERE quota_date = ?", (row[0],)
+            )
+            cur.execute("UPDATE quota_allocations SET released = 1 WHERE transaction_id = ?", (transaction_id,))
+            return True
+
+        return self._transaction(run)
+
+    def release_many(self, transaction_ids: list):
+        """Like release_quota_batch: one decrement per day. Returns the ids actually released."""
+        def run(cur):
+            placeholders = ", ".join("?" * len(transaction_ids))
+            rows = cur.execute(
+                f"SELECT transaction_id, quota_date FROM quota_allocations "
+                f"WHERE released = 0 AND transaction_id IN ({placeholders})",
+                transaction_ids
+            ).fetchall()
+            per_day = Counter(quota_date for _, quota_date in rows)
+            cur.executemany(
+                "UPDATE daily_quota SET discounts_used = discounts_used - ? WHERE quota_date = ?",
+                [(count, quota_date) for quota_date, count in per_day.items()]
+            )
+            cur.executemany(
+                "UPDATE quota_allocations SET released = 1 WHERE transaction_id = ?",
+                [(transaction_id,) for transaction_id, _ in rows]
+            )
+            return [transaction_id for transaction_id, _ in rows]
+
+        if not transaction_ids:
+            return []
+        return self._transaction(run)
+
+    def confirm(self, transaction_id: str):
+        """Like confirm_quota_hold: False if the transaction holds no quota any more."""
+        def run(cur):
+            now = time.time()
+            cur.execute(
+                "UPDATE quota_allocations SET confirmed_at = COALESCE(confirmed_at, ?), expires_at = NULL "
+                "WHERE transaction_id = ? AND released = 0 AND (expires_at IS NULL OR expires_at > ?)",
+                (now, transaction_id, now)
+            )
+            return cur.rowcount > 0
+
+        return self._transaction(run)
+
+    def reap(self, limit: int):
+        """Like reap_quota_holds: release up to `limit` expired holds. Returns their ids."""
+        def run(cur):
+            rows = cur.execute(
+                "SELECT transaction_id, quota_date FROM quota_allocations "
+                "WHERE released = 0 AND confirmed_at IS NULL AND expires_at < ? LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+            per_day = Counter(quota_date for _, quota_date in rows)
+            cur.executemany(
+                "UPDATE daily_quota SET discounts_used = discounts_used - ? WHERE quota_date = ?",
+                [(count, quota_date) for quota_date, count in per_day.items()]
+            )
+            cur.executemany(
+                "UPDATE quota_allocations SET released = 1 WHERE transaction_id = ?",
+                [(transaction_id,) for transaction_id, _ in rows]
+            )
+            return [transaction_id for transaction_id, _ in rows]
+
+        return self._transaction(run)
@@ -1,31 +1,145 @@
 import base64
 import json
 import os
+import threading
 import asyncio
-from fastapi import FastAPI, Request
-try:
-    from google.cloud import pubsub_v1
-except ImportError:
-    pubsub_v1 = None
-from datetime import datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from datetime import datetime, date, timedelta
 from uuid import UUID
 from app.quota_manager import QuotaManager
+from app.quota_calendar import QuotaCalendar, parse_caps
+from app.release_batcher import ReleaseBatcher
+from app.hold_reaper import HoldReaper
+from common.keyed_executor import KeyedExecutor
+from common.delivery import EventDelivery, PUBSUB, delivery_routes
+from common.profiling import profiling_routes
+from common.database import router as db_router
+from common.lanes import LaneScheduler, PRIORITY_LANE, DEFAULT_LANE
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Outside local mode, build the Pub/Sub client in the background so neither
+    # startup nor the first request waits for it
+    if PROJECT_ID != "local-project":
+        asyncio.get_running_loop().run_in_executor(None, get_publisher)
+    # Provision upcoming quota days and roll the cached IST day over at midnight
+    calendar_task = asyncio.create_task(quota_calendar.run())
+    # Reclaim holds of sagas that never created their booking
+    reaper_task = asyncio.create_task(hold_reaper.run()) if quota_manager.hold_seconds else None
+    yield
+    calendar_task.cancel()
+    if reaper_task:
+        reaper_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/lanes")
+async def lane_metrics():
+    """Per-lane queue depth, throughput and wait times of event processing."""
+    return scheduler.stats()
+
+@app.get("/db")
+async def db_metrics():
+    """Sessions, latency and replication lag per database, and how reads were routed."""
+    return db_router.stats()
 
 # Configuration
 PROJECT_ID = os.getenv("PROJECT_ID", "local-project")
 TOPIC_ID = os.getenv("TOPIC_ID", "booking-events")
 
-# Pub/Sub Publisher
-if pubsub_v1:
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-else:
-    publisher = None
-    topic_path = None
+# Pub/Sub Publisher, created on first use (or warmed up in the background at startup):
+# importing google.cloud.pubsub_v1 and building the client dominates cold start time
+publisher = None
+topic_path = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    global publisher, topic_path
+    with _publisher_lock:
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+            topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    return publisher, topic_path
+
+# Per-transaction ordered event processing and delivery. Compensation frees quota,
+# so it runs in the priority lane instead of queueing behind new acquisitions.
+PRIORITY_EVENTS = {"booking.compensate", "booking.quota.released", "quota.available"}
+
+def lane_for(event_type):
+    return PRIORITY_LANE if event_type in PRIORITY_EVENTS else DEFAULT_LANE
+
+scheduler = LaneScheduler(
+    capacity=int(os.getenv("EVENT_CONCURRENCY", "100")),
+    weights={
+        PRIORITY_LANE: int(os.getenv("PRIORITY_LANE_WEIGHT", "4")),
+        DEFAULT_LANE: int(os.getenv("DEFAULT_LANE_WEIGHT", "1"))
+    }
+)
+executor = KeyedExecutor(scheduler=scheduler)
+
+# Retrying event delivery with circuit breakers and a dead-letter store
+delivery = EventDelivery.from_env("quota-manager", get_publisher)
+app.include_router(delivery_routes(delivery))
+app.include_router(profiling_routes("quota-manager"))
+
+quota_manager = QuotaManager(
+    max_discounts=int(os.getenv("QUOTA_DEFAULT_MAX", "100")),
+    exhausted_ttl=float(os.getenv("QUOTA_EXHAUSTED_TTL", "30")),
+    hold_seconds=int(os.getenv("QUOTA_HOLD_SECONDS", "0")),
+    acquired_cache_size=int(os.getenv("QUOTA_ACQUIRED_CACHE", "10000"))
+)
+quota_calendar = QuotaCalendar(
+    quota_manager,
+    days_ahead=int(os.getenv("QUOTA_PROVISION_DAYS", "14")),
+    caps=parse_caps(os.getenv("QUOTA_DAY_CAPS"))
+)
+# Concurrent compensations are released together, one decrement per quota day
+release_batcher = ReleaseBatcher(quota_manager, max_batch=int(os.getenv("QUOTA_RELEASE_BATCH", "500")))
+hold_reaper = HoldReaper(
+    quota_manager,
+    interval=float(os.getenv("QUOTA_REAP_INTERVAL", "10")),
+    batch=int(os.getenv("QUOTA_REAP_BATCH", "500"))
+)
+
+@app.get("/quota/releases")
+async def release_metrics():
+    """Batched release counters (mean_batch shows how much compensations coalesce)."""
+    return release_batcher.stats()
+
+@app.get("/quota/holds")
+async def hold_metrics():
+    """Hold expiry settings and how many expired holds the reaper reclaimed."""
+    return hold_reaper.stats()
+
+@app.post("/quota/holds/{transaction_id}/confirm")
+async def confirm_hold(transaction_id: UUID):
+    """
+    Make a hold permanent (local mode; with Postgres the orchestrator confirms in the
+    transaction that creates the booking).
+    """
+    return {"confirmed": bool(await quota_manager.confirm_hold(transaction_id))}
 
-quota_manager = QuotaManager()
+@app.get("/quota/calendar")
+async def get_quota_calendar(days: int = 14):
+    """Provisioned quota days from today (IST) with usage and caps."""
+    start = quota_manager.today
+    return await quota_calendar.get_days(start, start + timedelta(days=days - 1))
+
+@app.put("/quota/calendar/{quota_date}")
+async def set_quota_cap(quota_date: date, request: Request):
+    """Override the discount cap of one day (holiday, campaign)."""
+    body = await request.json()
+    max_discounts = body.get("max_discounts")
+    if not isinstance(max_discounts, int) or max_discounts < 0:
+        raise HTTPException(status_code=400, detail="max_discounts must be a non-negative integer")
+    await quota_calendar.set_cap(quota_date, max_discounts, body.get("note"))
+    return {"quota_date": quota_date.isoformat(), "max_discounts": max_discounts}
 
 async def publish_event(event_data: dict):
     if PROJECT_ID == "local-project":
@@ -36,38 +150,23 @@ async def publish_event(event_data: dict):
         # Quota outcomes go to Orchestrator
         if event_type in ["booking.quota.acquired", "booking.quota.skipped", "booking.quota.failed", "booking.quota.released"]:
              target_url = "http://127.0.0.1:8084/"
+        # Quota signals (quota.exhausted/available) are not sent: run_local.py starts a
+        # single quota-manager worker, which has already applied the flag itself
              
         if target_url:
-            import httpx
-            asyncio.create_task(send_local_event(target_url, event_data))
+            schedule_local_event(target_url, event_data)
         return
         
-    data_str = json.dumps(event_data)
-    data_bytes = data_str.encode("utf-8")
-    future = publisher.publish(
-        topic_path, 
-        data_bytes, 
-        event_type=event_data.get("event_type", "unknown"),
-        transaction_id=event_data.get("transaction_id", "")
-    )
-    future.result()
+    # Retried with backoff, dead-lettered if Pub/Sub stays unavailable
+    await delivery.deliver(PUBSUB, event_data)
+
+def schedule_local_event(url, data):
+    # Deliveries for the same transaction go out in order, one at a time
+    executor.submit(data.get("transaction_id"), lambda: send_local_event(url, data), lane_for(data.get("event_type")))
 
 async def send_local_event(url, data):
-    import httpx
-    try:
-        # Simulate Pub/Sub message format
-        payload = {
-            "message": {
-                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
-                "attributes": {
-                    "event_type": data.get("event_type")
-                }
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json=payload)
-    except Exception as e:
-        print(f"Failed to send local event to {url}: {e}")
+    # Retried with backoff, dead-lettered if the service stays unavailable
+    await delivery.deliver(url, data)
 
 
 @app.post("/")
@@ -86,13 +185,28 @@ async def receive_event(request: Request):
     
     event_type = event.get("event_type")
     
+    # Acquire and compensation for one transaction never overlap
     if event_type == "booking.priced":
-        await handle_booking_priced(event)
+        await executor.run(event['transaction_id'], lambda: handle_booking_priced(event), DEFAULT_LANE)
     elif event_type == "booking.compensate":
-        await handle_compensation(event)
+        await executor.run(event['transaction_id'], lambda: handle_compensation(event), PRIORITY_LANE)
+    elif event_type == "quota.exhausted":
+        quota_manager.mark_exhausted(date.fromisoformat(event['quota_date']))
+    elif event_type == "quota.available":
+        quota_manager.mark_available(date.fromisoformat(event['quota_date']) if event.get('quota_date') else None)
         
     return {"status": "processed"}
 
+async def broadcast_exhausted(quota_date: date):
+    """Tell other instances to fast-reject discount requests for quota_date"""
+    await publish_event({
+        "event_type": "quota.exhausted",
+        "quota_date": quota_date.isoformat(),
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+quota_manager.on_exhausted = broadcast_exhausted
+
 async def handle_booking_priced(event: dict):
     print(f"Processing event: {event}")
     data = event['data']
@@ -131,7 +245,7 @@ async def handle_compensation(event: dict):
     """Handle compensation request"""
     print(f"Compensating event: {event}")
     transaction_id = UUID(event['transaction_id'])
-    released = await quota_manager.release_quota(transaction_id)
+    released = await release_batcher.release(transaction_id)
     
     if released:
         await publish_event({
@@ -139,3 +253,28 @@ async def handle_compensation(event: dict):
             "transaction_id": event['transaction_id'],
             "timestamp": datetime.utcnow().isoformat()
         })
+
+async def broadcast_available(released_ids):
+    """One quota.available per released batch, not per compensation"""
+    await publish_event({
+        "event_type": "quota.available",
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+release_batcher.on_released = broadcast_available
+
+async def broadcast_reaped(reaped_ids):
+    """booking.quota.released for each reclaimed hold (saga state, rollups), one quota.available per batch"""
+    timestamp = datetime.utcnow().isoformat()
+    await asyncio.gather(*(
+        publish_event({
+            "event_type": "booking.quota.released",
+            "transaction_id": transaction_id,
+            "timestamp": timestamp,
+            "reason": "Quota hold expired"
+        })
+        for transaction_id in reaped_ids
+    ))
+    await broadcast_available(reaped_ids)
+
+hold_reaper.on_reaped = broadcast_reaped
@@ -0,0 +1,97 @@
+import asyncio
+import os
+from datetime import datetime, date, time, timedelta
+from common.database import get_db
+
+
+def parse_caps(spec: str):
+    """Parse per-day caps like "2026-12-25=0,2026-11-14=200" into {date: cap}."""
+    caps = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        day, cap = item.split("=")
+        caps[date.fromisoformat(day.strip())] = int(cap)
+    return caps
+
+
+class QuotaCalendar:
+    """
+    Keeps daily_quota rows provisioned ahead of time and rolls the cached IST day.
+
+    On start and at every IST midnight, the next `days_ahead` days are created with
+    the default cap, or with their override (holidays, campaigns) from `caps` and
+    from caps set at runtime via set_cap. acquire_quota then always finds the row
+    of the day and only has to lock and increment it.
+    """
+
+    def __init__(self, quota_manager, days_ahead=14, caps=None):
+        self.quota_manager = quota_manager
+        self.days_ahead = days_ahead
+        self.caps = caps or {}
+
+    def seconds_until_rollover(self):
+        now = datetime.now(self.quota_manager.ist)
+        midnight = datetime.combine(now.date() + timedelta(days=1), time.min, tzinfo=self.quota_manager.ist)
+        return (midnight - now).total_seconds()
+
+    async def provision(self):
+        """Apply configured caps and create the upcoming days. Returns the number of days created."""
+        today = self.quota_manager.today
+        for day, cap in self.caps.items():
+            if today <= day < today + timedelta(days=self.days_ahead):
+                await self.set_cap(day, cap)
+
+        if os.getenv("PROJECT_ID") == "local-project":
+            days = [(today + timedelta(days=i)).isoformat() for i in range(self.days_ahead)]
+            return self.quota_manager.local_store.provision(days, self.quota_manager.max_discounts)
+
+        from sqlalchemy import text
+        async with get_db() as db:
+            result = await db.execute(
+                text("SELECT provision_quota_days(:p_start, :p_days, :p_default_max)"),
+                {"p_start": today, "p_days": self.days_ahead, "p_default_max": self.quota_manager.max_discounts}
+            )
+            await db.commit()
+            return result.scalar()
+
+    async def set_cap(self, quota_date: date, max_discounts: int, note: str = None):
+        if os.getenv("PROJECT_ID") == "local-project":
+            self.quota_manager.local_store.set_cap(quota_date.isoformat(), max_discounts, note)
+        else:
+            from sqlalchemy import text
+            async with get_db() as db:
+                await db.execute(
+                    text("SELECT set_quota_cap(:p_date, :p_max, :p_note)"),
+                    {"p_date": quota_date, "p_max": max_discounts, "p_note": note}
+                )
+                await db.commit()
+        # A raised cap may make an exhausted day available again
+        self.quota_manager.mark_available(quota_date)
+
+    async def get_days(self, start: date, end: date):
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.quota_manager.local_store.calendar(start.isoformat(), end.isoformat())
+
+        from sqlalchemy import text
+        # Read-only view, a replica within the lag bound will do
+        async with get_db(readonly=True) as db:
+            result = await db.execute(text("""
+                SELECT q.quota_date, q.discounts_used, q.max_discounts, c.note
+                FROM daily_quota q LEFT JOIN quota_calendar c ON c.quota_date = q.quota_date
+                WHERE q.quota_date BETWEEN :start AND :end
+                ORDER BY q.quota_date
+            """), {"start": start, "end": end})
+            return [
+                {"quota_date": r[0].isoformat(), "discounts_used": r[1], "max_discounts": r[2], "note": r[3]}
+                for r in result.fetchall()
+            ]
+
+    async def run(self):
+        """Provision now, then roll the day over and provision again at every IST midnight."""
+        while True:
+            try:
+                created = await self.provision()
+                print(f"Quota calendar: {self.quota_manager.today}, provisioned {created} new day(s)", flush=True)
+            except Exception as e:
+                print(f"Quota calendar provisioning failed: {e}", flush=True)
+            await asyncio.sleep(self.seconds_until_rollover())
+            self.quota_manager.roll_over()
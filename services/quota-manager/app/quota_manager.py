@@ -1,66 +1,138 @@
-import pytz
 import os
-from datetime import datetime
+import time
+from collections import OrderedDict
+from datetime import datetime, date, timedelta, timezone
 from uuid import UUID
-from sqlalchemy import text
-from app.database import get_db
+from common.database import get_db
+from app.local_store import LocalQuotaStore
+
+QUOTA_REACHED_MESSAGE = "Daily discount quota reached. Please try again tomorrow."
+
+# IST is a fixed UTC+05:30 offset (no DST), so pytz is not needed
+IST = timezone(timedelta(hours=5, minutes=30), 'IST')
 
 class QuotaManager:
-    def __init__(self, max_discounts=100):
+    def __init__(self, max_discounts=100, exhausted_ttl=30.0, hold_seconds=None, acquired_cache_size=10000):
         self.max_discounts = max_discounts
-        self.ist = pytz.timezone('Asia/Kolkata')
+        # Acquired quota is a hold for this many seconds until the booking confirms it
+        # (None or 0: permanent allocations, freed only by compensation)
+        self.hold_seconds = hold_seconds or None
+        self.ist = IST
+        # Current IST day, cached and rolled over at midnight by QuotaCalendar.run
+        self.today = None
+        self.roll_over()
+        # Eventually consistent "quota exhausted" signal: date -> monotonic time it was marked.
+        # Entries expire after exhausted_ttl so a release seen by another instance is
+        # eventually picked up; the daily_quota row stays authoritative.
+        self.exhausted_ttl = exhausted_ttl
+        self._exhausted = {}
+        # Optional async callback(quota_date) used to broadcast a fresh exhaustion
+        self.on_exhausted = None
+        # Most recent transactions this instance acquired quota for (bounded LRU), so
+        # the exhausted fast path rejects everything else without a database lookup
+        self.acquired_cache_size = acquired_cache_size
+        self._acquired = OrderedDict()
+
+    def roll_over(self):
+        self.today = datetime.now(self.ist).date()
+
+    @property
+    def local_store(self):
+        # Local mock, shared between workers through LOCAL_STATE_DIR
+        if not hasattr(self, '_mock_quota'):
+            self._mock_quota = LocalQuotaStore()
+        return self._mock_quota
+
+    def is_exhausted(self, quota_date: date):
+        marked_at = self._exhausted.get(quota_date)
+        if marked_at is None:
+            return False
+        if time.monotonic() - marked_at > self.exhausted_ttl:
+            del self._exhausted[quota_date]
+            return False
+        return True
+
+    def mark_exhausted(self, quota_date: date):
+        """Returns True if the date was not already known to be exhausted."""
+        fresh = not self.is_exhausted(quota_date)
+        self._exhausted[quota_date] = time.monotonic()
+        return fresh
+
+    def mark_available(self, quota_date: date = None):
+        if quota_date is None:
+            self._exhausted.clear()
+        else:
+            self._exhausted.pop(quota_date, None)
+
+    def _remember_acquired(self, transaction_id: UUID):
+        self._acquired[str(transaction_id)] = None
+        self._acquired.move_to_end(str(transaction_id))
+        if len(self._acquired) > self.acquired_cache_size:
+            self._acquired.popitem(last=False)
+
+    async def _exhausted_result(self, quota_date: date):
+        if self.mark_exhausted(quota_date) and self.on_exhausted:
+            await self.on_exhausted(quota_date)
+        return (False, QUOTA_REACHED_MESSAGE)
     
     async def acquire_quota(self, transaction_id: UUID):
+        today = self.today
+
+        # Fast reject: no database round trip once the day is known to be exhausted.
+        # A redelivered booking.priced this instance acquired for goes on to the
+        # idempotent acquire and gets its original outcome.
+        if self.is_exhausted(today) and str(transaction_id) not in self._acquired:
+            return (False, QUOTA_REACHED_MESSAGE)
+
         # MOCK IMPLEMENTATION FOR LOCAL TESTING
         if os.getenv("PROJECT_ID") == "local-project":
             return await self.acquire_quota_mock(transaction_id)
-
-        # Get today in IST
-        today = datetime.now(self.ist).date()
         
-        # Call database function (handles locking)
+        # Call database function (locks and increments the provisioned day)
+        from sqlalchemy import text
         async with get_db() as db:
             # Note: We must use autocommit or commit explicitly for side effects if not managed by transaction block
             # But the function itself does logic. 
             # In SQLAlchemy async, we execute text.
-            stmt = text("SELECT acquire_quota(:p_date, :p_max, :p_transaction_id)")
+            stmt = text("SELECT acquire_quota(:p_date, :p_max, :p_transaction_id, :p_hold_seconds)")
             result = await db.execute(
                 stmt,
-                {"p_date": today, "p_max": self.max_discounts, "p_transaction_id": transaction_id}
+                {"p_date": today, "p_max": self.max_discounts, "p_transaction_id": transaction_id,
+                 "p_hold_seconds": self.hold_seconds}
             )
             # Commit needed for the INSERT/UPDATE inside the function to persist
             await db.commit()
             acquired = result.scalar()
         
         if acquired:
+            self._remember_acquired(transaction_id)
             return (True, "Quota acquired")
         else:
-            return (False, "Daily discount quota reached. Please try again tomorrow.")
-            
+            return await self._exhausted_result(today)
+
     async def acquire_quota_mock(self, transaction_id: UUID):
-        # Simple in-memory mock
-        today = datetime.now(self.ist).strftime('%Y-%m-%d')
-        if not hasattr(self, '_mock_quota'):
-            self._mock_quota = {} # date -> count
-            self._mock_allocations = set()
-            
-        used = self._mock_quota.get(today, 0)
+        today_date = self.today
+        today = today_date.strftime('%Y-%m-%d')
+
+        acquired, used = self.local_store.acquire(today, self.max_discounts, str(transaction_id), self.hold_seconds)
         
-        if used < self.max_discounts:
-            self._mock_quota[today] = used + 1
-            self._mock_allocations.add(str(transaction_id))
-            print(f"[MOCK DB] Acquired quota for {transaction_id}. Used: {self._mock_quota[today]}/{self.max_discounts}")
+        if acquired:
+            print(f"[MOCK DB] Acquired quota for {transaction_id}. Used: {used}")
+            self._remember_acquired(transaction_id)
             return (True, "Quota acquired")
         else:
-            return (False, "Daily discount quota reached. Please try again tomorrow.")
+            return await self._exhausted_result(today_date)
 
     async def release_quota(self, transaction_id: UUID):
         """Compensation logic"""
         if os.getenv("PROJECT_ID") == "local-project":
-             print(f"[MOCK DB] Released quota for {transaction_id}")
-             # In a real mock we would decrement, but for simplicity just ack
-             return True
+             released = self.local_store.release(str(transaction_id))
+             print(f"[MOCK DB] Released quota for {transaction_id}: {released}")
+             if released:
+                 self.mark_available()
+             return released
 
+        from sqlalchemy import text
         async with get_db() as db:
             stmt = text("SELECT release_quota(:p_transaction_id)")
             result = await db.execute(
@@ -68,5 +140,60 @@ class QuotaManager:
                 {"p_transaction_id": transaction_id}
             )
             await db.commit()
+            released = result.scalar()
+
+        if released:
+            # A slot was freed, stop fast-rejecting until the DB says otherwise
+            self.mark_available()
+        return released
+
+    async def release_quota_batch(self, transaction_ids: list):
+        """Release many allocations in one transaction. Returns the set of ids released."""
+        if os.getenv("PROJECT_ID") == "local-project":
+            released = set(self.local_store.release_many([str(t) for t in transaction_ids]))
+            print(f"[MOCK DB] Released quota for {len(released)}/{len(transaction_ids)} transactions")
+        else:
+            from sqlalchemy import text
+            async with get_db() as db:
+                result = await db.execute(
+                    text("SELECT * FROM release_quota_batch(:p_transaction_ids)"),
+                    {"p_transaction_ids": [UUID(str(t)) for t in transaction_ids]}
+                )
+                released = {str(row[0]) for row in result.fetchall()}
+                await db.commit()
+
+        if released:
+            self.mark_available()
+        return released
+
+    async def confirm_hold(self, transaction_id: UUID):
+        """Make the transaction's hold permanent. False if it expired or was released."""
+        if os.getenv("PROJECT_ID") == "local-project":
+            return self.local_store.confirm(str(transaction_id))
+
+        from sqlalchemy import text
+        async with get_db() as db:
+            result = await db.execute(
+                text("SELECT confirm_quota_hold(:p_transaction_id)"),
+                {"p_transaction_id": transaction_id}
+            )
+            await db.commit()
             return result.scalar()
 
+    async def reap_holds(self, limit: int):
+        """Release up to `limit` expired holds in one transaction. Returns their ids."""
+        if os.getenv("PROJECT_ID") == "local-project":
+            reaped = self.local_store.reap(limit)
+        else:
+            from sqlalchemy import text
+            async with get_db() as db:
+                result = await db.execute(
+                    text("SELECT * FROM reap_quota_holds(:p_limit)"),
+                    {"p_limit": limit}
+                )
+                reaped = [str(row[0]) for row in result.fetchall()]
+                await db.commit()
+
+        if reaped:
+            self.mark_available()
+        return reaped
@@ -0,0 +1,81 @@
+import asyncio
+
+
+class ReleaseBatcher:
+    """
+    Coalesces concurrent quota releases into release_quota_batch calls.
+
+    The first release starts a flush on the next loop iteration; releases arriving
+    while a batch is in flight queue up and go out together in the next one (at
+    most `max_batch` ids per call). A lone compensation is not delayed, and after an
+    incident thousands of compensations take one lock and commit per batch instead
+    of one each. Callers get their own outcome: True if their allocation was
+    released by the batch, False if it was unknown or already released.
+    """
+
+    def __init__(self, quota_manager, max_batch=500):
+        self.quota_manager = quota_manager
+        self.max_batch = max_batch
+        # Optional async callback(released_ids) run once per batch that freed quota
+        self.on_released = None
+        self.batches = 0
+        self.requested = 0
+        self.released = 0
+        self._pending = {}  # transaction_id -> future
+        self._flushing = False
+        self._tasks = set()  # drains in flight, referenced until done
+
+    async def release(self, transaction_id) -> bool:
+        transaction_id = str(transaction_id)
+        future = self._pending.get(transaction_id)
+        if future is None:
+            # A duplicate compensation already queued shares the same outcome
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction_id] = future
+            if not self._flushing:
+                self._flushing = True
+                task = asyncio.create_task(self._drain())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(future)
+
+    async def _drain(self):
+        try:
+            while self._pending:
+                batch = dict(list(self._pending.items())[:self.max_batch])
+                for transaction_id in batch:
+                    del self._pending[transaction_id]
+                await self._flush(batch)
+        finally:
+            self._flushing = False
+        self._tasks = set()  # drains in flight, referenced until done
+
+    async def _flush(self, batch):
+        try:
+            released = await self.quota_manager.release_quota_batch(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.requested += len(batch)
+        self.released += len(released)
+        for transaction_id, future in batch.items():
+            if not future.done():
+                future.set_result(transaction_id in released)
+        if released and self.on_released:
+            try:
+                await self.on_released(released)
+            except Exception as e:
+                print(f"Release callback failed: {e}")
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "requested": self.requested,
+            "released": self.released,
+            "mean_batch": round(self.requested / self.batches, 1) if self.batches else 0
+        }
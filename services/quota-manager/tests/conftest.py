@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Run as the local stack does: `app` importable from the service directory, `common`
+# from services/, local mode, and a throwaway LOCAL_STATE_DIR
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVICE_DIR, os.path.dirname(SERVICE_DIR)]
+os.environ["PROJECT_ID"] = "local-project"
+os.environ["LOCAL_STATE_DIR"] = tempfile.mkdtemp(prefix="quota-manager-tests-")
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import random
+from datetime import date, timedelta
+from uuid import uuid4
+
+import pytest
+
+from app.local_store import LocalQuotaStore
+from app.quota_manager import QuotaManager, QUOTA_REACHED_MESSAGE
+
+# Database with database/schema.sql and functions.sql applied (see test_quota_holds.py)
+TEST_DATABASE_URL = os.getenv("QUOTA_TEST_DATABASE_URL")
+
+
+def test_unprovisioned_day_is_created_with_the_default_cap(tmp_path):
+    store = LocalQuotaStore(str(tmp_path / "quota.db"))
+
+    assert store.acquire("2030-02-01", 2, str(uuid4())) == (True, 1)
+    assert store.acquire("2030-02-01", 2, str(uuid4())) == (True, 2)
+    assert store.acquire("2030-02-01", 2, str(uuid4())) == (False, 2)
+
+
+def test_exhausted_day_rejects_from_memory_and_replays_own_acquires(tmp_path, monkeypatch):
+    manager = QuotaManager(max_discounts=1)
+    manager._mock_quota = LocalQuotaStore(str(tmp_path / "quota.db"))
+    first, second = uuid4(), uuid4()
+
+    async def run():
+        assert await manager.acquire_quota(first) == (True, "Quota acquired")
+        assert await manager.acquire_quota(second) == (False, QUOTA_REACHED_MESSAGE)
+        assert manager.is_exhausted(manager.today)
+
+        calls = []
+        acquire = manager.local_store.acquire
+        monkeypatch.setattr(manager.local_store, "acquire", lambda *a: calls.append(a) or acquire(*a))
+        # Unknown to this instance: rejected without a store lookup
+        assert await manager.acquire_quota(uuid4()) == (False, QUOTA_REACHED_MESSAGE)
+        assert calls == []
+        # Redelivery of its own acquire: the idempotent acquire answers
+        assert await manager.acquire_quota(first) == (True, "Quota acquired")
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="QUOTA_TEST_DATABASE_URL not set")
+def test_concurrent_first_acquires_of_an_unprovisioned_day_both_succeed():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    day = date(2100, 1, 1) + timedelta(days=random.randrange(100000))
+    acquire = text("SELECT acquire_quota(:d, 10, :tid)")
+
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as first, engine.connect() as second:
+                # The first acquire creates the day but has not committed yet...
+                assert (await first.execute(acquire, {"d": day, "tid": uuid4()})).scalar()
+                # ...so the second one's INSERT waits for it and then inserts nothing
+                racing = asyncio.create_task(second.execute(acquire, {"d": day, "tid": uuid4()}))
+                await asyncio.sleep(0.2)
+                assert not racing.done()
+                await first.commit()
+                assert (await racing).scalar()
+                await second.commit()
+
+            async with engine.connect() as conn:
+                used = await conn.execute(text("SELECT discounts_used FROM daily_quota WHERE quota_date = :d"), {"d": day})
+                assert used.scalar() == 2
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(text("DELETE FROM quota_allocations WHERE quota_date = :d"), {"d": day})
+                await conn.execute(text("DELETE FROM daily_quota WHERE quota_date = :d"), {"d": day})
+            await engine.dispose()
+
+    asyncio.run(run())
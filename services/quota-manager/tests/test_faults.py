@@ -0,0 +1,102 @@
+import asyncio
+import base64
+import json
+from uuid import uuid4
+
+import httpx
+
+from app import main
+from common.faults import FaultInjector
+
+
+def push(event):
+    """Wrap an event the way a Pub/Sub push subscription delivers it."""
+    return {"message": {"data": base64.b64encode(json.dumps(event).encode()).decode()}}
+
+
+async def settle(faults):
+    """Wait for the deliveries the injector detached (duplicates, held-back events)."""
+    while faults._tasks:
+        await asyncio.gather(*faults._tasks)
+
+
+def test_duplicated_booking_priced_consumes_quota_once(monkeypatch):
+    published = []
+
+    async def publish_event(event):
+        published.append(event)
+
+    monkeypatch.setattr(main, "publish_event", publish_event)
+    faults = FaultInjector({"routes": {"booking.priced": {"duplicate_rate": 1.0}}})
+    transaction_id = str(uuid4())
+    event = {
+        "event_type": "booking.priced",
+        "transaction_id": transaction_id,
+        "data": {"service_ids": [1], "final_price": 270.0, "discount_eligible": True}
+    }
+
+    async def run():
+        statuses = []
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://quota-manager") as client:
+            async def send(destination, event):
+                resp = await client.post(destination, json=push(event))
+                statuses.append(resp.status_code)
+                resp.raise_for_status()
+
+            await faults.send("/", event, send)
+            await settle(faults)
+            calendar = (await client.get("/quota/calendar", params={"days": 1})).json()
+        return statuses, calendar
+
+    statuses, calendar = asyncio.run(run())
+
+    assert faults.injected["duplicated"] == 1
+    assert statuses == [200, 200]
+    assert calendar[0]["discounts_used"] == 1
+    # The copy gets the outcome of the first delivery, not a second allocation
+    assert [e["event_type"] for e in published] == ["booking.quota.acquired"] * 2
+    assert main.quota_manager.local_store.allocated(transaction_id)
+
+
+def test_failed_held_back_delivery_goes_to_retry_path():
+    faults = FaultInjector({"routes": {"booking.priced": {"reorder_window_ms": 5}}})
+    retried = []
+
+    async def send(destination, event):
+        raise httpx.ConnectError("connection refused")
+
+    async def on_failure(destination, event):
+        retried.append((destination, event["transaction_id"]))
+
+    async def run():
+        await faults.send("/", {"event_type": "booking.priced", "transaction_id": "t1"}, send, on_failure)
+        await settle(faults)
+
+    asyncio.run(run())
+
+    assert retried == [("/", "t1")]
+    assert faults.injected["held_back"] == 1
+    assert faults.injected["reordered"] == 0
+
+
+def test_reordered_counts_only_overtaken_events():
+    faults = FaultInjector({"routes": {"status.changed": {"reorder_window_ms": 20}}})
+    delivered = []
+
+    async def send(destination, event):
+        delivered.append(event["event_type"])
+
+    async def run():
+        # Held back, then overtaken by a later event of the same transaction
+        await faults.send("/", {"event_type": "status.changed", "transaction_id": "t1"}, send)
+        await faults.send("/", {"event_type": "booking.completed", "transaction_id": "t1"}, send)
+        # Held back with nothing behind it
+        await faults.send("/", {"event_type": "status.changed", "transaction_id": "t2"}, send)
+        await settle(faults)
+
+    asyncio.run(run())
+
+    assert delivered[0] == "booking.completed"
+    assert faults.injected["held_back"] == 2
+    assert faults.injected["reordered"] == 1
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import random
+import time
+from datetime import date, timedelta
+from uuid import uuid4
+
+import pytest
+
+from app.local_store import LocalQuotaStore
+
+DAY = "2030-01-15"
+
+# Database with database/schema.sql and functions.sql applied, e.g.
+# postgresql+asyncpg://postgres@/medical_booking_db?host=/tmp/pgdata
+TEST_DATABASE_URL = os.getenv("QUOTA_TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalQuotaStore(str(tmp_path / "quota.db"))
+
+
+def used(store):
+    return store.calendar(DAY, DAY)[0]["discounts_used"]
+
+
+def test_confirmed_hold_is_not_reaped(store):
+    tid = str(uuid4())
+    assert store.acquire(DAY, 10, tid, hold_seconds=60) == (True, 1)
+
+    assert store.confirm(tid)
+    assert store.confirm(tid)  # a redelivered booking confirms again
+    assert store.reap(100) == []
+    assert used(store) == 1
+
+
+def test_expired_hold_cannot_be_confirmed_and_is_reaped(store):
+    kept, expired = str(uuid4()), str(uuid4())
+    store.acquire(DAY, 10, kept, hold_seconds=60)
+    store.acquire(DAY, 10, expired, hold_seconds=0.01)
+    time.sleep(0.05)
+
+    # Expired but not reaped yet: the booking must not get the discount
+    assert not store.confirm(expired)
+    assert store.reap(100) == [expired]
+    assert not store.confirm(expired)
+    assert used(store) == 1
+    # A redelivered booking.priced does not take the quota again
+    assert store.acquire(DAY, 10, expired, hold_seconds=60) == (False, 1)
+
+
+def test_permanent_allocation_confirms_and_is_never_reaped(store):
+    tid = str(uuid4())
+    store.acquire(DAY, 10, tid)
+
+    assert store.reap(100) == []
+    assert store.confirm(tid)
+    assert used(store) == 1
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="QUOTA_TEST_DATABASE_URL not set")
+def test_acquire_confirm_reap_on_postgres():
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    # A far-away day of its own, so the test leaves other rows alone
+    day = date(2100, 1, 1) + timedelta(days=random.randrange(100000))
+    kept, expired = uuid4(), uuid4()
+
+    async def run():
+        engine = create_async_engine(TEST_DATABASE_URL)
+        try:
+            async with engine.connect() as conn:
+                async def execute(sql, **params):
+                    result = await conn.execute(text(sql), params)
+                    await conn.commit()
+                    return result
+
+                async def scalar(sql, **params):
+                    return (await execute(sql, **params)).scalar()
+
+                async def acquire(tid):
+                    return await scalar("SELECT acquire_quota(:d, 10, :tid, 60)", d=day, tid=tid)
+
+                async def confirm(tid):
+                    return await scalar("SELECT confirm_quota_hold(:tid)", tid=tid)
+
+                assert await acquire(kept)
+                assert await acquire(expired)
+                assert await confirm(kept)
+
+                await execute(
+                    "UPDATE quota_allocations SET expires_at = NOW() - INTERVAL '1 second' "
+                    "WHERE transaction_id = :tid", tid=expired
+                )
+                # Expired but not reaped yet: the booking must not get the discount
+                assert not await confirm(expired)
+
+                reaped = (await execute("SELECT reap_quota_holds(100)")).scalars().all()
+                assert expired in reaped and kept not in reaped
+                assert not await confirm(expired)
+                assert not await acquire(expired)
+                assert await scalar("SELECT discounts_used FROM daily_quota WHERE quota_date = :d", d=day) == 1
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(text("DELETE FROM quota_allocations WHERE quota_date = :d"), {"d": day})
+                await conn.execute(text("DELETE FROM daily_quota WHERE quota_date = :d"), {"d": day})
+            await engine.dispose()
+
+    asyncio.run(run())
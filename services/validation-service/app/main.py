@@ -1,27 +1,56 @@
 import base64
 import json
 import os
+import threading
 from datetime import datetime
-from fastapi import FastAPI, Request
-try:
-    from google.cloud import pubsub_v1
-except ImportError:
-    pubsub_v1 = None
+from fastapi import FastAPI, HTTPException, Request
 import asyncio
+from contextlib import asynccontextmanager
+from common.keyed_executor import KeyedExecutor
+from common.delivery import EventDelivery, PUBSUB, delivery_routes
+from common.profiling import profiling_routes
+from app.validation_engine import ValidationEngine
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Outside local mode, build the Pub/Sub client in the background so neither
+    # startup nor the first request waits for it
+    if PROJECT_ID != "local-project":
+        asyncio.get_running_loop().run_in_executor(None, get_publisher)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
 
 # Configuration
 PROJECT_ID = os.getenv("PROJECT_ID", "local-project")
 TOPIC_ID = os.getenv("TOPIC_ID", "booking-events")
 
-# Pub/Sub Publisher
-if pubsub_v1:
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
-else:
-    publisher = None
-    topic_path = None
+# Pub/Sub Publisher, created on first use (or warmed up in the background at startup):
+# importing google.cloud.pubsub_v1 and building the client dominates cold start time
+publisher = None
+topic_path = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    global publisher, topic_path
+    with _publisher_lock:
+        if publisher is None:
+            from google.cloud import pubsub_v1
+            publisher = pubsub_v1.PublisherClient()
+            topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+    return publisher, topic_path
+
+# Per-transaction ordered event delivery
+executor = KeyedExecutor(int(os.getenv("EVENT_CONCURRENCY", "100")))
+
+# Retrying event delivery with circuit breakers and a dead-letter store
+delivery = EventDelivery.from_env("validation-service", get_publisher)
+app.include_router(delivery_routes(delivery))
+app.include_router(profiling_routes("validation-service"))
 
 async def publish_event(event_data: dict):
     if PROJECT_ID == "local-project":
@@ -34,58 +63,46 @@ async def publish_event(event_data: dict):
         elif event_type == "booking.validated":
              target_url = "http://127.0.0.1:8082/"
              # Also send to Orchestrator for tracking
-             asyncio.create_task(send_local_event("http://127.0.0.1:8084/", event_data))
+             schedule_local_event("http://127.0.0.1:8084/", event_data)
              
         if target_url:
-            import httpx
-            asyncio.create_task(send_local_event(target_url, event_data))
+            schedule_local_event(target_url, event_data)
         return
         
-    data_str = json.dumps(event_data)
-    data_bytes = data_str.encode("utf-8")
-    future = publisher.publish(
-        topic_path, 
-        data_bytes, 
-        event_type=event_data.get("event_type", "unknown"),
-        transaction_id=event_data.get("transaction_id", "")
-    )
-    future.result()
+    # Retried with backoff, dead-lettered if Pub/Sub stays unavailable
+    await delivery.deliver(PUBSUB, event_data)
+
+def schedule_local_event(url, data):
+    # Deliveries for the same transaction go out in order, one at a time
+    executor.submit(data.get("transaction_id"), lambda: send_local_event(url, data))
 
 async def send_local_event(url, data):
-    import httpx
-    try:
-        # Simulate Pub/Sub message format
-        payload = {
-            "message": {
-                "data": base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"),
-                "attributes": {
-                    "event_type": data.get("event_type")
-                }
-            }
-        }
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json=payload)
-    except Exception as e:
-        print(f"Failed to send local event to {url}: {e}")
-
-
-async def get_services_by_ids(service_ids: list):
-    # Mock data - ideally shares a common lib or calls a DB
-    all_services = {
-        1: {'id': 1, 'name': 'General Consultation', 'gender': 'both', 'base_price': 300.00},
-        2: {'id': 2, 'name': 'Gynecology', 'gender': 'female', 'base_price': 500.00},
-        3: {'id': 3, 'name': 'Ultrasound', 'gender': 'female', 'base_price': 800.00},
-        4: {'id': 4, 'name': 'Blood Test', 'gender': 'both', 'base_price': 450.00},
-        5: {'id': 5, 'name': 'Cardiology', 'gender': 'both', 'base_price': 600.00},
-        6: {'id': 6, 'name': 'Urology', 'gender': 'male', 'base_price': 550.00},
-        7: {'id': 7, 'name': 'Prostate Screening', 'gender': 'male', 'base_price': 700.00},
-        8: {'id': 8, 'name': 'Dermatology', 'gender': 'both', 'base_price': 400.00},
-    }
-    # Return objects with dot notation access to match spec code
-    class ServiceObj:
-        def __init__(self, d):
-            self.__dict__ = d
-    return [ServiceObj(all_services[sid]) for sid in service_ids if sid in all_services]
+    # Retried with backoff, dead-lettered if the service stays unavailable
+    await delivery.deliver(url, data)
+
+
+# Catalog compiled once into per-gender eligibility bitmasks
+engine = ValidationEngine()
+MAX_BATCH = int(os.getenv("VALIDATION_BATCH_MAX", "1000"))
+
+@app.post("/validate/batch")
+async def validate_batch(request: Request):
+    """
+    Validates many bookings without starting sagas (bulk imports, client pre-checks).
+    Body: {"bookings": [{user_name, user_gender, user_dob, service_ids}, ...]}
+    """
+    body = await request.json()
+    bookings = body.get("bookings") if isinstance(body, dict) else None
+    if not isinstance(bookings, list):
+        raise HTTPException(status_code=400, detail="Body must be {\"bookings\": [...]}")
+    if len(bookings) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH} bookings per batch")
+
+    results = []
+    for booking in bookings:
+        errors = engine.validate(booking) if isinstance(booking, dict) else ["Booking must be an object"]
+        results.append({"valid": not errors, "errors": errors})
+    return {"results": results, "valid": sum(r["valid"] for r in results), "invalid": sum(not r["valid"] for r in results)}
 
 @app.post("/")
 async def receive_event(request: Request):
@@ -114,22 +131,8 @@ async def handle_booking_initiated(event: dict):
     transaction_id = event['transaction_id']
     data = event['data']
     
-    # Validate user data
-    errors = []
-    
-    if not data.get('user_name'):
-        errors.append("Name required")
-    
-    if data.get('user_gender') not in ['male', 'female']:
-        errors.append("Invalid gender")
-    
-    # Validate services exist and match gender
-    services = await get_services_by_ids(data['service_ids'])
-    user_gender = data['user_gender']
-    
-    for svc in services:
-        if svc.gender not in [user_gender, 'both']:
-            errors.append(f"Service '{svc.name}' not available for {user_gender}")
+    # Validate user data and services in one pass, collecting every error
+    errors = engine.validate(data)
     
     # Publish result
     if errors:
@@ -0,0 +1,82 @@
+GENDERS = ("male", "female")
+
+# Mock data - ideally shares a common lib or calls a DB
+SERVICES = (
+    {'id': 1, 'name': 'General Consultation', 'gender': 'both', 'base_price': 300.00},
+    {'id': 2, 'name': 'Gynecology', 'gender': 'female', 'base_price': 500.00},
+    {'id': 3, 'name': 'Ultrasound', 'gender': 'female', 'base_price': 800.00},
+    {'id': 4, 'name': 'Blood Test', 'gender': 'both', 'base_price': 450.00},
+    {'id': 5, 'name': 'Cardiology', 'gender': 'both', 'base_price': 600.00},
+    {'id': 6, 'name': 'Urology', 'gender': 'male', 'base_price': 550.00},
+    {'id': 7, 'name': 'Prostate Screening', 'gender': 'male', 'base_price': 700.00},
+    {'id': 8, 'name': 'Dermatology', 'gender': 'both', 'base_price': 400.00},
+)
+
+
+def is_service_id(value):
+    # Batch input is raw JSON: ids may be anything, including unhashable lists and dicts
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class ValidationEngine:
+    """
+    Booking validation compiled once from the service catalog.
+
+    Every service id gets a bit; each gender gets the bitmask of the services it may
+    book. Validating a booking is one pass over its service ids (unknown and
+    duplicate ids are reported there) followed by a single mask test for gender
+    eligibility, and every error is reported, not just the first.
+    """
+
+    def __init__(self, services=SERVICES):
+        self.bits = {}
+        self.names = {}
+        self.allowed = {gender: 0 for gender in GENDERS}
+        for position, service in enumerate(services):
+            bit = 1 << position
+            self.bits[service['id']] = bit
+            self.names[service['id']] = service['name']
+            for gender in GENDERS:
+                if service['gender'] in (gender, 'both'):
+                    self.allowed[gender] |= bit
+
+    def validate(self, data: dict) -> list:
+        """Returns the list of errors, empty when the booking is valid."""
+        errors = []
+
+        if not data.get('user_name'):
+            errors.append("Name required")
+
+        user_gender = data.get('user_gender')
+        allowed = self.allowed.get(user_gender) if isinstance(user_gender, str) else None
+        if allowed is None:
+            errors.append("Invalid gender")
+
+        service_ids = data.get('service_ids')
+        if not isinstance(service_ids, list) or not service_ids:
+            errors.append("At least one service required")
+            return errors
+
+        requested = duplicated = 0
+        for service_id in service_ids:
+            if not is_service_id(service_id):
+                errors.append(f"Invalid service id {service_id!r}")
+                continue
+            bit = self.bits.get(service_id)
+            if bit is None:
+                errors.append(f"Unknown service id {service_id}")
+            elif requested & bit:
+                if not duplicated & bit:
+                    errors.append(f"Service '{self.names[service_id]}' requested more than once")
+                duplicated |= bit
+            else:
+                requested |= bit
+
+        if allowed is not None and requested & ~allowed:
+            for service_id in service_ids:
+                bit = self.bits.get(service_id) if is_service_id(service_id) else None
+                if bit is not None and bit & requested & ~allowed:
+                    errors.append(f"Service '{self.names[service_id]}' not available for {user_gender}")
+                    requested &= ~bit
+
+        return errors
@@ -0,0 +1,55 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+client = TestClient(app)
+
+VALID = {"user_name": "Asha", "user_gender": "female", "user_dob": "1990-05-01", "service_ids": [1, 2]}
+
+
+def validate_batch(bookings):
+    resp = client.post("/validate/batch", json={"bookings": bookings})
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_batch_reports_malformed_items_without_failing():
+    result = validate_batch([
+        VALID,
+        {**VALID, "service_ids": [[1], {"id": 2}, "3", True, None]},
+        {**VALID, "user_gender": ["female"]},
+        {**VALID, "service_ids": "1,2"},
+        "not a booking",
+        None,
+    ])
+
+    assert result["valid"] == 1
+    assert result["invalid"] == 5
+    valid, bad_ids, bad_gender, bad_list, text, null = result["results"]
+    assert valid == {"valid": True, "errors": []}
+    assert bad_ids["errors"] == [
+        "Invalid service id [1]",
+        "Invalid service id {'id': 2}",
+        "Invalid service id '3'",
+        "Invalid service id True",
+        "Invalid service id None",
+    ]
+    assert bad_gender["errors"] == ["Invalid gender"]
+    assert bad_list["errors"] == ["At least one service required"]
+    assert text["errors"] == null["errors"] == ["Booking must be an object"]
+
+
+def test_batch_keeps_reporting_other_errors_next_to_malformed_ids():
+    result = validate_batch([{**VALID, "user_gender": "male", "service_ids": [2, [2], 2, 99]}])
+
+    assert result["results"][0]["errors"] == [
+        "Invalid service id [2]",
+        "Service 'Gynecology' requested more than once",
+        "Unknown service id 99",
+        "Service 'Gynecology' not available for male",
+    ]
+
+
+def test_batch_body_must_hold_a_list():
+    assert client.post("/validate/batch", json={"bookings": {"user_name": "Asha"}}).status_code == 400
+    assert client.post("/validate/batch", json=[VALID]).status_code == 400